@@ -6,7 +6,6 @@ http://gamma-astro-data-formats.readthedocs.io/en/latest/skymaps/healpix/index.h
 """
 import os, glob, StringIO
 import healpy
-from collections import Counter 
 import numpy as np
 from astropy.io import fits
 import pandas as pd
@@ -52,6 +51,16 @@ def roi_circle(roi_index, galactic=True, radius=5.0):
     return (sdir.l(),sdir.b(), radius) if galactic else (sdir.ra(),sdir.dec(), radius)
 
 
+def sum_by_key(keys, counts):
+    """return (keys, counts) with the counts for equal keys summed, sorted by key
+    """
+    order = keys.argsort(kind='mergesort')
+    keys, counts = keys[order], counts[order]
+    if len(keys)==0: return keys, counts
+    first = np.flatnonzero(np.concatenate([[True], keys[1:]!=keys[:-1]]))
+    return keys[first], np.add.reduceat(counts, first)
+
+
 class GTI(object):
     def __init__(self, gti_hdu):
         self.hdu=gti_hdu
@@ -59,9 +68,9 @@ class GTI(object):
         self.start=data.START
         self.stop =data.STOP
 
-    def add(self, other):
-        self.start=np.hstack([self.start, other.start])
-        self.stop =np.hstack([self.stop, other.stop])
+    def add(self, *others):
+        self.start=np.hstack([self.start]+[other.start for other in others])
+        self.stop =np.hstack([self.stop]+[other.stop for other in others])
         g = self.hdu
         g.columns['START'].array=self.start
         g.columns['STOP'].array = self.stop
@@ -143,90 +152,77 @@ class Pixels(object):
         if pixel_count is not None:
             # old format: make a list of channel numbers from the bands HDU
             # the old list of pixels was sorted by channel
-            chn= []
-            for i,c in enumerate(pixel_count):
-                if c<0: continue
-                chn = chn + [i]*c 
             self.pix = pixeldata.field('INDEX')
             self.cnt = pixeldata.field('COUNT')
-            self.chn = np.array(chn,int)
+            self.chn = np.repeat(np.arange(len(pixel_count)), np.maximum(pixel_count,0))
         else:
             # read new format
             self.chn = pixeldata.field('CHANNEL')  # band index
             self.pix = pixeldata.field('PIX')     # pixel index (depends on channel)
             self.cnt = pixeldata.field('VALUE')   # number of photons in bin
         
-        self.counter = None
         self._sorted = False
 
-    def _make_counter(self):
-        # Make a Counter, with keys combined from channel and pixel id
-        if self.counter is None:
-            chn = np.array(self.chn,int) # convert to int for shift
-            keys = list(np.left_shift(chn,32) + self.pix)
-            self.counter = Counter(dict(zip(keys, self.cnt)))
-        return self.counter
- 
-    def add(self, other):
-        """combind the current list of pixels with another
-        other : Pixels object
+    def keys(self):
+        """array of keys combined from channel and pixel id, with the order of (channel, pixel)"""
+        return np.left_shift(np.asarray(self.chn, np.int64), 32) + np.asarray(self.pix, np.int64)
+
+    def add(self, *others):
+        """combine the current list of pixels with others
+        others : Pixels objects
         """
-        # combine the pixels by updating the Counter dictionary-like objects
-        self._make_counter() # create local Counter only if adding another
-        self.counter.update(other._make_counter())
-    
-    def _decode_counter(self):
-        # Update the three arrays following adding another set of data
-        assert self.counter is not None, 'logic failure'
-        items = np.array(self.counter.items(), int)
-        keys = items[:,0]
+        # sort all the keys together, and sum the counts for each distinct key
+        allpix = (self,)+others
+        keys, self.cnt = sum_by_key(np.concatenate([p.keys() for p in allpix]),
+            np.concatenate([np.asarray(p.cnt, np.int64) for p in allpix]))
         self.chn = np.right_shift(keys,32)
         self.pix = np.bitwise_and(keys, 2**32-1)
-        self.cnt = items[:,1]
+        self._set_lookup()
+
+    def _sort(self):
+        # sort the list of pixels according to channel number (band), then pixel
+        if self._sorted: return
+        csort = np.lexsort((self.pix, self.chn))
+        self.chn = self.chn[csort]
+        self.pix = self.pix[csort]
+        self.cnt = self.cnt[csort]
+        self._set_lookup()
+
+    def _set_lookup(self):
+        # create a lookup dictionary with limits for the pixel and count lists
+        channels = np.unique(self.chn)
+        indexchan = list(np.searchsorted(self.chn, channels))+[len(self.chn)]
+        self.lookup = dict(zip(channels,zip(indexchan[:-1], indexchan[1:])))
+        self._sorted = True
 
     def dataframe(self):
         """return a DataFrame with number of pixels and photons per band
         """
-        if self.counter is not None:
-            self._decode_counter()
-        channels = sorted(list(set(self.chn))); 
+        self._sort()
         d = dict()
-        for channel in channels:
-            c = self.cnt[self.chn==channel]
-            d[channel] = {'pixels': len(c), 'photons': sum(c)}
+        for channel, (a,b) in self.lookup.items():
+            d[channel] = {'pixels': b-a, 'photons': self.cnt[a:b].sum()}
         df = pd.DataFrame(d).T[['pixels', 'photons']]
         df.index.name='band'
         return df
 
+    def channel(self, channel):
+        """return (pixel, count) arrays for the band, sorted by pixel: views, not copies
+        """
+        self._sort()
+        a,b = self.lookup.get(channel, (0,0))
+        return self.pix[a:b], self.cnt[a:b]
+
     def __getitem__(self, channel):
         """return a list of (pixel, count) pairs for the band 
         """
-        if not self._sorted:
-            if self.counter is not None:
-                self._decode_counter()
-            # sort the list of pixels according to channel number (band)
-            # create a lookup dictionary with limits for the pixel and count lists
-            csort = self.chn.argsort()
-            self.chn = self.chn[csort]
-            self.pix = self.pix[csort]
-            self.cnt = self.cnt[csort]
-            channels = sorted(list(set(self.chn)))
-            indexchan = list(np.searchsorted(self.chn, channels))+[len(self.chn)]
-            self.lookup = dict(zip(channels,zip(indexchan[:-1], indexchan[1:])))
-            self._sorted = True
-        try:
-            a,b = self.lookup[channel]
-            return zip(self.pix[a:b], self.cnt[a:b])
-        except KeyError:
-            return [] # empty list of no entry
+        return zip(*self.channel(channel))
 
     def make_hdu(self):
         """ create a new HDU in new format
             
         """
-        if self.counter is not None:
-            # needed it result of combining
-            self._decode_counter()
+        self._sort()
         skymap_cols = [
             fits.Column(name='PIX', format='J',    array=self.pix),
             fits.Column(name='CHANNEL', format='I',array=self.chn),
@@ -242,15 +238,44 @@ class Pixels(object):
             AXCOLS='E_MIN,E_MAX',
             )
         return skymap_hdu
+
+    def write_store(self, path):
+        """ write the columns, sorted by channel and pixel, and the channel offset index, to
+        .npy files in the folder path, to be memory-mapped by PixelStore
+        """
+        self._sort()
+        nchan = max(self.lookup.keys())+1 if len(self.lookup)>0 else 0
+        offsets = np.searchsorted(self.chn, np.arange(nchan+1))
+        np.save(os.path.join(path, 'pix.npy'), np.asarray(self.pix, np.int32))
+        np.save(os.path.join(path, 'cnt.npy'), np.asarray(self.cnt, np.int32))
+        np.save(os.path.join(path, 'offsets.npy'), np.asarray(offsets, np.int64))
     
     def __repr__(self):
-        if self.counter is not None:
-            npix, nphot = len(self.counter), sum(self.counter.values())
-        else:
-            npix, nphot = len(self.cnt), sum(self.cnt)
+        npix, nphot = len(self.cnt), np.sum(self.cnt)
         return '{}: {:,} pixels, {:,} photons'.format(self.__class__, npix, nphot) 
 
 
+class PixelStore(Pixels):
+    """The list of pixels from the columnar store written by Pixels.write_store.
+    The pixel and count columns are memory-mapped; the channel offsets are the lookup index.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.pix = np.load(os.path.join(path, 'pix.npy'), mmap_mode='r')
+        self.cnt = np.load(os.path.join(path, 'cnt.npy'), mmap_mode='r')
+        offsets = np.load(os.path.join(path, 'offsets.npy'))
+        self.lookup = dict((c, (a,b)) for c, (a,b) in enumerate(zip(offsets[:-1], offsets[1:])) if b>a)
+        self._sorted = True
+
+    def __getattr__(self, name):
+        # the channel column is only needed to add, or to write FITS: generate it from the lookup
+        if name!='chn': raise AttributeError(name)
+        chn = np.zeros(len(self.pix), np.int16)
+        for c, (a,b) in self.lookup.items():
+            chn[a:b] = c
+        self.chn = chn
+        return chn
+
     
 class BinFile(object):
     """ A Binned photon data file
@@ -263,28 +288,40 @@ class BinFile(object):
         """
         filenames : a FITS file name, or a list
             if a list, combine them
+            A folder name is interpreted as a store written by write_store
         outfile : filename | Null [default]
             write the corresponding fits file
         """
         if not hasattr(filenames, '__iter__'):
             filenames = [filenames]
+        others = []
         for i,filename in enumerate(filenames):
             if i==0: # first one: will add others, if any to this one
                 print '\n"{}" '.format(filename),
-                self.hdus=fits.open(filename)
-                self.gti=GTI(self.hdus['GTI'])
-                if 'PIXELS' in self.hdus: 
-                    # old format
+                if os.path.isdir(filename):
+                    # columnar store: header file, memory-mapped pixels
+                    self.hdus=fits.open(os.path.join(filename, 'header.fits'))
+                    self.gti=GTI(self.hdus['GTI'])
                     self.bands=BandList(self.hdus['BANDS'])
-                    self.pixels=Pixels(self.hdus['PIXELS'], self.bands.pixelcnt)
+                    self.pixels=PixelStore(filename)
                 else:
-                    # new format
+                    self.hdus=fits.open(filename)
+                    self.gti=GTI(self.hdus['GTI'])
                     self.bands=BandList(self.hdus['BANDS'])
-                    self.pixels=Pixels(self.hdus['SKYMAP'])
+                    if 'PIXELS' in self.hdus: 
+                        # old format
+                        self.pixels=Pixels(self.hdus['PIXELS'], self.bands.pixelcnt)
+                    else:
+                        # new format
+                        self.pixels=Pixels(self.hdus['SKYMAP'])
                 print self.pixels.__repr__(),
             else:
-                self.add(BinFile(filename, adding=True))
-                print self.pixels.__repr__(),
+                others.append(BinFile(filename, adding=True))
+                print others[-1].pixels.__repr__(),
+        if len(others)>0:
+            # merge all the others at once, with a single sort
+            self.add(*others)
+            print '\ncombined: {}'.format(self.pixels.__repr__()),
         if not adding: print
 
         if outfile is not None:
@@ -310,18 +347,18 @@ class BinFile(object):
         b = self.bands[index]
         bb = Band(int(b.nside), int(b.event_type), b.e_min, b.e_max, 0,0)
         # this is an unfortunate loop: need to consider an interface for adding a set of pixels
-        for pix, cnt in self.pixels[index]:
+        for pix, cnt in zip(*self.pixels.channel(index)):
             bb.add(int(pix), int(cnt))
         return bb
 
     def __len__(self): return len(self.bands.bands)
 
-    def add(self, other):
-        """ other : BinFile object
+    def add(self, *others):
+        """ others : BinFile objects
         """
-        # combine the pixel and GTI arrays
-        self.pixels.add(other.pixels)
-        self.gti.add(other.gti)
+        # combine the pixel and GTI arrays, all together
+        self.pixels.add(*[other.pixels for other in others])
+        self.gti.add(*[other.gti for other in others])
 
     def dataframe(self):
         """return a DataFrame with Band info and Pixel summary
@@ -353,37 +390,41 @@ class BinFile(object):
         fits.HDUList(hdus).writeto(filename, clobber=clobber)
         print 'wrote file {}'.format(filename)
 
+    def write_store(self, path):
+        """write to a folder in the columnar format: a FITS file with the primary, BANDS and GTI HDUs,
+        and the pixel columns and channel index, see Pixels.write_store. Read it back with BinFile(path)
+        """
+        if not os.path.exists(path): os.makedirs(path)
+        hdus=[self.hdus[0], self.bands.make_hdu(), self.gti.make_hdu()]
+        fits.HDUList(hdus).writeto(os.path.join(path, 'header.fits'), clobber=True)
+        self.pixels.write_store(path)
+        print 'wrote store {}'.format(path)
+
     def photonCount(self):
         """ method to be consistent with skymaps.BinnedPhotonData
         """
-        return sum(self.pixels.cnt)    
+        return np.sum(self.pixels.cnt)    
 
     def roi_subset(self,  roi_number, channel, radius=5):
         """Return a tuple:
             (l,b,radius), nside, DataFrame with data values for the HEALPix pixels within the pointlike ROI
         Creates empty pixels if no data in the pixel (input is sparse, output not)
         """
-        skymap = self.hdus['SKYMAP'].data
-        nside = self.hdus['BANDS'].data.NSIDE[channel]
+        nside = self.bands.dataframe().nside[channel]
         
-        # select pixels for the given channel
-        def select_pixels(channel):
-            sel = skymap.CHANNEL==channel
-            return pd.DataFrame( np.array(skymap.VALUE[sel], int), index=np.array(skymap.PIX[sel],int), columns=['value'])
-
-
         # the set of pixels in an ROI
         def qdisk(nside, glon, glat, radius):
             return healpy.query_disc(nside, healpy.dir2vec(glon,glat,lonlat=True), np.radians(radius))
         pix=qdisk(nside, *roi_circle(roi_number) )
-        roi_pix = pd.DataFrame(np.zeros_like(pix), index=pix, columns=['value'])
-        data_pix = select_pixels(channel)
-        data_in_roi=list(set(data_pix.index).intersection(set(roi_pix.index)))
-        print 'Found {} nside={} data pixels for channel {} in ROI {}'.format(len(data_in_roi),nside, channel, roi_number)
-        z = data_pix.loc[data_in_roi]
-        data_pix_in_roi = data_pix.loc[data_in_roi]
-        roi_pix.value = z.value
-        roi_pix[pd.isnull(roi_pix.value)]=0
+
+        # look up the ROI pixels in the sorted pixels for the given channel
+        data_pix, data_cnt = self.pixels.channel(channel)
+        i = np.minimum(np.searchsorted(data_pix, pix), max(len(data_pix)-1,0))
+        found = data_pix[i]==pix if len(data_pix)>0 else np.zeros(len(pix), bool)
+        values = np.zeros(len(pix), int)
+        values[found] = data_cnt[i[found]]
+        print 'Found {} nside={} data pixels for channel {} in ROI {}'.format(sum(found),nside, channel, roi_number)
+        roi_pix = pd.DataFrame(values, index=pix, columns=['value'])
         return roi_circle(roi_number, galactic=False), nside, roi_pix
 
     def write_roi_fits(self, filename, roi_number, channel, radius=5, clobber=True):
@@ -458,6 +499,8 @@ class BinFile(object):
                 self.write_roi_fits(fname, roi_index, cindex)
 
 class ConvertFT1(object):
+    """ Bin the events from one or more FT1 files, which are read in chunks of chunk_size events
+    """
 
     defaults=(
         # ('ebins', np.hstack([np.logspace(2,4.5, 11), np.logspace(5,6,3)]),'Energy bin array'),
@@ -467,22 +510,16 @@ class ConvertFT1(object):
         ('etypes', (0,1), 'event type index'),
         ('theta_cut', 66.4, 'Maximum instrument theta'),
         ('z_cut', 100, 'Maximum zenith angle'),
+        ('chunk_size', 1000000, 'Number of events to read at a time'),
     )
 
     @keyword_options.decorate(defaults)
     def __init__(self, ft1_file,  **kwargs):
-        """
+        """ft1_file : a FT1 file name, or a list
         """
         keyword_options.process(self, kwargs)
-        self.ft1_hdus=ft1 = fits.open(ft1_file);
-
-        # extract arrays for values of interest
-        data =ft1['EVENTS'].data
-        self.glon, self.glat, self.energy, self.et, self.z, self.theta =\
-             [data[x] for x in 'L B ENERGY EVENT_TYPE ZENITH_ANGLE THETA'.split()]
-        self.front = np.array([x[-1] for x in self.et],bool) # et is arrray of array of bool, last one true if Front
-        self.data_cut = np.logical_and(self.theta<self.theta_cut, self.z<self.z_cut)
-        print 'Found {} events. Removed: {:.2f} %'.format(len(data), 100.- 100*sum(self.data_cut)/float(len(data)));
+        self.ft1_files = ft1_file if hasattr(ft1_file, '__iter__') else [ft1_file]
+        self.ft1_hdus = fits.open(self.ft1_files[0]) # for the primary header
 
         # DataFrame with component values for energy and event type, nside
         t = {}
@@ -493,39 +530,83 @@ class ConvertFT1(object):
                 t[2*ie+et]= dict(ie=ie, event_type=et, nside=nside)
         self.df = pd.DataFrame(t).T
 
+    def events(self, columns):
+        """generate lists of arrays of the columns for successive chunks of events from the FT1 files
+        """
+        for filename in self.ft1_files:
+            hdus = fits.open(filename, memmap=True)
+            data = hdus['EVENTS'].data
+            for i in range(0, len(data), self.chunk_size):
+                chunk = data[i:i+self.chunk_size]
+                yield [np.array(chunk[x]) for x in columns]
+            hdus.close()
+
     def cuthist(self):
         import matplotlib.pyplot  as plt
         # plot effect of cuts on theta and zenith angle
+        tbins, zbins = np.linspace(0,90,46), np.linspace(0,120,61)
+        th, zh = np.zeros(len(tbins)-1), np.zeros(len(zbins)-1)
+        for theta, z in self.events(['THETA', 'ZENITH_ANGLE']):
+            th += np.histogram(theta, tbins)[0]
+            zh += np.histogram(z, zbins)[0]
         fig, axx = plt.subplots(1,2, figsize=(12,5))
         ax = axx[0]
-        ax.hist(self.theta, np.linspace(0,90,46));
+        ax.hist(tbins[:-1], tbins, weights=th);
         ax.axvline(self.theta_cut, color='red');
         ax.set(xlabel='theta')
         ax = axx[1]
-        ax.hist(self.z, np.linspace(0,120,61));
+        ax.hist(zbins[:-1], zbins, weights=zh);
         ax.axvline(self.z_cut, color='red');
         ax.set(xlabel='zenith angle')
 
     def binner(self, quiet=True):
-        # digitize energy: 0 is first bin above 100 MeV, -1 the underflow.
-        eindex = np.digitize(self.energy, self.ebins)-1
-        self.pix=[]; self.chn=[];  self.cnt=[]
-
-        if not quiet: print ' ie  et  nside  photons     bins'
-        for i,band in self.df.iterrows():
-            if not quiet:
+        # nside for each channel, zero if not used
+        nchan = 2*(len(self.ebins)-1)
+        chan_nside = np.zeros(nchan, int)
+        chan_nside[np.array(self.df.index, int)] = self.df.nside
+        # the (key, count) arrays of the chunks are summed only when they outnumber the keys already
+        # summed, so each key is sorted a number of times logarithmic, not linear, in the chunks
+        keys, counts = np.zeros(0, np.int64), np.zeros(0, np.int64)
+        pending, npending = [], 0
+        def reduce(keys, counts, pending):
+            return sum_by_key(np.concatenate([keys]+[p[0] for p in pending]), 
+                np.concatenate([counts]+[p[1] for p in pending]))
+        nevents = nkept = 0
+        for glon, glat, energy, et, z, theta in self.events('L B ENERGY EVENT_TYPE ZENITH_ANGLE THETA'.split()):
+            nevents += len(energy)
+            data_cut = np.logical_and(theta<self.theta_cut, z<self.z_cut)
+            nkept += np.sum(data_cut)
+            # digitize energy: 0 is first bin above 100 MeV, -1 the underflow.
+            eindex = np.digitize(energy, self.ebins)-1
+            front = et[:,-1] # et is arrray of array of bool, last one true if Front
+            chn = 2*eindex + np.where(front, 0, 1)
+            sel = data_cut & (eindex>=0) & (eindex<len(self.ebins)-1)
+            sel[sel] = chan_nside[chn[sel]]>0
+            chn, glon, glat = chn[sel], glon[sel], glat[sel]
+
+            # HEALPix index, for each distinct nside
+            nside = chan_nside[chn]
+            pix = np.zeros(len(chn), np.int64)
+            for n in np.unique(nside):
+                m = nside==n
+                pix[m] = healpy.ang2pix(int(n), glon[m], glat[m], nest=False, lonlat=True)
+            k, c = np.unique(np.left_shift(chn.astype(np.int64), 32)+pix, return_counts=True)
+            pending.append((k, c)); npending += len(k)
+            if npending > len(keys):
+                keys, counts = reduce(keys, counts, pending)
+                pending, npending = [], 0
+        keys, counts = reduce(keys, counts, pending)
+        print 'Found {} events. Removed: {:.2f} %'.format(nevents, 100.- 100*nkept/float(max(nevents,1)))
+
+        self.chn = np.right_shift(keys, 32)
+        self.pix = np.bitwise_and(keys, 2**32-1)
+        self.cnt = counts
+        if not quiet:
+            print ' ie  et  nside  photons     bins'
+            for i,band in self.df.iterrows():
+                sel = self.chn==i
                 print '{:3} {:3} {:6}'.format( band.ie, band.event_type, band.nside), 
-            esel = np.logical_and(eindex==band.ie, self.data_cut)
-            sel = np.logical_and(esel, self.front if band.event_type==0 else np.logical_not(self.front))
-            glon_sel = self.glon[sel]
-            glat_sel = self.glat[sel]
-            hpindex = healpy.ang2pix(int(band.nside), glon_sel, glat_sel, nest=False, lonlat=True)
-            a,b = np.array(np.unique(hpindex, return_counts=True))
-            self.pix+=list(a)
-            self.cnt+=list(b)
-            self.chn+=[i]*len(a)
-            if not quiet:
-                print '{:8} {:8}'.format(sum(sel), len(a))
+                print '{:8} {:8}'.format(sum(self.cnt[sel]), sum(sel))
 
     def create_fits(self, outfile='test.fits', clobber=True):
         elow, ehigh = self.ebins[:-1], self.ebins[1:]
@@ -554,7 +635,10 @@ class ConvertFT1(object):
             BANDSHDU='BANDS',
             AXCOLS='E_MIN,E_MAX',
                     )
-        # add the GTI from the FT1 file and write it out
-        hdus = [self.ft1_hdus[0],  skymap_hdu, bands_hdu, self.ft1_hdus['GTI']]
+        # add the GTI from the FT1 files and write it out
+        gti = GTI(self.ft1_hdus['GTI'])
+        for filename in self.ft1_files[1:]:
+            gti.add(GTI(fits.open(filename)['GTI']))
+        hdus = [self.ft1_hdus[0],  skymap_hdu, bands_hdu, gti.make_hdu()]
         fits.HDUList(hdus).writeto(outfile, clobber=clobber)
 
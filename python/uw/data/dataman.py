@@ -163,6 +163,8 @@ class DataSpec(object):
         ('use_weighted_livetime',True,'if True, calculate the weighted livetime for use in livetime-dependent corrections to the effective area'),
         ('livetime_buffer',10,'radius in degrees by which livetime cube cone is larger than ROI cone'),
         ('livetime_pixelsize',1,'pixel size to use for livetime calculation'),
+        ('livetime_processes',0,'if >0, compute the livetime cube with uw.data.livetime, processing\n'\
+                                'this many FT2 files in parallel, instead of skymaps.LivetimeCube'),
         ('exposure_cube', None, 'if set, file names of a pair of exposure cubes genertated by gtexpcube2'\
                                 'override use of ltcube'),
         ('data_name', '', 'descriptive name for the data set'),
@@ -526,30 +528,33 @@ class DataSpec(object):
                 print 'Constructing all-sky livetime cube'
             else:
                 print('Constructing livetime cube about RA,Dec = ({0:0.3f},{1:0.3f}) with a radius of {2:0.3f} deg.'.format(roi_dir.ra(),roi_dir.dec(),exp_radius))
-        for i in xrange(1+self.use_weighted_livetime):
-            #print('on iteration {0}'.format(i))
-            sys.stdout.flush()
-            lt = skymaps.LivetimeCube(
-                cone_angle =exp_radius,
-                dir        =roi_dir,
-                zcut       =np.cos(np.radians(zenithcut)),
-                pixelsize  =self.livetime_pixelsize,
-                quiet      =self.quiet,
-                weighted   =i)
-
-            for hf in self.ft2files:
-                if not self.quiet: print('checking FT2 file {0}...'.format(hf)),
-                lt_gti = skymaps.Gti(hf,'SC_DATA')
-                if not ((lt_gti.maxValue() < self.gti.minValue()) or
-                        (lt_gti.minValue() > self.gti.maxValue())):
-                    lt.load(hf,self.gti)
-                    if not self.quiet: print 'loaded'
-                else:
-                    if not self.quiet: print 'not in Gti range'
-
-            # write out ltcube
-            extension = 'WEIGHTED_EXPOSURE' if i else 'EXPOSURE'
-            lt.write(self.ltcube,extension,not bool(i))
+        if self.livetime_processes:
+            self._make_healpix_ltcube(roi_dir,exp_radius,zenithcut)
+        else:
+            for i in xrange(1+self.use_weighted_livetime):
+                #print('on iteration {0}'.format(i))
+                sys.stdout.flush()
+                lt = skymaps.LivetimeCube(
+                    cone_angle =exp_radius,
+                    dir        =roi_dir,
+                    zcut       =np.cos(np.radians(zenithcut)),
+                    pixelsize  =self.livetime_pixelsize,
+                    quiet      =self.quiet,
+                    weighted   =i)
+
+                for hf in self.ft2files:
+                    if not self.quiet: print('checking FT2 file {0}...'.format(hf)),
+                    lt_gti = skymaps.Gti(hf,'SC_DATA')
+                    if not ((lt_gti.maxValue() < self.gti.minValue()) or
+                            (lt_gti.minValue() > self.gti.maxValue())):
+                        lt.load(hf,self.gti)
+                        if not self.quiet: print 'loaded'
+                    else:
+                        if not self.quiet: print 'not in Gti range'
+
+                # write out ltcube
+                extension = 'WEIGHTED_EXPOSURE' if i else 'EXPOSURE'
+                lt.write(self.ltcube,extension,not bool(i))
         self.dss.write(self.ltcube,header_key=0)
         # write some info to livetime file
         f = pyfits.open(self.ltcube)
@@ -557,6 +562,18 @@ class DataSpec(object):
         f[0]._header['PIXSIZE'] = self.livetime_pixelsize
         f.writeto(self.ltcube,clobber=True)
         f.close()
+
+    def _make_healpix_ltcube(self,roi_dir,exp_radius,zenithcut):
+        """ Generate the livetime cube with the numpy engine in uw.data.livetime."""
+        from uw.data import livetime
+        lt = livetime.HealpixLivetime(
+            nside     =livetime.nside_for(self.livetime_pixelsize),
+            zcut      =np.cos(np.radians(zenithcut)),
+            cone      =None if exp_radius==180 else (roi_dir.ra(),roi_dir.dec(),exp_radius),
+            weighted  =self.use_weighted_livetime,
+            quiet     =self.quiet)
+        lt.fill(self.ft2files,self.gti,processes=self.livetime_processes)
+        lt.write(self.ltcube)
         
     def _get_GTI(self):
         """ Apply GTI cuts and get resulting merged GTI."""
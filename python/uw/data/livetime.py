@@ -0,0 +1,240 @@
+"""
+Compute livetime cubes directly from FT2 spacecraft data with numpy.
+Duplicates the functionality of the C++ class skymaps.LivetimeCube: for each HEALPix
+direction, the livetime is histogrammed in sqrt(1-cos(theta)), theta being the angle
+from the spacecraft z-axis, after applying the GTI and the zenith angle cut.
+
+FT2 files are processed independently, optionally in parallel, and the partial cubes
+are summed, so that a cube can be extended with new data without recomputing it.
+The output file has the EXPOSURE, WEIGHTED_EXPOSURE and GTI tables expected by
+skymaps.LivetimeCube and uw.utilities.fitstools.merge_lt.
+"""
+import os, itertools
+import numpy as np
+import healpy
+from astropy.io import fits as pyfits
+from uw.utilities import keyword_options, processpool
+
+def nside_for(pixelsize):
+    """ smallest power of two HEALPix nside with pixels no larger than pixelsize (deg)"""
+    return 2**int(np.ceil(np.log2(np.sqrt(np.pi/3)/np.radians(pixelsize))))
+
+def gti_intervals(gti):
+    """ return sorted arrays of start and stop times from a skymaps.Gti or a (starts,stops) pair"""
+    if hasattr(gti,'computeOntime'):
+        gti = np.asarray([(x.minValue(),x.maxValue()) for x in gti]).reshape(-1,2).transpose()
+    starts,stops = [np.asarray(x,dtype=float) for x in gti]
+    a = np.argsort(starts)
+    return starts[a],stops[a]
+
+def merge_intervals(starts,stops):
+    """ union of a set of time intervals, as sorted, disjoint (starts,stops) arrays"""
+    starts,stops = gti_intervals((starts,stops))
+    if len(starts)==0: return starts,stops
+    # an interval begins a new block if it starts after every earlier one has stopped
+    reach = np.maximum.accumulate(stops)
+    new = np.append(True,starts[1:]>reach[:-1])
+    return starts[new],np.maximum.reduceat(stops,np.flatnonzero(new))
+
+def gti_overlap(starts,stops,t1,t2):
+    """ time within the disjoint intervals (starts,stops) for each interval [t1,t2]"""
+    if len(starts)==0: return np.zeros(len(t1))
+    cumulative = np.append(0,np.cumsum(stops-starts))
+    def covered(t):
+        k = np.searchsorted(starts,t,side='right')-1
+        kk = np.maximum(k,0)
+        inside = np.clip(t-starts[kk],0,stops[kk]-starts[kk])
+        return np.where(k>=0,cumulative[kk]+inside,0)
+    return covered(np.asarray(t2,dtype=float))-covered(np.asarray(t1,dtype=float))
+
+def ft2_livetime(ft2file,gti,nside=64,nbins=40,cosmin=0.,zcut=-1.,cone=None,weighted=True,chunk_size=64):
+    """ livetime histograms from a single FT2 file
+
+    ft2file : name of the FT2 file
+    gti : skymaps.Gti or (starts,stops) arrays of the good time intervals
+    nside, nbins, cosmin, zcut, cone, weighted, chunk_size : see HealpixLivetime
+
+    returns (exposure, weighted_exposure, (tmin,tmax)), with the exposure arrays
+    of shape (12*nside**2, nbins), weighted_exposure None if not weighted, and
+    (tmin,tmax) the time range with livetime in the file, None if there is none
+    """
+    starts,stops = merge_intervals(*gti_intervals(gti))
+    npix = 12*nside**2
+    exposure = np.zeros((npix,nbins))
+    wexposure = np.zeros((npix,nbins)) if weighted else None
+
+    f = pyfits.open(ft2file,memmap=True)
+    d = f['SC_DATA'].data
+    t1,t2,live = [np.asarray(d.field(x),dtype=float) for x in ('START','STOP','LIVETIME')]
+    frac = gti_overlap(starts,stops,t1,t2)/(t2-t1)
+    keep = (frac>0) & (live>0)
+    if not np.any(keep):
+        f.close()
+        return exposure,wexposure,None
+    lt = live[keep]*frac[keep]
+    wlt = lt*live[keep]/(t2-t1)[keep]
+    def unit(ra,dec):
+        ra,dec = [np.radians(np.asarray(d.field(x),dtype=float)[keep]) for x in (ra,dec)]
+        return np.asarray([np.cos(dec)*np.cos(ra),np.cos(dec)*np.sin(ra),np.sin(dec)])
+    scz = unit('RA_SCZ','DEC_SCZ')
+    zenith = unit('RA_ZENITH','DEC_ZENITH') if zcut>-1 else None
+    trange = (t1[keep].min(),t2[keep].max())
+    f.close()
+
+    # pixels in the cone
+    pixdirs = np.asarray(healpy.pix2vec(nside,np.arange(npix),nest=True)).transpose()
+    pixels = np.arange(npix)
+    if cone is not None:
+        ra,dec,radius = np.radians(cone)
+        center = np.asarray([np.cos(dec)*np.cos(ra),np.cos(dec)*np.sin(ra),np.sin(dec)])
+        pixels = pixels[np.dot(pixdirs,center)>=np.cos(radius)]
+    pixdirs = pixdirs[pixels]
+
+    # histogram a block of FT2 intervals at a time for all pixels
+    acc = np.zeros(len(pixels)*nbins)
+    wacc = np.zeros(len(pixels)*nbins) if weighted else None
+    for i in xrange(0,len(lt),chunk_size):
+        sl = slice(i,i+chunk_size)
+        costh = np.dot(pixdirs,scz[:,sl])
+        mask = costh>cosmin
+        if zenith is not None:
+            mask &= np.dot(pixdirs,zenith[:,sl])>zcut
+        rows,cols = np.nonzero(mask)
+        ibin = np.minimum((np.sqrt((1-costh[rows,cols])/(1-cosmin))*nbins).astype(int),nbins-1)
+        index = rows*nbins+ibin
+        acc += np.bincount(index,weights=lt[sl][cols],minlength=len(acc))
+        if weighted:
+            wacc += np.bincount(index,weights=wlt[sl][cols],minlength=len(wacc))
+    exposure[pixels] = acc.reshape(-1,nbins)
+    if weighted:
+        wexposure[pixels] = wacc.reshape(-1,nbins)
+    return exposure,wexposure,trange
+
+def _livetime_task(args):
+    ft2file,gti,kwargs = args
+    return ft2_livetime(ft2file,gti,**kwargs)
+
+class HealpixLivetime(object):
+    """ Livetime cube in HEALPix, NESTED ordering, with sqrt(1-cos(theta)) bins in each pixel
+
+    Cubes with the same binning and cuts can be summed, e.g., to add a new month of data
+    to an existing cube; the GTI of the sum is the union of the GTIs.
+    """
+    defaults = (
+        ('nside',64,'HEALPix nside; see nside_for to convert a pixel size'),
+        ('nbins',40,'number of bins in sqrt(1-cos(theta))'),
+        ('cosmin',0.,'minimum cosine of the angle to the spacecraft z-axis'),
+        ('zcut',-1.,'cosine of the zenith angle cut; -1 for no cut'),
+        ('cone',None,'(ra,dec,radius) in degrees to restrict the pixels filled; None for the whole sky'),
+        ('weighted',True,'if True, also accumulate the livetime weighted by the livetime fraction'),
+        ('chunk_size',64,'number of FT2 intervals histogrammed at once'),
+        ('quiet',True,'set False for progress information'),
+    )
+
+    @keyword_options.decorate(defaults)
+    def __init__(self,**kwargs):
+        keyword_options.process(self,kwargs)
+        npix = 12*self.nside**2
+        self.exposure = np.zeros((npix,self.nbins))
+        self.weighted_exposure = np.zeros((npix,self.nbins)) if self.weighted else None
+        self.gti = (np.zeros(0),np.zeros(0))
+
+    def __repr__(self):
+        return '%s.%s: nside %d, %d bins, ontime %.0f s'%(self.__module__,self.__class__.__name__,
+            self.nside,self.nbins,(self.gti[1]-self.gti[0]).sum())
+
+    def _kwargs(self):
+        return dict(nside=self.nside,nbins=self.nbins,cosmin=self.cosmin,zcut=self.zcut,
+                    cone=self.cone,weighted=self.weighted,chunk_size=self.chunk_size)
+
+    def _accumulate(self,exposure,wexposure,gti):
+        self.exposure += exposure
+        if self.weighted:
+            self.weighted_exposure += wexposure
+        self.gti = merge_intervals(np.append(self.gti[0],gti[0]),np.append(self.gti[1],gti[1]))
+
+    def fill(self,ft2files,gti,processes=1):
+        """ add the livetime from a set of FT2 files during the good time intervals gti
+
+        ft2files : FT2 file name or list of names
+        gti : skymaps.Gti or (starts,stops) arrays; should not overlap the GTI already filled
+        processes : number of FT2 files to process in parallel
+        """
+        if isinstance(ft2files,str): ft2files = [ft2files]
+        starts,stops = merge_intervals(*gti_intervals(gti))
+        tasks = [(ft2,(starts,stops),self._kwargs()) for ft2 in ft2files]
+        def add(ft2,result):
+            exposure,wexposure,trange = result
+            if trange is None:
+                if not self.quiet: print 'FT2 file %s: not in Gti range'%ft2
+                return
+            # record the part of the GTI covered by this file
+            a,b = np.maximum(starts,trange[0]),np.minimum(stops,trange[1])
+            self._accumulate(exposure,wexposure,(a[b>a],b[b>a]))
+            if not self.quiet: print 'FT2 file %s: loaded'%ft2
+        results = processpool.imap(_livetime_task,tasks,processes)
+        try:
+            # one partial cube at a time: izip does not collect the results first
+            for task,result in itertools.izip(tasks,results):
+                add(task[0],result)
+        finally:
+            results.close()
+
+    def check_consistency(self,other):
+        """ raise ValueError unless other has the same binning and cuts"""
+        for key in ('nside','nbins','cosmin','zcut','weighted'):
+            if getattr(self,key)!=getattr(other,key):
+                raise ValueError('Livetime cubes have inconsistent %s: %s, %s'%(key,getattr(self,key),getattr(other,key)))
+
+    def add(self,other):
+        """ add the livetime of another HealpixLivetime, or of a file written by one or by
+        skymaps.LivetimeCube, in place
+        """
+        if isinstance(other,str):
+            other = read(other,weighted=self.weighted,zcut=self.zcut)
+        self.check_consistency(other)
+        self._accumulate(other.exposure,other.weighted_exposure,other.gti)
+        return self
+
+    def write(self,filename,clobber=True):
+        """ write the EXPOSURE, WEIGHTED_EXPOSURE (if weighted) and GTI tables"""
+        npix = len(self.exposure)
+        def table(name,values):
+            hdu = pyfits.BinTableHDU.from_columns([pyfits.Column(name='COSBINS',
+                format='%dE'%self.nbins,array=values.astype(np.float32))],name=name)
+            h = hdu.header
+            for key,value in (('PIXTYPE','HEALPIX'),('ORDERING','NESTED'),('COORDSYS','EQU'),
+                ('NSIDE',self.nside),('FIRSTPIX',0),('LASTPIX',npix-1),
+                ('THETABIN','SQRT(1-COSTHETA)'),('NBRBINS',self.nbins),('COSMIN',self.cosmin),
+                ('PHIBINS',0)):
+                h[key] = value
+            return hdu
+        hdus = [pyfits.PrimaryHDU(),table('EXPOSURE',self.exposure)]
+        if self.weighted:
+            hdus.append(table('WEIGHTED_EXPOSURE',self.weighted_exposure))
+        hdus.append(pyfits.BinTableHDU.from_columns([
+            pyfits.Column(name='START',format='D',unit='s',array=self.gti[0]),
+            pyfits.Column(name='STOP',format='D',unit='s',array=self.gti[1])],name='GTI'))
+        hdus[0].header['ZCUT'] = self.zcut
+        if os.path.exists(filename) and clobber: os.remove(filename)
+        pyfits.HDUList(hdus).writeto(filename)
+
+def read(filename,weighted=True,zcut=-1.):
+    """ return a HealpixLivetime with the contents of a livetime cube file
+
+    zcut : cosine of the zenith angle cut, if not recorded in the file (skymaps.LivetimeCube)
+    """
+    f = pyfits.open(filename)
+    h = f['EXPOSURE'].header
+    if h.get('ORDERING','NESTED')!='NESTED':
+        raise ValueError('Livetime cube %s not in NESTED ordering'%filename)
+    weighted = weighted and 'WEIGHTED_EXPOSURE' in [x.name for x in f]
+    lt = HealpixLivetime(nside=h['NSIDE'],nbins=h['NBRBINS'],cosmin=h['COSMIN'],
+        zcut=f[0].header.get('ZCUT',zcut),weighted=weighted)
+    lt.exposure[:] = f['EXPOSURE'].data.field('COSBINS')
+    if weighted:
+        lt.weighted_exposure[:] = f['WEIGHTED_EXPOSURE'].data.field('COSBINS')
+    gti = f['GTI'].data
+    lt.gti = merge_intervals(gti.field('START'),gti.field('STOP'))
+    f.close()
+    return lt
@@ -17,6 +17,23 @@ from scipy import interpolate
 
 import skymaps
 
+def efficiency_factors(pars,energies):
+    """Return the livetime efficiency factors (f1,f2) at each energy.
+
+    The exposure is f1*livetime + f2*weighted_livetime; pars are the two rows
+    (p0,p1) of the EFFICIENCY_PARS column, each (a0,b0,a1,logEb1,a2,logEb2)
+    defining a broken linear function of log10(energy). p0 multiplies the
+    livetime fraction, so it applies to the weighted livetime.
+    """
+    loge = np.log10(energies)
+    def p(v):
+        a0,b0,a1,logEb1,a2,logEb2 = v
+        b1 = (a0 - a1)*logEb1 + b0
+        b2 = (a1 - a2)*logEb2 + b1
+        return np.where(loge<logEb1,a0*loge + b0,np.where(loge<logEb2,a1*loge + b1,a2*loge + b2))
+    pars = np.asarray(pars,dtype=float).reshape(2,6)
+    return p(pars[1]),p(pars[0])
+
 #To get something working for now, just use C++ implementation
 
 class EffectiveArea(skymaps.EffectiveArea):
@@ -24,9 +41,19 @@ class EffectiveArea(skymaps.EffectiveArea):
     def __init__(self,filename,
                  aeff_extension="EFFECTIVE_AREA",
                  eff_params_extension="EFFICIENCY_PARAMETERS"):
+        self.filename = filename
         self.eff_params_extension = eff_params_extension
         skymaps.EffectiveArea.__init__(self,'',str(filename),str(aeff_extension))
 
+    def livetime_factors(self,energies):
+        """Return the efficiency factors (f1,f2) for the livetime and weighted livetime,
+        or None if the file has no efficiency parameters."""
+        try:
+            pars = fits.getdata(self.filename,self.eff_params_extension).field('EFFICIENCY_PARS')
+        except KeyError:
+            return None
+        return efficiency_factors(pars,energies)
+
 
 """
 #TODO: 
@@ -6,7 +6,9 @@ Author: Eric Wallace
 __version__='$Revision: 1.3 $'
 
 
+import os
 import numpy as np
+import healpy
 
 import skymaps
 
@@ -16,8 +18,13 @@ class Exposure(object):
                  correction=None,
                  weighted_livetime=None,
                  exposure_cube=None,
-                 cthetamin=.4):
+                 cthetamin=.4,
+                 healpix=None):
+        """healpix : HealpixExposureTable or None
+            if set, the band exposures are looked up in its all-sky arrays, see HealpixBandExposure
+        """
         self.aeff = aeff 
+        self.healpix = healpix
         self.lt = livetime
         self.weighted_lt = weighted_livetime
         if correction is not None:
@@ -49,6 +56,8 @@ class Exposure(object):
         return ExposureIntegral(self,skydir,emin,emax)
 
     def band_exposure(self,energy):
+        if self.healpix is not None:
+            return HealpixBandExposure(self,energy)
         return BandExposure(self,energy)
 
 class BandExposure(Exposure):
@@ -57,7 +66,7 @@ class BandExposure(Exposure):
         return '{} : \n\tenergy {:.0f}'.format(self.__class__, self.energy)
 
     def __init__(self,exp,energy):
-        for attr in ('aeff','lt','weighted_lt','correction','_cpp_exposure'):
+        for attr in ('aeff','lt','weighted_lt','correction','_cpp_exposure','healpix'):
             setattr(self,attr,getattr(exp,attr))
         self.energy = energy
         self.correction = exp.correction(self.energy)
@@ -67,6 +76,32 @@ class BandExposure(Exposure):
             energy = self.energy
         return Exposure.value(self,skydir,energy)
 
+    def skyspectrum(self):
+        """Return (SkySpectrum, factor) for evaluation of a grid in C++: the exposure, with the 
+        energy set, and 1.0
+        """
+        self._cpp_exposure.setEnergy(self.energy)
+        return self._cpp_exposure, 1.0
+
+
+class HealpixBandExposure(BandExposure):
+    """BandExposure evaluated by lookup in the all-sky arrays of a HealpixExposureTable, rather than
+    by the C++ exposure: the grid fills use evaluate, and ExposureIntegral uses spectrum.
+    """
+
+    def __call__(self,skydir,energy=None):
+        if energy is None:
+            energy = self.energy
+        return self.healpix.values([skydir],[energy])[0,0]
+
+    def spectrum(self,skydir,energies):
+        """Return the exposure at skydir for each of the energies"""
+        return self.healpix.values([skydir],energies)[0]
+
+    def evaluate(self,unit_vectors):
+        """Return the exposure at the band energy for an (n x 3) array of equatorial unit vectors"""
+        return self.healpix.evaluate(unit_vectors,[self.energy])[:,0]
+
 
 class ExposureCorrection(object):
     """ logarithmic interpolation function
@@ -99,7 +134,10 @@ class ExposureIntegral(object):
             note that exposure is evaluated at the skydir
         """
         self.sp_points = sp = np.logspace(np.log10(emin),np.log10(emax),self.nsp_simps+1)
-        exp_points     = map(lambda e: exp(skydir, e), sp)
+        if hasattr(exp, 'spectrum'):
+            exp_points = exp.spectrum(skydir, sp)
+        else:
+            exp_points = map(lambda e: exp(skydir, e), sp)
         # following may be marginally faster, but not implemented for exposure cube
         #exp_points      = np.asarray(self.exp.vector_value(self.sd,DoubleVector(sp)))
         simps_weights  = (np.log(sp[-1]/sp[0])/(3.*self.nsp_simps)) * \
@@ -113,3 +151,130 @@ class ExposureIntegral(object):
         """
         axis = 1 if hasattr(model_function(self.sp_points[0]), '__iter__') else None
         return (model_function(self.sp_points)*self.sp_vector).sum(axis=axis)
+
+
+class HealpixExposure(object):
+    """ Exposure at the center of every pixel of a livetime cube, for a set of energies.
+
+    The livetime histograms in cos(theta), for all pixels, are combined with the effective
+    area at the bin centers as a single matrix product. The result, an array (npix, energies),
+    can be saved and memory-mapped for reuse, e.g., one file per band.
+    """
+
+    def __init__(self, ltcube, aeff, energies,
+                 cthetamin=.4,
+                 weighted=True,
+                 livetime_factors=None,
+                 cachefile=None):
+        """
+        ltcube : file name, or list of names, of livetime cubes in HEALPix NESTED ordering,
+            or a uw.data.livetime.HealpixLivetime object
+        aeff : function of (energy, costheta) returning the effective area in cm^2
+        cthetamin : minimum cos(theta) for the effective area
+        weighted : if True, apply the livetime efficiency correction using the weighted livetime
+        livetime_factors : function of energies returning (f1,f2) for the livetime and weighted 
+            livetime; if None, use aeff.livetime_factors if available
+        cachefile : if set, name of a .npy file: loaded, memory-mapped, if it exists, else saved
+        """
+        self.energies = energies = np.asarray(energies, float)
+        if cachefile is not None and os.path.exists(cachefile):
+            self.values = np.load(cachefile, mmap_mode='r')
+            self.nside = healpy.npix2nside(self.values.shape[0])
+            assert self.values.shape[1]==len(energies), 'Cached exposure %s does not match energies' % cachefile
+            return
+        from uw.data import livetime
+        if isinstance(ltcube, livetime.HealpixLivetime):
+            lt = ltcube
+        else:
+            files = [ltcube] if isinstance(ltcube, str) else ltcube
+            lt = livetime.read(files[0], weighted=weighted)
+            for f in files[1:]:
+                lt.add(f)
+        self.nside = lt.nside
+
+        # effective area at the centers of the sqrt(1-cos(theta)) bins
+        f = ((np.arange(lt.nbins)+0.5)/lt.nbins)**2
+        costh = 1 - f*(1-lt.cosmin)
+        aeff_matrix = np.array([[aeff(e, c) if c>cthetamin else 0. for e in energies] for c in costh])
+
+        if livetime_factors is None:
+            livetime_factors = getattr(aeff, 'livetime_factors', None)
+        factors = livetime_factors(energies) if (weighted and lt.weighted and livetime_factors is not None) else None
+        if factors is None:
+            self.values = np.dot(lt.exposure, aeff_matrix)
+        else:
+            f1, f2 = factors
+            self.values = np.dot(lt.exposure, aeff_matrix*f1) + np.dot(lt.weighted_exposure, aeff_matrix*f2)
+        if cachefile is not None:
+            np.save(cachefile, self.values)
+
+    def __repr__(self):
+        return '{}: nside {}, {} energies from {:.0f} to {:.0f} MeV'.format(self.__class__, 
+            self.nside, len(self.energies), self.energies[0], self.energies[-1])
+
+    def pixels(self, skydirs):
+        """ NESTED pixel indices for a list of SkyDirs"""
+        ra, dec = np.array([(sd.ra(), sd.dec()) for sd in skydirs]).reshape(-1,2).T
+        return healpy.ang2pix(self.nside, np.radians(90-dec), np.radians(ra), nest=True)
+
+    def __call__(self, skydirs):
+        """ exposure (len(skydirs), energies) for a list of SkyDirs, or (energies,) for one SkyDir"""
+        single = hasattr(skydirs, 'ra')
+        ret = np.asarray(self.values[self.pixels([skydirs] if single else skydirs)])
+        return ret[0] if single else ret
+
+
+class HealpixExposureTable(object):
+    """ The HealpixExposure arrays for one livetime cube and effective area, by set of energies.
+
+    Each array is computed once, reading the livetime cube only for the first, and is kept in memory.
+    If a cache is set, the arrays are also saved there for other processes or jobs.
+    """
+
+    def __init__(self, ltcube, aeff, cthetamin=.4, weighted=False, cache=None, key=None):
+        """
+        ltcube, aeff, cthetamin, weighted : see HealpixExposure
+        cache : function of (key, fill) returning an array, e.g., like2.convolution.GridCache, or None
+        key : dict identifying the livetime cube and effective area in the cache, e.g., the event type
+        """
+        self.ltcube, self.aeff = ltcube, aeff
+        self.cthetamin, self.weighted = cthetamin, weighted
+        self.cache = cache
+        self.key = key if key is not None else dict()
+        self.lt = None
+        self.arrays = dict()
+
+    def __repr__(self):
+        return '{}: livetime {}, {} sets of energies'.format(self.__class__, self.ltcube, len(self.arrays))
+
+    def __call__(self, energies):
+        """ the array (npix, len(energies)) of exposure """
+        energies = tuple(np.round(np.atleast_1d(energies), 6))
+        if energies not in self.arrays:
+            def fill():
+                if self.lt is None:
+                    from uw.data import livetime
+                    self.lt = livetime.read(self.ltcube, weighted=self.weighted)
+                return HealpixExposure(self.lt, self.aeff, energies,
+                    cthetamin=self.cthetamin, weighted=self.weighted).values
+            if self.cache is None:
+                self.arrays[energies] = fill()
+            else:
+                key = dict(kind='exposure', energies=energies, cthetamin=self.cthetamin, 
+                    weighted=self.weighted, **self.key)
+                self.arrays[energies] = self.cache(key, fill)
+        return self.arrays[energies]
+
+    def values(self, skydirs, energies):
+        """ exposure (len(skydirs), len(energies)) for a list of SkyDirs"""
+        cube = self(energies)
+        ra, dec = np.array([(sd.ra(), sd.dec()) for sd in skydirs]).reshape(-1,2).T
+        pix = healpy.ang2pix(healpy.npix2nside(len(cube)), np.radians(90-dec), np.radians(ra), nest=True)
+        return np.asarray(cube[pix])
+
+    def evaluate(self, unit_vectors, energies):
+        """ exposure (len(unit_vectors), len(energies)) for an (n x 3) array of equatorial unit vectors"""
+        cube = self(energies)
+        x, y, z = np.asarray(unit_vectors, float).reshape(-1,3).T
+        pix = healpy.vec2pix(healpy.npix2nside(len(cube)), x, y, z, nest=True)
+        return np.asarray(cube[pix])
@@ -20,7 +20,7 @@ class IrfManager(object):
                                  psf = (2,3,4,5),
                                  edisp = (6,7,8,9))
 
-    def __init__(self, dataset, irf_dir="$CALDB", irfname=None, event_types=None,):
+    def __init__(self, dataset, irf_dir="$CALDB", irfname=None, event_types=None, exposure_cache=None):
         """
         Parameters
         ---------
@@ -29,7 +29,11 @@ class IrfManager(object):
             If None, use parameter values, and define psf without weighting over exposure
         irf_dir : string
             Path to the CALDB folder 
+        exposure_cache : like2.convolution.GridCache or None
+            If set, with a dataset, the band exposures are looked up in all-sky HEALPix arrays,
+            see exposure.HealpixExposureTable, which are saved in this cache
         """
+        self.exposure_cache = exposure_cache
         self.caldb = caldb.CALDB(irf_dir, dataset.irf)
         if dataset is not None:
             self.irfname = dataset.irf
@@ -75,8 +79,12 @@ class IrfManager(object):
             else:
                 cthetamin = np.cos(np.radians(dataset.theta_cut.get_bounds()[1]))
             # Allows for multiple livetime cubes
+            def healpix(et, aeff):
+                if self.exposure_cache is None: return None
+                return exposure.HealpixExposureTable(dataset.livetime_file(et), aeff, cthetamin=cthetamin,
+                    cache=self.exposure_cache, key=dict(event_type=et))
             self._exposure = {et:exposure.Exposure(dataset.livetime_cube(et),
-                    aeff,cthetamin=cthetamin)
+                    aeff,cthetamin=cthetamin, healpix=healpix(et, aeff))
                                 for et,aeff in self._aeff.items()}
         else:
             self._exposure = None
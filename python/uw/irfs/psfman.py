@@ -15,6 +15,14 @@ from skymaps import (SkyDir, ExposureWeighter, PythonPsf,)
 from . import caldb
 
 
+def unit_vectors(skydirs):
+    """ return an (n x 3) array of the unit vectors for a list of SkyDir objects
+    """
+    radec = np.radians(np.array([(sd.ra(), sd.dec()) for sd in skydirs], float).reshape(-1,2))
+    ra, dec = radec[:,0], radec[:,1]
+    return np.array([np.cos(dec)*np.cos(ra), np.cos(dec)*np.sin(ra), np.sin(dec)]).T
+
+
 class PSFmanager(dict):
     """ manage the PSF
     Much of this code has been imported from the original uw/like/pypsf, writen by M. Kerr, 
@@ -250,6 +258,30 @@ class PSFmanager(dict):
                 self._cpsf.wsdl_val(rvals, skydir, wsdl)
                 return rvals
 
+            def wsdl_values(self, skydirs, wsdl=None, pixel_vectors=None, maxsize=1000000):
+                """Return a (sources x pixels) array of PSF values for a list of SkyDirs and a list of
+                    pixels, with one vectorized evaluation of the angular separations
+                    paramters:
+                    skydirs : list of SkyDir objects
+                    wsdl    : WeightedSkyDirList | None
+                    pixel_vectors : (pixels x 3) array of unit vectors | None
+                        if set, used instead of wsdl
+                    maxsize : int
+                        limit to the size of the block of sources evaluated together
+                """
+                if pixel_vectors is None:
+                    pixel_vectors = unit_vectors(wsdl)
+                svecs = unit_vectors(skydirs)
+                npix = len(pixel_vectors)
+                ret = np.empty((len(svecs), npix))
+                step = max(1, maxsize//max(npix,1))
+                for i in range(0, len(svecs), step):
+                    cosdelta = np.dot(svecs[i:i+step], pixel_vectors.T)
+                    # angle from the half-chord, accurate for small separations
+                    delta = 2*np.arcsin(np.sqrt(np.clip((1-cosdelta)/2, 0, 1)))
+                    ret[i:i+step] = self(delta.ravel()).reshape(delta.shape)
+                return ret
+
             def plot(self, ax=None):
                 from matplotlib import pylab as plt
  
@@ -0,0 +1,116 @@
+"""
+irfs testing code, using unittest
+These tests use a simple effective area function and a livetime cube filled with numpy: no data files
+"""
+import os, sys, unittest, tempfile
+import numpy as np
+
+from uw.irfs import exposure, effective_area
+from uw.data import livetime
+
+# EFFICIENCY_PARS rows (p0, p1), each (a0, b0, a1, logEb1, a2, logEb2)
+efficiency_pars = np.array([[-1.4, 3.5, -0.35, 2.5, -0.1, 3.8],
+                            [ 1.3, -2.9, 0.3, 2.6, 0.05, 3.9]])
+
+class TestEfficiency(unittest.TestCase):
+    """Compare efficiency_factors with the broken linear functions evaluated at each energy
+    """
+    def broken_linear(self, pars, loge):
+        a0, b0, a1, logEb1, a2, logEb2 = pars
+        if loge < logEb1: return a0*loge + b0
+        b1 = (a0-a1)*logEb1 + b0
+        if loge < logEb2: return a1*loge + b1
+        return a2*loge + (a1-a2)*logEb2 + b1
+
+    def test_factors(self):
+        energies = np.logspace(1.5, 5, 36)
+        f1, f2 = effective_area.efficiency_factors(efficiency_pars.ravel(), energies)
+        loge = np.log10(energies)
+        # p1 applies to the livetime, p0 to the weighted livetime
+        self.assertTrue(np.allclose(f1, [self.broken_linear(efficiency_pars[1], x) for x in loge]))
+        self.assertTrue(np.allclose(f2, [self.broken_linear(efficiency_pars[0], x) for x in loge]))
+
+    def test_continuity(self, eps=1e-9):
+        """--> the functions are continuous at the breaks"""
+        for logeb in efficiency_pars[:,[3,5]].ravel():
+            below = effective_area.efficiency_factors(efficiency_pars, 10**(logeb-eps))
+            above = effective_area.efficiency_factors(efficiency_pars, 10**(logeb+eps))
+            self.assertTrue(np.allclose(below, above, atol=1e-6), msg='%s, %s' % (below, above))
+
+class TestHealpixExposure(unittest.TestCase):
+    """Compare the HealpixExposure matrix product with a sum over the pixels and cos(theta) bins
+    """
+    def setUp(self, cthetamin=0.4):
+        rng = np.random.RandomState(0)
+        self.lt = livetime.HealpixLivetime(nside=2, nbins=10, weighted=True)
+        self.lt.exposure[:] = rng.uniform(0, 1e6, self.lt.exposure.shape)
+        self.lt.weighted_exposure[:] = self.lt.exposure * rng.uniform(0.8, 0.95, self.lt.exposure.shape)
+        self.energies = np.logspace(2, 4, 5)
+        self.cthetamin = cthetamin
+
+    def aeff(self, energy, costheta):
+        """ effective area in cm^2"""
+        return 8000*costheta**2*(1-np.exp(-energy/300.))
+
+    def direct(self, exposure, factors):
+        """ exposure for each pixel and energy, one bin at a time"""
+        nbins = self.lt.nbins
+        ret = np.zeros((exposure.shape[0], len(self.energies)))
+        for p in range(exposure.shape[0]):
+            for i in range(nbins):
+                # center of the bin in sqrt(1-cos(theta))
+                costheta = 1 - ((i+0.5)/nbins)**2 * (1-self.lt.cosmin)
+                if costheta<=self.cthetamin: continue
+                for j, e in enumerate(self.energies):
+                    ret[p,j] += exposure[p,i] * self.aeff(e, costheta) * factors[j]
+        return ret
+
+    def test_unweighted(self):
+        values = exposure.HealpixExposure(self.lt, self.aeff, self.energies,
+            cthetamin=self.cthetamin, weighted=False).values
+        self.assertEqual(values.shape, (12*2**2, len(self.energies)))
+        self.assertTrue(np.allclose(values, self.direct(self.lt.exposure, np.ones(len(self.energies)))))
+
+    def test_weighted(self):
+        factors = lambda energies: effective_area.efficiency_factors(efficiency_pars, energies)
+        values = exposure.HealpixExposure(self.lt, self.aeff, self.energies,
+            cthetamin=self.cthetamin, weighted=True, livetime_factors=factors).values
+        f1, f2 = factors(self.energies)
+        expect = self.direct(self.lt.exposure, f1) + self.direct(self.lt.weighted_exposure, f2)
+        self.assertTrue(np.allclose(values, expect))
+
+    def test_cachefile(self):
+        """--> values saved, then loaded memory-mapped"""
+        fd, cachefile = tempfile.mkstemp(suffix='.npy')
+        os.close(fd)
+        os.remove(cachefile)
+        try:
+            values = exposure.HealpixExposure(self.lt, self.aeff, self.energies,
+                cthetamin=self.cthetamin, weighted=False, cachefile=cachefile).values
+            cached = exposure.HealpixExposure(None, self.aeff, self.energies, cachefile=cachefile)
+            self.assertTrue(np.all(values==cached.values))
+            self.assertEqual(cached.nside, 2)
+        finally:
+            os.remove(cachefile)
+
+test_cases = (
+    TestEfficiency,
+    TestHealpixExposure,
+    )
+
+def run(t='all', loader=unittest.TestLoader(), debug=False):
+    if t=='all':
+        suite = unittest.TestSuite()
+        for test_class in test_cases:
+            tests = loader.loadTestsFromTestCase(test_class)
+            suite.addTests(tests)
+    else:
+        suite = loader.loadTestsFromTestCase(t)
+    print 'running %d tests %s' % (suite.countTestCases(), 'in debug mode' if debug else '')
+    if debug:
+        suite.debug()
+    else:
+        unittest.TextTestRunner(stream=sys.stdout,verbosity=2).run(suite)
+
+if __name__=='__main__':
+    run()
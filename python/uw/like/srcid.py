@@ -12,9 +12,12 @@ import math
 import re
 import operator
 import glob
+import cPickle as pickle
+import zlib
 
 
 import numpy as np
+from scipy.spatial import cKDTree
 from astropy.io import fits as pf
 
 import skymaps
@@ -35,6 +38,9 @@ class SourceAssociation(object):
                 ('verbosity',1,
                  '''How verbose to be: 0 for no output, 1 for normal output,
                     2 for extra output'''),
+                ('index_dir',None,
+                 '''Path to a directory in which to cache the spatial indices
+                    of the counterpart catalogs. If None, do not cache.'''),
                 ('quiet',False,'Set verbosity=0. DEPRECATED'))
 
     @keyword_options.decorate(defaults)
@@ -126,7 +132,8 @@ class SourceAssociation(object):
         except ImportError, AttributeError:
             raise SrcidError("Counterpart class %s not found."%kw['cpt_class'])
         if not self.catalogs.has_key(kw['cpt_class']):
-            self.catalogs[kw['cpt_class']] = Catalog(class_module,self.catalog_dir,verbosity=self.verbosity)
+            self.catalogs[kw['cpt_class']] = Catalog(class_module,self.catalog_dir,verbosity=self.verbosity,
+                                                     index_dir=self.index_dir)
             #print 'loaded catalog %s' %class_module
         these = self.catalogs[kw['cpt_class']].associate(position,error,
                                                          trap_mask=kw['trap_mask'],
@@ -228,9 +235,66 @@ class SourceAssociation(object):
             cls = source[cls][0][0][:3].lower()
         return cls
 
+class SkyIndex(object):
+    """A KD-tree on unit vectors for fast cone searches in a list of positions.
+
+    Candidates found with the tree are checked with the same exact cut as
+    fitstools.rad_mask, so the selections are identical."""
+
+    def __init__(self,ras,decs,filename=None):
+        """
+        Arguments:
+            ras,decs : arrays of positions in degrees
+            filename : optional path of a pickle file in which to cache the tree
+        """
+        self.ras,self.decs = np.asarray(ras,dtype=float),np.asarray(decs,dtype=float)
+        key = zlib.crc32(self.ras.tostring()+self.decs.tostring())
+        if filename is not None and os.path.exists(filename):
+            try:
+                cached_key,self.tree = pickle.load(open(filename,'rb'))
+                if cached_key==key: return
+            except Exception:
+                pass
+        self.tree = cKDTree(self._vectors(self.ras,self.decs))
+        if filename is not None:
+            pickle.dump((key,self.tree),open(filename,'wb'),pickle.HIGHEST_PROTOCOL)
+
+    def __len__(self):
+        return len(self.ras)
+
+    @staticmethod
+    def _vectors(ras,decs):
+        ras,decs = np.radians(ras),np.radians(decs)
+        return np.array([np.cos(decs)*np.cos(ras),np.cos(decs)*np.sin(ras),np.sin(decs)]).T
+
+    def query(self,ras,decs,radii):
+        """Return, for each center, the sorted array of indices within radius degrees.
+
+        Arguments:
+            ras,decs : arrays of cone centers in degrees
+            radii    : cone radii in degrees, scalar or one per center
+        """
+        ras,decs = np.atleast_1d(ras).astype(float),np.atleast_1d(decs).astype(float)
+        radii = np.broadcast_to(np.asarray(radii,dtype=float),ras.shape)
+        # chord length for the radius, padded against roundoff; the exact cut follows
+        chords = 2*np.sin(np.radians(np.minimum(radii,180))/2)+1e-9
+        vectors = self._vectors(ras,decs)
+        candidates = [None]*len(ras)
+        for chord in np.unique(chords):
+            sel = np.flatnonzero(chords==chord)
+            for i,cand in zip(sel,self.tree.query_ball_point(vectors[sel],chord)):
+                candidates[i] = cand
+        result = []
+        for ra0,dec0,radius,cand in zip(np.radians(ras),np.radians(decs),radii,candidates):
+            cand = np.sort(np.asarray(cand,dtype=int))
+            r,d = np.radians(self.ras[cand]),np.radians(self.decs[cand])
+            cos_diffs = np.sin(d)*np.sin(dec0)+np.cos(d)*np.cos(dec0)*np.cos(r-ra0)
+            result.append(cand[cos_diffs > np.cos(np.radians(radius))])
+        return result
+
 class Catalog(object):
     """A class to manage the relevant information from a FITS catalog."""
-    def __new__(cls,class_module,catalog_dir,verbosity=1):
+    def __new__(cls,class_module,catalog_dir,verbosity=1,index_dir=None):
         gamma_catalogs = 'agile egr cosb eg3 fermi_bsl fermi_1fgl'.split()
         extended_catalogs = 'dwarfs snr_ext'.split()
         modname = class_module.__name__.split('.')[-1]
@@ -284,8 +348,9 @@ class Catalog(object):
             raise CatalogError(self.cat_file,'Could not find columns with source positions')
         return names,lons,lats
 
-    def __init__(self,class_module,catalog_dir,verbosity=1):
+    def __init__(self,class_module,catalog_dir,verbosity=1,index_dir=None):
         self.names,lons,lats = self.init(class_module,catalog_dir,verbosity=verbosity)
+        self.index_dir = index_dir
         self.mask = self._make_selection()
         self.sources = np.array([CatalogSource(self,name,skymaps.SkyDir(lon,lat,self.coords))
                         for name,lon,lat in zip(self.names,lons,lats)])[self.mask]
@@ -300,6 +365,24 @@ class Catalog(object):
     def __iter__(self):
         return self.sources
 
+    @property
+    def index(self):
+        """SkyIndex for the positions of the sources, built on first use."""
+        if getattr(self,'_index',None) is None:
+            filename = None
+            if getattr(self,'index_dir',None) is not None:
+                filename = os.path.join(self.index_dir,os.path.basename(self.cat_file)+'_index.pickle')
+            self._index = SkyIndex(self.ras,self.decs,filename=filename)
+            self._last_circle = None
+        return self._index
+
+    @property
+    def foms(self):
+        """Array of the figures of merit of the sources."""
+        if getattr(self,'_foms',None) is None:
+            self._foms = np.array([source.fom for source in self.sources])
+        return self._foms
+
     def __getitem__(self, name):
         try:
             return self.sources[self.names.index(name)]
@@ -501,15 +584,37 @@ class Catalog(object):
             position    : SkyDir for center of selection region.
             radius      : radius of selection region.
         """
-        ras,decs = self.ras,self.decs
+        return self.sources[self._circle_indices(position,radius,trapezoid)]
+
+    def select_circles(self,positions,radii,trapezoid=False):
+        """Return a list of arrays of CatalogSources, one for each position, using a single batched query.
+
+        Arguments:
+            positions   : list of SkyDirs for centers of selection regions.
+            radii       : radius of selection regions, scalar or one per position.
+        """
+        ras = np.array([p.ra() for p in positions])
+        decs = np.array([p.dec() for p in positions])
+        radii = np.broadcast_to(np.asarray(radii,dtype=float),ras.shape)
+        selected = []
+        for position,radius,indices in zip(positions,radii,self.index.query(ras,decs,radii)):
+            if trapezoid:
+                indices = indices[trap_mask(self.ras[indices],self.decs[indices],position,radius)]
+            selected.append(self.sources[indices])
+        return selected
+
+    def _circle_indices(self,position,radius,trapezoid=False):
+        """Indices of sources within radius of position, remembering the last query,
+        which local_density repeats for each candidate counterpart."""
+        key = (position.ra(),position.dec(),radius,trapezoid)
+        index = self.index
+        if self._last_circle is not None and self._last_circle[0]==key:
+            return self._last_circle[1]
+        indices = index.query(position.ra(),position.dec(),radius)[0]
         if trapezoid:
-            tmask = trap_mask(self.ras,self.decs,position,radius)
-            sources = self.sources[tmask]
-            rmask = fitstools.rad_mask(self.ras[tmask],self.decs[tmask],position,radius,mask_only=True)
-            return sources[rmask]
-        else:
-            rmask = fitstools.rad_mask(self.ras,self.decs,position,radius,mask_only=True)
-            return self.sources[rmask]
+            indices = indices[trap_mask(self.ras[indices],self.decs[indices],position,radius)]
+        self._last_circle = key,indices
+        return indices
 
     def local_density(self,position,radius=4,fom=1.0,trap_mask=False):
         """Return the local density of catalog sources in a radius-degree region about position.
@@ -517,8 +622,8 @@ class Catalog(object):
         Only counts sources with figures of merit >= fom. The default fom for CatalogSources should be 1.,
         so the default fom=0 should not cut anything out.  However, this method ought to be independent
         of the implementation of the fom in CatalogSource, so this should get refactored at some point."""
-        n_sources = sum([1. for source in self.select_circle(position,radius,trapezoid = trap_mask) if
-                         source.fom >= fom])
+        indices = self._circle_indices(position,radius,trapezoid=trap_mask)
+        n_sources = float((self.foms[indices] >= fom).sum())
         #If no sources within radius, set n_sources = 1 to give lower limit on density
         #Maybe better to expand the radius in this case?
         if n_sources < 1 : n_sources = 1
@@ -582,7 +687,8 @@ class Catalog(object):
 class GammaCatalog(Catalog):
     """A catalog of gamma-ray sources (i.e. sources with error circles comparable to LAT)"""
 
-    def __init__(self,class_module,catalog_dir,verbosity = 1):
+    def __init__(self,class_module,catalog_dir,verbosity = 1,index_dir=None):
+        self.index_dir = index_dir
         self.names,lons,lats = self.init(class_module,catalog_dir,verbosity = verbosity)
         errors = self.get_position_errors()
         self.source_mask_radius = 3*max(errors)
@@ -612,7 +718,8 @@ class GammaCatalog(Catalog):
 class ExtendedCatalog(Catalog):
     """A catalog of extended sources"""
 
-    def __init__(self,class_module,catalog_dir,verbosity = 1):
+    def __init__(self,class_module,catalog_dir,verbosity = 1,index_dir=None):
+        self.index_dir = index_dir
         self.names,lons,lats= self.init(class_module,catalog_dir,verbosity = verbosity)
         radii = self.get_radii()
         self.source_mask_radius = max(radii)*3
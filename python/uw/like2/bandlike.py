@@ -9,6 +9,7 @@ import sys, types
 import numpy as np
 from  uw.utilities import keyword_options
 from skymaps import SkyDir
+from . import response
 
 config=None
    
@@ -17,6 +18,7 @@ class BandLike(object):
     """
     defaults = (
         ('quiet', True, 'set False for info'),
+        ('resum_interval', 100, 'number of incremental updates between full sums of the model'),
         )
     @keyword_options.decorate(defaults)
     def __init__(self, band, sources, free, roi, **kwargs):
@@ -29,8 +31,14 @@ class BandLike(object):
            roi reference to the ROI
         """
         keyword_options.process(self, kwargs)
-        # make a list of the Response objects
-        self.bandsources = np.array(map(lambda s: s.response(band, quiet=self.quiet, roi=roi), sources))
+        # make a list of the Response objects, evaluating the PSF for all point sources together
+        ispoint = [s.skydir is not None and not s.isextended for s in sources]
+        values = response.point_pixel_values(band, [s.skydir for s,p in zip(sources,ispoint) if p])
+        rows = iter(values) if values is not None else None
+        def make_response(s, p):
+            kw = dict(pixel_values=rows.next()) if p and rows is not None else dict()
+            return s.response(band, quiet=self.quiet, roi=roi, **kw)
+        self.bandsources = np.array(map(make_response, sources, ispoint))
 
         self.band = band 
         self.event_type_name = config.event_type_name(band.event_type)
@@ -80,6 +88,17 @@ class BandLike(object):
             raise Exception('Source "%s" not found in band sources' %i)
         return self.bandsources[i]
         
+    def initialize_sources(self, bandsources):
+        """ initialize a list of Response objects, evaluating the PSF for all point sources together
+        """
+        points = [bs for bs in bandsources if isinstance(bs, response.PointResponse)]
+        values = response.point_pixel_values(self.band, [bs.source.skydir for bs in points])
+        for i, bs in enumerate(points):
+            bs.initialize(values[i] if values is not None else None)
+        for bs in bandsources:
+            if not isinstance(bs, response.PointResponse):
+                bs.initialize()
+
     @property
     def pixel_dirs(self):
         """ the list of SkyDirs for the pixels with data"""
@@ -102,32 +121,55 @@ class BandLike(object):
         self.model_pixels = self.fixed_pixels.copy()
         for m in self.free_sources:
             self.model_pixels += m.pix_counts
+        self._summed = None # force a full sum at the next update
         
     def update(self, reset=False, force=False, **kwargs):
         """ assume that parameters have changed. Update only contributions 
         from models with free parameters, with changed tag. 
         *must* be called before evaluating likelihood.
+        The model is updated incrementally, by the differences of the contributions of the
+        free sources that were evaluated since the last update; see resum.
 
         reset: bool, default False
             if True, need to reinitialize variable source(s), for change of position or shape
         force: bool, default False
             Force update of response even if source unchanged.
         """
-        self.model_pixels[:]=self.fixed_pixels
-        self.counts = self.fixed_counts
+        if reset:
+            self.initialize_sources(self.free_sources)
         for bandsource in self.free_sources:
             if reset: 
-                bandsource.initialize()
                 bandsource.source.changed=False
             elif bandsource.source.changed or force:
                 bandsource.update()
-            if self.band.has_pixels: 
-                self.model_pixels += bandsource.pix_counts
-                self.counts+= bandsource.counts
- 
-        if self.band.has_pixels: 
-            self.weights = self.data / self.model_pixels
- 
+        if not self.band.has_pixels:
+            self.counts = self.fixed_counts
+            return
+        if reset or force or self._summed is None or self._incremental>=self.resum_interval:
+            self.resum()
+        else:
+            # a Response object replaces its pix_counts array when it is evaluated
+            for i, bandsource in enumerate(self.free_sources):
+                pix_counts, counts = self._summed[i]
+                if bandsource.pix_counts is pix_counts: continue
+                self.model_pixels += bandsource.pix_counts - pix_counts
+                self.counts += bandsource.counts - counts
+                self._summed[i] = (bandsource.pix_counts, bandsource.counts)
+            self._incremental += 1
+        self.weights = self.data / self.model_pixels
+
+    def resum(self):
+        """ set model_pixels and counts from the fixed contribution and all free sources, and save
+        the free source contributions for the incremental updates. Done every resum_interval
+        updates to limit the accumulation of round-off errors
+        """
+        self.model_pixels[:]=self.fixed_pixels
+        self.counts = self.fixed_counts
+        for bandsource in self.free_sources:
+            self.model_pixels += bandsource.pix_counts
+            self.counts+= bandsource.counts
+        self._summed = [(bs.pix_counts, bs.counts) for bs in self.free_sources]
+        self._incremental = 0
 
     def log_like(self):
         """ return the Poisson extended log likelihood """
@@ -248,15 +290,223 @@ class BandLike(object):
                 t.append(0)
         return np.array(t)
 
+    def densities(self, ra, dec, vectors=None):
+        """Return a (sources x positions) array of the counts/sr for all models at a set of positions
+        ra, dec : arrays of float
+        vectors : (n x 3) array of the corresponding unit vectors | None
+        """
+        if vectors is None:
+            vectors = response.unit_vectors(ra, dec)
+        return np.array([bb.densities(ra, dec, vectors) for bb in self.bandsources]).reshape(-1, len(ra))
+
     def __call__(self, skydir):
         """ return the total counts/sr for the given direction
         skydir : Skydir object | (ra,dec) tuple
         
         Note: to get counts, multiply by self.band.pixel_area
         """
-        return np.sum(self.fluxes(skydir)) 
-    
-         
+        return np.sum(self.fluxes(skydir))
+
+
+class PackedBandLike(object):
+    """ Evaluate the likelihood and gradient for a set of BandLike objects in single numpy operations
+
+    The data, fixed background and free-source templates (the pixel_values of each Response)
+    of all the bands are packed into contiguous arrays, with the free-source templates as the columns
+    of a (pixels x free sources) array. The spectral dependence of each free source in each band is
+    described by the (scale, aperture, gradient) tuple returned by Response.spectral_terms, saved in
+    (bands x free sources) and (bands x parameters) arrays which are refreshed only for changed sources.
+
+    The BandLike objects are given views of the packed model_pixels and weights arrays, unless bind is False.
+    """
+    def __init__(self, bandlikes, bind=True):
+        """
+        bandlikes : list of BandLike objects, all with the same set of free sources
+        bind : bool
+            if False, do not modify the BandLike objects: for a temporary object, e.g. to evaluate the hessian
+        """
+        self.bind = bind
+        self.pack(bandlikes)
+
+    def __repr__(self):
+        return '%s.%s: %d bands, %d pixels, %d free sources, %d parameters' % (
+            self.__module__, self.__class__.__name__, len(self.bandlikes), len(self.data),
+            self.templates.shape[1], len(self.par_source))
+
+    def pack(self, bandlikes=None):
+        """ create the arrays. Must be called again if the bands, the free sources,
+        or the pixel_values of any free source change
+        """
+        if bandlikes is not None:
+            self.bandlikes = list(bandlikes)
+        bls = self.bandlikes
+        nb = len(bls)
+        npix = np.array([b.pixels if b.band.has_pixels else 0 for b in bls], int)
+        self.has_pixels = npix>0
+        offsets = np.concatenate([[0], np.cumsum(npix)]).astype(int)
+        self.slices = [slice(a,b) for a,b in zip(offsets[:-1], offsets[1:])]
+        self.starts = offsets[:-1][self.has_pixels] # reduceat indices: only bands with pixels
+        self.band_index = np.repeat(np.arange(nb), npix)
+
+        self.unweight = np.array([b.unweight for b in bls], float)
+        self.exposure_factor = np.array([b.exposure_factor for b in bls], float)
+        self.fixed_counts = np.array([b.fixed_counts for b in bls], float)
+        pixel_bands = [b for b in bls if b.band.has_pixels]
+        self.data = np.concatenate([np.asarray(b.data, float) for b in pixel_bands]+[np.zeros(0)])
+        self.fixed_pixels = np.concatenate([b.fixed_pixels for b in pixel_bands]+[np.zeros(0)])
+
+        # free source templates, and mapping of parameters to free sources
+        free_sources = bls[0].free_sources if nb>0 else []
+        nfs = len(free_sources)
+        self.templates = np.zeros((len(self.data), nfs))
+        for b, sl in zip(bls, self.slices):
+            assert len(b.free_sources)==nfs, 'Inconsistent free sources'
+            if sl.stop==sl.start: continue
+            for j, bs in enumerate(b.free_sources):
+                self.templates[sl, j] = bs.pixel_values
+        npars = [np.sum(bs.spectral_model.free) for bs in free_sources]
+        self.par_source = np.repeat(np.arange(nfs), npars).astype(int)
+        poffsets = np.concatenate([[0], np.cumsum(npars)]).astype(int)
+        self.par_slices = [slice(a,b) for a,b in zip(poffsets[:-1], poffsets[1:])]
+
+        # spectral terms
+        self.scale = np.zeros((nb, nfs))
+        self.aperture = np.zeros((nb, nfs))
+        self.grad = np.zeros((nb, len(self.par_source)))
+        for k, b in enumerate(bls):
+            for j, bs in enumerate(b.free_sources):
+                self._set_terms(k, j, bs)
+
+        # the model, with views for the BandLike objects
+        self.model_pixels = self.fixed_pixels.copy()
+        self.weights = np.zeros(len(self.data))
+        for b, sl in zip(bls, self.slices):
+            if not b.band.has_pixels or not self.bind: continue
+            b.model_pixels = self.model_pixels[sl]
+            b.weights = self.weights[sl]
+        self.evaluate()
+
+    def _set_terms(self, k, j, bandsource):
+        self.scale[k,j], self.aperture[k,j], g = bandsource.spectral_terms()
+        self.grad[k, self.par_slices[j]] = g
+
+    def selects(self, bandlikes):
+        """ True if packed from this list of BandLike objects"""
+        return len(bandlikes)==len(self.bandlikes) \
+            and all(a is b for a,b in zip(bandlikes, self.bandlikes))
+
+    def update(self, reset=False, force=False, **kwargs):
+        """ update the responses of the free sources with changed tag, then the model.
+        Same semantics as BandLike.update
+        """
+        for k, b in enumerate(self.bandlikes):
+            if reset:
+                b.initialize_sources(b.free_sources)
+            for j, bandsource in enumerate(b.free_sources):
+                if reset:
+                    bandsource.source.changed=False
+                elif bandsource.source.changed or force:
+                    bandsource.update()
+                else: continue
+                self._set_terms(k, j, bandsource)
+        if reset:
+            self.pack() # the templates changed
+        else:
+            self.evaluate()
+
+    def evaluate(self):
+        """ set model_pixels, weights and counts from the current spectral terms"""
+        self.model_pixels[:] = self.fixed_pixels
+        if self.templates.shape[1]>0:
+            self.model_pixels += np.einsum('ij,ij->i', self.templates, self.scale[self.band_index])
+        self.weights[:] = self.data / self.model_pixels
+        # as in BandLike.update, free source counts are only added for bands with pixels
+        self.counts = self.fixed_counts + np.where(self.has_pixels, (self.scale*self.aperture).sum(axis=1), 0)
+        if not self.bind: return
+        for b, c in zip(self.bandlikes, self.counts):
+            b.counts = c
+            b._summed = None # BandLike.update must start with a full sum
+
+    def log_like(self, summed=True):
+        """ return the Poisson extended log likelihood, or the array of values for each band"""
+        pix = np.bincount(self.band_index, weights=self.data*np.log(self.model_pixels),
+            minlength=len(self.bandlikes))
+        r = self.unweight * (pix - self.counts * self.exposure_factor)
+        return r.sum() if summed else r
+
+    def coefficients(self):
+        """ (bands x free sources) array of the derivatives of the negative log likelihood
+        with respect to the scale of each source
+        """
+        nb, nfs = self.scale.shape
+        pixterm = np.zeros((nb, nfs))
+        if len(self.starts)>0 and nfs>0:
+            pixterm[self.has_pixels] = np.add.reduceat(
+                self.weights[:,None] * self.templates, self.starts, axis=0)
+        return self.unweight[:,None] * (self.exposure_factor[:,None] * self.aperture - pixterm)
+
+    def gradient(self):
+        """ gradient of the negative log likelihood with respect to the free parameters"""
+        return (self.coefficients()[:, self.par_source] * self.grad).sum(axis=0)
+
+    def hessian(self, curvature=True, delta=1e-6):
+        """ analytic hessian of the negative log likelihood with respect to the free parameters
+
+        The Fisher information term is the sum over pixels of data/model**2 times the products of
+        the derivatives of the model pixel values, each the product of a template and a spectral
+        gradient. 
+        curvature : bool
+            if True, add the terms with second derivatives of the spectral models, see curvature
+        delta : float
+            step used by curvature
+        """
+        nb, nfs = self.scale.shape
+        npar = len(self.par_source)
+        if npar==0: return np.zeros((0,0))
+        wt = self.unweight[self.band_index] * self.data / self.model_pixels**2
+        # per-band products of the templates
+        S = np.zeros((nb, nfs, nfs))
+        for k, sl in enumerate(self.slices):
+            if sl.stop==sl.start: continue
+            T = self.templates[sl]
+            S[k] = np.dot(T.T, wt[sl,None] * T)
+        ps = self.par_source
+        hess = np.einsum('bpq,bp,bq->pq', S[:, ps][:, :, ps], self.grad, self.grad)
+        if curvature:
+            hess += self.curvature(delta)
+        return hess
+
+    def curvature(self, delta=1e-6):
+        """ the hessian terms with second derivatives of the spectral models: block diagonal in the
+        free sources, the products of the coefficients and the derivatives of the spectral gradients.
+        These are evaluated by numerical differences of the spectral gradients: only the Response
+        objects of the source are evaluated, not the pixel sums.
+        """
+        coef = self.coefficients()
+        npar = len(self.par_source)
+        hess = np.zeros((npar, npar))
+        for j, psl in enumerate(self.par_slices):
+            if psl.stop==psl.start: continue
+            bandsources = [b.free_sources[j] for b in self.bandlikes]
+            model = bandsources[0].spectral_model
+            parz = model.get_parameters().copy()
+            try:
+                for i in range(psl.stop-psl.start):
+                    pars = parz.copy()
+                    pars[i] += delta
+                    model.set_parameters(pars)
+                    for k, bs in enumerate(bandsources):
+                        bs.update()
+                        dgrad = (bs.spectral_terms()[2] - self.grad[k, psl]) / delta
+                        hess[psl.start+i, psl] += coef[k,j] * dgrad
+            finally:
+                # the Response objects are shared: always restore the model
+                model.set_parameters(parz)
+                for bs in bandsources:
+                    bs.update()
+        return (hess + hess.T)/2
+
+
 class BandLikeList(list):
     """Manage a list of BandLike objects
     """
@@ -281,12 +531,15 @@ class BandLikeList(list):
         self.sources = roi_sources
         self.bands = roi_bands
         config = roi_bands.config #set global
+        self._packed = None
+        self._unbound = None # (key, PackedBandLike) used by hessian if not packed
         while len(self)>0:
             self.pop()
         for band in roi_bands:
             bl = BandLike(band, self.sources, self.sources.free, self) 
             self.append( bl)
             
+        self.generation = 0 # incremented by update, initialize and selection, to invalidate saved values
         self.set_selected(self)# set selected for a subset?
         self.all_energies = self.energies[:]
         self.roi_dir = roi_bands.roi_dir
@@ -294,6 +547,7 @@ class BandLikeList(list):
     #  the band selection mechanism, used by log_like, update and gradient   
     def set_selected(self, values):
         """setter for the property selected, which must be a subset of self"""
+        self.generation += 1
         if values in self: # single guy
             self._selected = [values]
             return
@@ -338,6 +592,29 @@ class BandLikeList(list):
                  %( energy, etindex, self.energies))
         self.selected = selected_bands
 
+    def set_packed(self, packed=True):
+        """ enable or disable use of a PackedBandLike object for update, log_like and gradient
+        of the selected bands
+        """
+        self._packed = PackedBandLike(self._selected) if packed else None
+
+    @property
+    def packed(self):
+        """ the PackedBandLike object for the selected bands, or None if not enabled"""
+        if self._packed is not None and not self._packed.selects(self._selected):
+            self._packed.pack(self._selected)
+        return self._packed
+
+    def unbound_packed(self):
+        """ a PackedBandLike for the selected bands that does not modify the BandLike objects,
+        kept until the likelihood, the selection or the free sources change
+        """
+        key = (self.generation, tuple(self.sources.free))
+        if self._unbound is None or self._unbound[0]!=key:
+            self._unbound = None # release the previous arrays first
+            self._unbound = (key, PackedBandLike(self._selected, bind=False))
+        return self._unbound[1]
+
     @property
     def free_sources(self):
         """ list of sources with currently free parameters
@@ -413,6 +690,9 @@ class BandLikeList(list):
             else:
                 b.initialize(free if free is not None else self.sources.free)
             b.update()
+        if self._packed is not None:
+            self._packed.pack(self._selected)
+        self.generation += 1
         
     # the following methods sum over the current set of bands
     def log_like(self, summed=True):
@@ -420,24 +700,42 @@ class BandLikeList(list):
         summed : bool, optional
         if false, return the array of likelihods for each band
         """
+        packed = self.packed
+        if packed is not None:
+            return packed.log_like(summed)
         r = np.array([b.log_like() for b in self._selected])
         return  sum(r) if summed else r
         
     def update(self, **kwargs):
-        for b in self._selected: 
-            b.update( **kwargs)
+        packed = self.packed
+        if packed is not None:
+            packed.update(**kwargs)
+        else:
+            for b in self._selected: 
+                b.update( **kwargs)
         self.sources.parameters.clear_changed()
+        self.generation += 1
         
     def gradient(self):
+        packed = self.packed
+        if packed is not None:
+            return packed.gradient()
         return np.array([blike.gradient() for blike in self._selected]).sum(axis=0) 
         
-    def hessian(self, mask=None, delta=1e-6):
+    def hessian(self, mask=None, delta=1e-6, analytic=True):
         """ return a hessian matrix based on the current parameter set
-        This makes a numerical derivative of the analytic gradient, so not exactly
+        If analytic, use PackedBandLike.hessian, assembled from the source pixel values and
+        spectral gradients, so symmetric and with no likelihood updates. If not in packed mode, the
+        PackedBandLike from unbound_packed is used, which does not modify the BandLike objects.
+        Otherwise, this makes a numerical derivative of the analytic gradient, so not exactly
         symmetric, but the the result must be (nearly) symmetric.
         
         mask : [None | array of bool]
             If present, must have dimension of the parameters, will generate a sub matrix
+        delta : float
+            step for the numerical derivatives
+        analytic : bool
+            set False for the numerical derivative
         
         For sigmas and correlation coefficients, invert to covariance
                 cov =  self.hessian().I
@@ -451,6 +749,9 @@ class BandLikeList(list):
         else:
             mask = np.asarray(mask)
             assert len(mask)==len(parz)
+        if analytic:
+            packed = self.packed or self.unbound_packed()
+            return np.matrix(packed.hessian(delta=delta)[np.outer(mask,mask)].reshape(sum(mask),sum(mask)))
         # initial values for the likelihood and gradient
         fzero = self.log_like()
         glast = gzero = self.gradient()[mask]
@@ -556,3 +857,40 @@ class BandLikeList(list):
         f =bl.fluxes((ra,dec) ) 
         fs= f[source_index]
         return fs/(sum(f))
+
+    def source_weights(self, source_index, ra, dec, energy, et):
+        """ Return arrays of the weights for a source, and of the total model counts/sr, for a set of photons
+
+        The photons are grouped by band, and the densities of all the sources are evaluated for each group
+        as arrays, rather than one photon at a time as in source_weight.
+
+        source_index : integer | string  | None
+            if string, look up source (allow wild cards)
+            if None, assume already selected
+        ra, dec, energy: arrays of float
+        et : array of int, the event type of each photon, e.g. (0,1) for (front,back)
+
+        Photons not in a band, or outside the ROI, have zero weight and total
+        """
+        try:
+            source_index = int(source_index)
+        except (ValueError, TypeError):
+            self.sources.find_source(source_index)
+            source_index=self.sources.selected_source_index
+        ra, dec, energy = [np.asarray(x, float).ravel() for x in (ra, dec, energy)]
+        et = np.asarray(et, int).ravel()
+        vectors = response.unit_vectors(ra, dec)
+        signal, total = np.zeros(len(energy)), np.zeros(len(energy))
+        for bl in self:
+            band = bl.band
+            sel = (et==band.event_type) & (energy>band.emin) & (energy<=band.emax)
+            if not np.any(sel): continue
+            center = response.unit_vectors(band.skydir.ra(), band.skydir.dec())[0]
+            sel[sel] = np.dot(vectors[sel], center) >= np.cos(band.radius_in_rad)
+            if not np.any(sel): continue
+            f = bl.densities(ra[sel], dec[sel], vectors[sel])
+            signal[sel] = f[source_index]
+            total[sel] = f.sum(axis=0)
+        weights = np.zeros(len(energy))
+        np.divide(signal, total, out=weights, where=total>0)
+        return weights, total
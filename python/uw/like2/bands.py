@@ -58,6 +58,14 @@ class EnergyBand(object):
         self.pix_counts = np.asarray([x.weight() for x in self.wsdl]) if len(self.wsdl)>0 else []
         self.pixel_area = cband.pixelArea()
         self.cband=cband
+        self._pixel_vectors = None
+    @property
+    def pixel_vectors(self):
+        """ (pixels x 3) array of unit vectors, equatorial, for the pixels with data"""
+        if getattr(self, '_pixel_vectors', None) is None:
+            ra, dec = np.array([(w.ra(), w.dec()) for w in self.wsdl], float).reshape(-1,2).T
+            self._pixel_vectors = np.array(healpy.dir2vec(ra, dec, lonlat=True)).T
+        return self._pixel_vectors
     @property
     def radius_in_rad(self): return np.radians(self.radius)
     @property #alias, for compatibilty, but deprecated
@@ -5,7 +5,7 @@ Manage the analysis configuration
 import os, sys, types, StringIO, pprint, yaml
 import numpy as np
 from uw.irfs import irfman
-from . import ( dataset, exposure, psf, from_xml)
+from . import ( dataset, exposure, psf, from_xml, response, convolution)
 import skymaps
 from uw.utilities import keyword_options
         
@@ -150,15 +150,28 @@ class Configuration(dict):
         # use dataset to extract psf and exposure, set up respective managers
         
         exposure_correction=datadict.pop('exposure_correction', None) if datadict is not None else None 
+        exposure_cache = config.get('exposure_cache', None)
+        if exposure_cache is not None:
+            exposure_cache = convolution.GridCache(exposure_cache, quiet=self.quiet,
+                context=dict(irf=irf, dataset=self.dataset.name, 
+                    ltcube=convolution.file_signature(self.dataset.ltcube)))
         if self.use_old_irf_code:
             self.exposureman = exposure.ExposureManager(self.dataset,
-                 exposure_correction=exposure_correction)
+                 exposure_correction=exposure_correction, exposure_cache=exposure_cache)
             self.psfman = psf.PSFmanager(self.dataset)
             self.irfs=None
         else:       
             self.irfs = irfman.IrfManager(self.dataset, 
-                irf_dir=self.caldb, irfname=self.dataset.irf)
+                irf_dir=self.caldb, irfname=self.dataset.irf, exposure_cache=exposure_cache)
         
+        # optional persistent cache of convolved diffuse grids
+        grid_cache = config.get('grid_cache', None)
+        if grid_cache is not None:
+            response.grid_cache = convolution.GridCache(grid_cache, quiet=self.quiet,
+                context=dict(irf=irf, dataset=self.dataset.name, 
+                    ltcube=convolution.file_signature(self.dataset.ltcube)))
+            if not self.quiet: print response.grid_cache
+
         # check location of model
         # possibilites are the all-sky pickle.zip, from which any ROI can be extraccted, or a specific set of
         #   sources in an XML file, which is either external or generated from a HEALPix ROI
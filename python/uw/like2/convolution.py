@@ -13,18 +13,41 @@ from uw.utilities import keyword_options
 from uw.utilities import convolution as utilities_convolution
 
 import skymaps #from Science Tools: for SkyDir 
+from . import diffuse
 
 class FillMixin(object):
     """A Mixin class for like2 convolution, to replace functions in utilities.convolution
     """
+    @property
+    def unit_vectors(self):
+        """ (npix*npix x 3) array of the equatorial unit vectors of the grid points, in the order of fill.
+        The grid is defined on the galactic equator at the longitude of the center, then rotated to
+        the latitude of the center about the axis perpendicular to the center meridian.
+        """
+        lon, lat = np.meshgrid(np.radians(list(self.lons)), np.radians(list(self.lats)), indexing='ij')
+        v = np.array([np.cos(lat)*np.cos(lon), np.cos(lat)*np.sin(lon), np.sin(lat)]).reshape(3,-1)
+        l0, b = np.radians(self.clon), np.radians(self.center.b())
+        K = np.array([[0, 0, np.cos(l0)], [0, 0, np.sin(l0)], [-np.cos(l0), -np.sin(l0), 0]])
+        R = np.eye(3) - np.sin(b)*K + (1-np.cos(b))*np.dot(K,K)
+        return np.dot(np.dot(R, v).T, diffuse.equatorial_to_galactic)
+
     def fill(self, skyfun):
         """ Evaluate skyfun along the internal grid and return the resulting array.
         (Identical to superclass, except skyfun can be either a python functor or a 
         C++ SkySkySpectrum)
+        Avoids calls to python for each grid point if skyfun implements either, in order of preference,
+            evaluate(unit_vectors) : the vectorized sky function protocol, see diffuse.DiffuseBase
+            skyspectrum() : returns (SkySpectrum, factor), a C++ object with energy set and a constant
         """
         v = np.empty(self.npix*self.npix)
         if isinstance(skyfun, skymaps.SkySpectrum):
             skymaps.PythonUtilities.val_grid(v,self.lons,self.lats,self.center,skyfun)
+        elif hasattr(skyfun, 'evaluate'):
+            v[:] = skyfun.evaluate(self.unit_vectors)
+        elif hasattr(skyfun, 'skyspectrum'):
+            spectrum, factor = skyfun.skyspectrum()
+            skymaps.PythonUtilities.val_grid(v,self.lons,self.lats,self.center,spectrum)
+            v *= factor
         else:
             def pyskyfun(u):
                 return skyfun(skymaps.SkyDir(skymaps.Hep3Vector(u[0],u[1],u[2])))
@@ -43,6 +66,8 @@ class FillMixin(object):
         if dm is None:
             assert cache is not None, 'Logic error'
             self.bg_vals = self.fill(exp) * cache
+        elif hasattr(dm, 'evaluate'):
+            self.bg_vals = self.fill(exp) * self.fill(dm)
         else:
             def exp_dm(skydir):
                     return exp(skydir)*dm(skydir)
@@ -61,10 +86,19 @@ class FillMixin(object):
             
     def psf_fill(self, psf):
         """ Evaluate PSF on the grid
+        The kernel and its spectrum are cached by (PSF manager, energy, event type, npix, pixelsize)
+        if the psf object has energy and event_type attributes, and a reference to its manager,
+        which identifies the IRF
         """
         #print 'filling with psf %s' % psf
-        psf_vals = psf(self.dists).reshape([self.npix,self.npix])
-        self.psf_vals = psf_vals / psf_vals.sum()
+        def fill():
+            psf_vals = psf(self.dists).reshape([self.npix,self.npix])
+            return psf_vals / psf_vals.sum()
+        key = None
+        manager = getattr(psf, 'psfman', getattr(psf, 'parent', None))
+        if hasattr(psf, 'energy') and hasattr(psf, 'event_type'):
+            key = (psf.energy, psf.event_type, self.npix, self.pixelsize)
+        self.set_kernel(*utilities_convolution.cached_kernel(key, fill, manager))
         
     def set_npix(self, psf, edge=0, r_multi=1.2, r_max=20):
         """ modify the npix with
@@ -136,7 +170,7 @@ class ShowMixin(object):
         norm = LogNorm(vmax=vmax, vmin=vmax/1e3)
         marker = float(self.npix)/2
         for ax,what in zip(axx[1:], (self.bg_vals, self.cvals)  ):
-            what[what==0]=vmax/1e6
+            what = np.where(what==0, vmax/1e6, what) # cached grids are read-only
             ax.imshow(what.transpose()[::-1], norm=norm, interpolation='nearest')
             ax.axvline(marker,color='grey')
             ax.axhline(marker,color='grey')
@@ -178,6 +212,108 @@ class ConvolvableGrid(FillMixin, ShowMixin, utilities_convolution.BackgroundConv
         return '%s.%s: center %s npix %d pixelsize %.2f' %(
             self.__module__,self.__class__.__name__, self.center, self.npix, self.pixelsize)
 
+def file_signature(filename):
+    """ return a tuple (path, size, modification time) identifying the contents of a file,
+    or the argument itself if not an existing file. A list is processed element by element
+    """
+    if isinstance(filename, (list, tuple)):
+        return tuple(map(file_signature, filename))
+    if not isinstance(filename, str): return filename
+    path = os.path.expandvars(filename)
+    if not os.path.isfile(path): return filename
+    st = os.stat(path)
+    return (os.path.abspath(path), st.st_size, int(st.st_mtime))
+
+class GridCache(object):
+    """ Persistent, content-addressed cache of convolved grids
+
+    Each entry is a .npy file in the cache folder, named by a hash of a key dict describing
+    everything that determines its contents, and opened by memory-mapping.
+    Entries are evicted, least recently used first, to keep the total size below max_size,
+    and if not used for more than max_age days.
+    """
+    defaults = (
+        ('max_size', 20., 'maximum total size, in GB'),
+        ('max_age',  None, 'if set, remove entries not used for this many days'),
+        ('quiet',    True, ''),
+        )
+    @keyword_options.decorate(defaults)
+    def __init__(self, path, context=None, **kwargs):
+        """
+        path : string
+            folder for the cache files, created if necessary
+        context : dict | None
+            items common to all keys, such as the IRF and livetime cube
+        """
+        keyword_options.process(self, kwargs)
+        self.path = os.path.expandvars(path)
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        self.context = context if context is not None else dict()
+        self.hits = self.misses = 0
+        self.evict()
+
+    def __repr__(self):
+        return '%s.%s: %s, %d hits, %d misses' % (self.__module__, self.__class__.__name__,
+            self.path, self.hits, self.misses)
+
+    def filename(self, key):
+        """ the file for the key dict """
+        import hashlib
+        t = dict(self.context); t.update(key)
+        digest = hashlib.sha1(repr(sorted(t.items()))).hexdigest()
+        return os.path.join(self.path, digest+'.npy')
+
+    def get(self, key):
+        """ return a read-only memory-mapped array for the key, or None if not in the cache"""
+        fn = self.filename(key)
+        try:
+            ret = np.load(fn, mmap_mode='r')
+        except IOError:
+            self.misses +=1
+            return None
+        os.utime(fn, None) # mark as recently used
+        self.hits +=1
+        return ret
+
+    def put(self, key, array):
+        """ save the array for the key. Written to a temporary file and renamed,
+        so that concurrent jobs never see a partial entry
+        """
+        fn = self.filename(key)
+        tmp = '%s.%d.tmp' % (fn, os.getpid())
+        with open(tmp, 'wb') as out:
+            np.save(out, np.asarray(array))
+        os.rename(tmp, fn)
+
+    def __call__(self, key, fill):
+        """ return the cached array for key; if missing, call fill() and save the result"""
+        ret = self.get(key)
+        if ret is None:
+            ret = fill()
+            self.put(key, ret)
+        return ret
+
+    def evict(self):
+        """ remove old entries, and least recently used entries beyond max_size"""
+        import time, glob
+        entries = []
+        for fn in glob.glob(os.path.join(self.path, '*.npy')):
+            st = os.stat(fn)
+            entries.append((st.st_mtime, st.st_size, fn))
+        entries.sort(reverse=True)
+        total = 0; removed = 0
+        now = time.time()
+        for mtime, size, fn in entries:
+            total += size
+            if total > self.max_size*2**30 or \
+                    (self.max_age is not None and now-mtime > self.max_age*86400):
+                try:
+                    os.remove(fn); removed +=1
+                except OSError: pass # perhaps removed by another job
+        if removed>0 and not self.quiet:
+            print '%s: evicted %d entries' % (self, removed)
+
 def spherical_harmonic(f, lmax, thetamax=45):
     """ Calculate spherical harmonics for a function f, l<=lmax
     thetamax : float, optionial. units degrees
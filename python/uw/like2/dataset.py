@@ -196,7 +196,7 @@ class DataSet(dataman.DataSpec):
         # new IRF management
         self.CALDBManager = caldb.CALDB(CALDB_dir=self.CALDB, irfname=self.irf)
         if self.exposure_cube is None:
-            ltcubes = glob.glob(self.ltcube) #allow for more than one
+            self.ltcubes = ltcubes = glob.glob(self.ltcube) #allow for more than one
             self.lt = [skymaps.LivetimeCube(lt,weighted=False) for lt in ltcubes]
             if self.use_weighted_livetime:
                 self.weighted_lt = [skymaps.LivetimeCube(lt,weighted=True) for lt in ltcubes]
@@ -212,6 +212,12 @@ class DataSet(dataman.DataSpec):
         assert len(self.lt)==len(self.event_types), 'Expected 4 live time cubes'
         return self.lt[event_type-self.event_types[0]]
 
+    def livetime_file(self, event_type):
+        """return the file name of the livetime cube returned by livetime_cube"""
+        if not self.psf_event_types or len(self.ltcubes)==1:
+            return self.ltcubes[0]
+        return self.ltcubes[event_type-self.event_types[0]]
+
     def _process_dataset(self, dataset, binfile=None, interval=None, month=None, quiet=False):
         """ Parse the dataset as a string lookup key, or a dict
             interval: string
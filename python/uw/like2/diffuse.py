@@ -8,6 +8,7 @@ author:  Toby Burnett
 import os, types, collections, zipfile, pickle, glob
 import numpy as np
 import skymaps #from Science Tools: for SkyDir, DiffuseFunction, IsotropicSpectrum
+import healpy
 import pandas as pd
 from astropy.io import fits
 from astropy import wcs
@@ -22,6 +23,28 @@ class DiffuseException(Exception):pass
 
 normalization = None # global for the dict with normalization factors to apply
 
+# rotation matrix from equatorial (J2000) to galactic unit vectors
+equatorial_to_galactic = np.array([
+    [-0.0548755604162154, -0.8734370902348850, -0.4838350155487132],
+    [ 0.4941094278755837, -0.4448296299600112,  0.7469822444972189],
+    [-0.8676661490190047, -0.1980763734312015,  0.4559837761750669]])
+
+def galactic_vectors(unit_vectors):
+    """ convert an (n x 3) array of equatorial unit vectors to galactic"""
+    return np.dot(unit_vectors, equatorial_to_galactic.T)
+
+def log_interpolate(u, v, a):
+    """ logarithmic interpolation between arrays u and v with fraction a, using u or v alone if a is 
+    near 0 or 1, or if the other is not positive. Negative results are set to zero, NaN is kept
+    for the caller to check. Same as the scalar HealpixCube.__call__
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        w = np.exp( np.log(u) * (1-a) + np.log(v) * a )
+        use_u = (np.abs(a) < 1e-2) | (v<=0) | np.isnan(v)
+        use_v = ~use_u & ((np.abs(1-a)< 1e-2) | (u<=0) | np.isnan(u))
+        ret = np.where(use_u, u, np.where(use_v, v, w))
+        return np.where((ret>0) | np.isnan(ret), ret, 0)
+
 class DiffuseBase(object):
     """Base class for global diffuse sources
     expect subclasses to implement SkySpectrum interface
@@ -67,6 +90,13 @@ class DiffuseBase(object):
     @property
     def name(self):
         return self.__class__.__name__
+
+    def evaluate(self, unit_vectors, energy=None):
+        """ return an array of values for an (n x 3) array of equatorial unit vectors.
+        This is the vectorized sky function protocol, used to fill convolution grids. Subclasses 
+        should override it; this version calls the SkySpectrum interface for each direction.
+        """
+        return np.array([self(skymaps.SkyDir(skymaps.Hep3Vector(*u)), energy) for u in unit_vectors])
         
     def show(self, title=None, scale='log', **kwargs):
         """make an AIT image for testing
@@ -152,6 +182,9 @@ class Isotropic(DiffuseBase):
         return np.exp(    np.log(self.spectrum[i])   * (1-a) 
                         + np.log(self.spectrum[i+1]) * a     ) 
 
+    def evaluate(self, unit_vectors, energy=None):
+        return np.full(len(unit_vectors), self(None, energy))
+
 
 class MapCube(DiffuseBase, skymaps.DiffuseFunction):
     """ wrapper for eventual invocation of skymaps.DiffuseFunction, which interprets a map cube
@@ -186,7 +219,8 @@ class HealpixCube(DiffuseBase):
             
     def load(self):
         try:
-            self.hdulist = hdus = fits.open(self.fullfilename)
+            # memory-mapped: columns are views into the file, only the pages used are read
+            self.hdulist = hdus = fits.open(self.fullfilename, memmap=True)
             if hdus[2].columns[0].name=='CHANNEL':
                 # binned format: assume next 2 columns are min, max and use geometric mean
                 emin,emax = [hdus[2].data.field(i) for i in (1,2)]
@@ -237,7 +271,21 @@ class HealpixCube(DiffuseBase):
             ret = 0
         return ret
 
+    def evaluate(self, unit_vectors, energy=None):
+        g = galactic_vectors(unit_vectors)
+        return self.values(healpy.vec2pix(self.nside, g[:,0], g[:,1], g[:,2]), energy)
 
+    def values(self, skyindex, energy=None):
+        """ return an array of values for an array of HEALPix (RING) indices, at the energy if specified,
+        else the current energy. Only the selected pixels of the two energy planes are read and interpolated
+        """
+        if energy is not None and energy!=self.energy: 
+            self.setEnergy(energy)
+        skyindex = np.asarray(skyindex, int)
+        ret = log_interpolate(self.eplane1[skyindex], self.eplane2[skyindex], self.energy_interpolation)
+        assert np.all(np.isfinite(ret)), 'Not finite for {} MeV at pixels {}'.format(self.energy,
+            skyindex[~np.isfinite(ret)][:10])
+        return ret
 
     def setEnergy(self, energy): 
         # set up logarithmic interpolation
@@ -345,6 +393,25 @@ class FitsMapCube(DiffuseBase):
         
         return ret
 
+    def evaluate(self, unit_vectors, energy=None):
+        if energy is not None and energy!=self.energy: 
+            self.setEnergy(energy)
+        x,y,z = np.asarray(unit_vectors).T
+        ra, dec = np.degrees(np.arctan2(y,x)) % 360, np.degrees(np.arcsin(np.clip(z,-1,1)))
+        pix = np.array(self.w.wcs_world2pix(np.array([ra, dec, np.ones(len(ra))]).T, 0)[:,:2], int)
+        inside = np.all((pix>=0) & (pix<self.naxis), axis=1)
+        i, j = pix[inside].T
+        a = self.energy_interpolation
+        f1, f2 = self.eplane1[j,i], self.eplane2[j,i]
+        if np.abs(a)<1e-2: f = f1
+        elif np.abs(1-a)< 1e-2: f = f2
+        else: 
+            with np.errstate(divide='ignore'):
+                f = np.exp( np.log(f1) * (1-a) + np.log(f2) * a  )
+        ret = np.zeros(len(pix))
+        ret[inside] = np.where((f1==0) | (f2==0), 0, f)
+        return ret
+
 class FitsMapCubeList():
     def __init__(self, filename):
         filenames = open(filename).read().split('\r\n')
@@ -356,6 +423,8 @@ class FitsMapCubeList():
             cube.load()
     def __call__(self, skydir, energy=None):
         return sum([cube(skydir, energy) for cube in self.cubelist])
+    def evaluate(self, unit_vectors, energy=None):
+        return sum([cube.evaluate(unit_vectors, energy) for cube in self.cubelist])
     def __repr__(self):
         r =self.__class__.__name__ +': Sum of: '
         for cube in self.cubelist:
@@ -478,6 +547,8 @@ class IsotropicSpectralFunction(DiffuseBase):
         return '%s: %s' % (self.__class__.__name__, self.expression )
     def __call__(self, skydir, energy=None):
         return self.spectral_function(self.energy if energy is None else energy)
+    def evaluate(self, unit_vectors, energy=None):
+        return np.full(len(unit_vectors), self(None, energy))
     def setEnergy(self, energy): self.energy=energy
 
 
@@ -493,6 +564,9 @@ class PieceWise(object):
             if x<self.a[i+1]:
                 return self.b[i]+(x-self.a[i])*self.s[i]
         return self.b[-1]
+    def evaluate(self, x):
+        """ array version of __call__"""
+        return np.interp(x, self.a, self.b)
 
 class AziLimb(IsotropicSpectralFunction):
     """ Azimuthally symmetric Limb function
@@ -528,6 +602,11 @@ class AziLimb(IsotropicSpectralFunction):
         dec = skydir.dec() # only depends on DEC
         return spec * self.limbfun( np.sin(np.radians(dec))  ) 
 
+    def evaluate(self, unit_vectors, energy=None):
+        spec = self.spectral_function(self.energy if energy is None else energy)
+        # z component is sin(dec)
+        return spec * self.limbfun.evaluate(np.asarray(unit_vectors)[:,2])
+
 class GulliLimb(DiffuseBase):
     """Implement the (internal?) text version of Gulli's RA-independent diffuse
     """
@@ -565,6 +644,12 @@ class GulliLimb(DiffuseBase):
         spec = self.spec_fun[dindex]( energy /100.)
         return spec 
 
+    def evaluate(self, unit_vectors, energy=None):
+        if energy is None: energy=self.energy
+        spec = np.array([f(energy/100.) for f in self.spec_fun])
+        dec = np.degrees(np.arcsin(np.clip(np.asarray(unit_vectors)[:,2], -1, 1)))
+        return spec[np.clip(((dec+90.)/2.).astype(int), 0, 89)]
+
 
 class CachedMapCube(DiffuseBase):
     """ for compatibility with previous models"""
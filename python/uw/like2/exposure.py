@@ -3,8 +3,9 @@ Implements exposure calcuations
 
 $Header: /nfs/slac/g/glast/ground/cvs/pointlike/python/uw/like2/exposure.py,v 1.6 2017/08/02 22:57:11 burnett Exp $
 """
-import os
+import os, glob
 import numpy as np
+import healpy
 import skymaps
 from astropy.io import fits as  pyfits
 
@@ -24,7 +25,12 @@ class ExposureManager(object):
             
         datadict['exposure_correction'] : list of strings defining functions of energy
             the correction factors to apply to front, back 
+        datadict['exposure_cache'] : convolution.GridCache or None
+            if set, the exposure for each band is computed for all HEALPix pixels of the 
+            livetime cube with irfs.exposure.HealpixExposure, and kept in this cache
         """
+        self.exposure_cache = datadict.pop('exposure_cache', None)
+        self.healpix_setup = None
 
         def make_exposure():
             if dataset.exposure_cube is not None:
@@ -43,17 +49,23 @@ class ExposureManager(object):
             if pyfits.open(aeff_files[0])[1].name != 'EFFECTIVE AREA':
                  # new format with combined 
                 self.ea  = [skymaps.EffectiveArea('', file, 'EFFECTIVE AREA_'+name) for file,name in zip(aeff_files, type_names)]
+                eff_params = [(file, 'EFFICIENCY_PARAMS_'+name) for file,name in zip(aeff_files, type_names)]
             else:
                 self.ea  = [skymaps.EffectiveArea('', file) for file in aeff_files]
+                eff_params = [(file, 'EFFICIENCY_PARAMS') for file in aeff_files]
             if dataset.verbose: print ' -->effective areas at 1 GeV: ', \
                     ['%s: %6.1f'% (type_names[i],self.ea[i](1000)) for i in range(len(type_names))]
             
-            if dataset.use_weighted_livetime and hasattr(dataset, 'weighted_lt'):
+            weighted = dataset.use_weighted_livetime and hasattr(dataset, 'weighted_lt')
+            self.healpix_setup = dict(ltcubes=sorted(glob.glob(dataset.ltcube)), eff_params=eff_params, 
+                cthetamin=np.cos(np.radians(dataset.thetacut)), weighted=weighted)
+            if weighted:
                 return [skymaps.Exposure(dataset.lt,dataset.weighted_lt,ea) for ea in self.ea]
             else:
                 return  [skymaps.Exposure(dataset.lt,ea) for ea in self.ea]
                 
         self.exposure = make_exposure()
+        self.tables = dict()
 
         correction = datadict.pop('exposure_correction', None)
         if correction is not None:
@@ -67,7 +79,44 @@ class ExposureManager(object):
             
     def value(self, sdir, energy, event_type):
         return self.exposure[event_type].value(sdir, energy)*self.correction[event_type](energy)
+    
+    def table(self, event_type, energies):
+        """Return the ExposureTable for the event type and set of energies, usually those of a band, 
+        creating it if needed
+        """
+        key = (event_type,) + tuple(np.round(energies, 6))
+        if key not in self.tables:
+            self.tables[key] = ExposureTable(self, event_type, energies)
+        return self.tables[key]
+    
+    def healpix_exposure(self, event_type, energies):
+        """Return an array (npix, len(energies)) of uncorrected exposure at the center of each pixel
+        of the livetime cube, from the exposure cache, or None if not enabled
+        """
+        if self.exposure_cache is None or self.healpix_setup is None: return None
+        from uw.irfs import exposure as irfs_exposure
+        from uw.irfs.effective_area import efficiency_factors
+        setup = self.healpix_setup
+        def fill():
+            filename, extension = setup['eff_params'][event_type]
+            try:
+                pars = pyfits.getdata(filename, extension).field('EFFICIENCY_PARS')
+                factors = lambda energies: efficiency_factors(pars, energies)
+            except KeyError:
+                factors = lambda energies: None
+            return irfs_exposure.HealpixExposure(setup['ltcubes'], self.ea[event_type], energies,
+                cthetamin=setup['cthetamin'], weighted=setup['weighted'], livetime_factors=factors).values
+        key = dict(kind='exposure', event_type=event_type, energies=tuple(np.round(energies, 6)),
+            cthetamin=setup['cthetamin'], weighted=setup['weighted'])
+        return self.exposure_cache(key, fill)
+
+    def values(self, sdirs, energies, event_type):
+        """Return corrected exposure for a SkyDir or list of SkyDirs and an array of energies
+            array with shape (len(energies),) for a single SkyDir, else (len(sdirs), len(energies))
+        """
+        return self.table(event_type, energies)(sdirs)
         
+
     def __call__(self, event_type, energy=1000):
         """Return a SkySpectrum-compatible object of the exposure for the given event type (e.g., front or back)
         """
@@ -84,6 +133,16 @@ class ExposureManager(object):
                 return self.eman.value(sdir, e, self.et)
             def setEnergy(self, e):
                 self.energy=e
+            def spectrum(self, sdirs, energies):
+                """ return exposure for a SkyDir, or list of SkyDirs, at each of the energies
+                """
+                return self.eman.values(sdirs, energies, self.et)
+            def skyspectrum(self):
+                """ return (SkySpectrum, factor) for evaluation of a grid in C++
+                """
+                exposure = self.eman.exposure[self.et]
+                exposure.setEnergy(self.energy)
+                return exposure, self.eman.correction[self.et](self.energy)
             def model_integral(self, skydir, func,  emin, emax):
                 """ return the integral of func(e)*exp(e) from emin to emax
                 """
@@ -119,6 +178,53 @@ class ExposureCorrection(object):
         plt.setp(ax, xscale='log', xlim=(dom[0], dom[-1]))
 
 
+class ExposureTable(object):
+    """ Corrected exposure for one event type at a fixed set of energies, usually the Simpson points of a band.
+    
+    The values for a direction are calculated once, and reused by every ROI and response that
+    needs that direction, e.g., a source that appears in the models of neighboring ROIs.
+    If the manager has an exposure cache, they are looked up in the precomputed all-sky array, 
+    for all the new directions at once. Otherwise, each value is a call to the C++ exposure for a
+    direction and an energy: the table only avoids repeating them, and the vectorized speedup 
+    depends on the 'exposure_cache' configuration key.
+    """
+    def __init__(self, eman, event_type, energies):
+        self.exposure = eman.exposure[event_type]
+        self.energies = np.asarray(energies, float)
+        self.correction = np.array([eman.correction[event_type](e) for e in self.energies])
+        self.table = dict()
+        self.cube = eman.healpix_exposure(event_type, self.energies)
+        
+    def __repr__(self):
+        return '%s.%s: %d energies from %.0f to %.0f MeV, %d directions' % (self.__module__, 
+            self.__class__.__name__, len(self.energies), self.energies[0], self.energies[-1], len(self.table))
+        
+    def fill(self, sdirs):
+        """ return an array (len(sdirs), len(energies)) of uncorrected exposure for new directions:
+        a single lookup in the cube if present, else len(sdirs)*len(energies) C++ calls
+        """
+        if self.cube is not None:
+            ra, dec = np.array([(sd.ra(), sd.dec()) for sd in sdirs]).reshape(-1,2).T
+            pix = healpy.ang2pix(healpy.npix2nside(len(self.cube)), np.radians(90-dec), np.radians(ra), nest=True)
+            return np.asarray(self.cube[pix])
+        value = self.exposure.value
+        return np.array([[value(sd, e) for e in self.energies] for sd in sdirs]).reshape(-1, len(self.energies))
+        
+    def __call__(self, sdirs):
+        """ sdirs : SkyDir or list of SkyDirs
+        """
+        single = hasattr(sdirs, 'ra')
+        if single: sdirs = [sdirs]
+        keys = [(sd.ra(), sd.dec()) for sd in sdirs]
+        new = [i for i,key in enumerate(keys) if key not in self.table]
+        if len(new)>0:
+            values = self.fill([sdirs[i] for i in new]) * self.correction
+            for i,v in zip(new, values):
+                self.table[keys[i]] = v
+        ret = np.array([self.table[key] for key in keys])
+        return ret[0] if single else ret
+        
+
 class ExposureIntegral(object):
 
     nsp_simps =16#4 # reduced from original 16
@@ -129,7 +235,10 @@ class ExposureIntegral(object):
             note that exposure is evaluated at the skydir
         """
         self.sp_points = sp = np.logspace(np.log10(emin),np.log10(emax),self.nsp_simps+1)
-        exp_points     = map(lambda e: exp(skydir, e), sp)
+        if hasattr(exp, 'spectrum'):
+            exp_points = exp.spectrum(skydir, sp)
+        else:
+            exp_points = map(lambda e: exp(skydir, e), sp)
         # following may be marginally faster, but not implemented for exposure cube
         #exp_points      = np.asarray(self.exp.vector_value(self.sd,DoubleVector(sp)))
         simps_weights  = (np.log(sp[-1]/sp[0])/(3.*self.nsp_simps)) * \
@@ -22,6 +22,23 @@ import astropy
 warnings.filterwarnings('ignore', category=astropy.wcs.FITSFixedWarning)
 warnings.filterwarnings('ignore', category=astropy.io.fits.verify.VerifyWarning,)
 
+def ft1_event_type(data, event_types=(0,1)):
+    """ return an array of the event type of each photon in an FT1 table, for the event types used
+    for the bands, or -1 if none. Uses the EVENT_TYPE bit mask (Pass 8) if present, else CONVERSION_TYPE.
+    A photon in more than one of the event types is assigned to the first.
+    """
+    names = data.names
+    if 'EVENT_TYPE' not in names:
+        return np.asarray(data.field('CONVERSION_TYPE'), int)
+    bits = np.asarray(data.field('EVENT_TYPE'))
+    if bits.dtype==bool:
+        # a 32X column: array of bool, most significant bit first
+        bits = np.dot(bits.astype(np.int64), 1<<np.arange(bits.shape[1])[::-1])
+    ret = np.full(len(bits), -1, int)
+    for et in event_types[::-1]:
+        ret[(bits>>et)&1==1] = et
+    return ret
+
 class ROI(views.LikelihoodViews):
     """ROI analysis
     This is a list of the properties and functions appropriate for user analysis of an ROI
@@ -64,6 +81,7 @@ class ROI(views.LikelihoodViews):
     freeze -- freeze a parameter
     set_model -- change the spectral model for a source
     thaw -- thaw (unfreeze) a parameter
+    write_weights -- add columns with the weights for a source to FT1 files
 
 
     plot/print
@@ -84,6 +102,7 @@ class ROI(views.LikelihoodViews):
         ('quiet', True, 'set to suppress output'),
         ('load_kw', {'rings':2, 'tsmin':0}, 'a dict specific for the loading'),
         ('postpone', False, 'Set True to not load data until requested'),
+        ('packed_likelihood', False, 'Set True to evaluate likelihood and gradient with a bandlike.PackedBandLike'),
     )
 
     @keyword_options.decorate(defaults)
@@ -136,6 +155,8 @@ class ROI(views.LikelihoodViews):
         roi_bands = bands.BandSet(config, roi_index)
         roi_bands.load_data()
         super(ROI, self).__init__( roi_bands, roi_sources)
+        if self.packed_likelihood:
+            self.set_packed()
     
     def __repr__(self):
         if hasattr(self, 'sources'):
@@ -353,6 +374,49 @@ class ROI(views.LikelihoodViews):
         """ Return the total predicted counts for the specified, or default source
         """
         return sum(self.get_counts(source_name))
+
+    def write_weights(self, ft1files, source_name=None, colnames=('WEIGHT','TOTAL'), chunk_size=1000000):
+        """ Add, or replace, columns with the weight for the source, and the total model counts/sr,
+        for every photon in a set of FT1 files, using the current state of the model
+
+        ft1files : string | list of strings
+            file names, perhaps with wildcards
+        source_name : string | None
+        colnames : names for the weight and total columns
+        chunk_size : int
+            number of photons to process together
+        """
+        from astropy.io import fits
+        if isinstance(ft1files, str):
+            ft1files = sorted(glob.glob(ft1files))
+        source = self.sources.find_source(source_name)
+        event_types = sorted(set(bl.band.event_type for bl in self))
+        for ft1 in ft1files:
+            hdus = fits.open(ft1, memmap=False)
+            events = hdus['EVENTS']
+            data = events.data
+            n = len(data)
+            weights, total = np.zeros(n, np.float32), np.zeros(n, np.float32)
+            for i in range(0, n, chunk_size):
+                chunk = data[i:i+chunk_size]
+                weights[i:i+chunk_size], total[i:i+chunk_size] = self.source_weights(source.name,
+                    chunk.field('RA'), chunk.field('DEC'), chunk.field('ENERGY'), 
+                    ft1_event_type(chunk, event_types))
+            names = data.names
+            new_cols = []
+            for name, values in zip(colnames, (weights, total)):
+                if name in names:
+                    data.field(name)[:] = values
+                else:
+                    new_cols.append(fits.Column(name=name, format='E', array=values))
+            if len(new_cols)>0:
+                hdus['EVENTS'] = fits.BinTableHDU.from_columns(events.columns + fits.ColDefs(new_cols),
+                     header=events.header, name='EVENTS')
+            hdus.writeto(ft1, clobber=True)
+            hdus.close()
+            if not self.quiet:
+                print 'Wrote weights for {} to {}: {} photons, sum of weights {:.1f}'.format(
+                    source.name, ft1, n, weights.sum())
     
     @tools.decorate_with(plotting.sed.stacked_plots)    
     def plot_sed(self, source_name=None, **kwargs):
@@ -3,14 +3,14 @@ Code to generate a set of maps for each ROI
 $Header: /nfs/slac/g/glast/ground/cvs/pointlike/python/uw/like2/maps.py,v 1.15 2018/01/27 15:37:17 burnett Exp $
 
 """
-import os, sys,  types, glob
+import os, sys,  types, glob, time
 import cPickle as pickle
 import numpy as np
 import pandas as pd
 from skymaps import Band, SkyDir, PySkyFunction, Hep3Vector, PythonUtilities 
 from uw.like import Models
 from . import (sources, sedfuns, ) 
-from uw.utilities import image
+from uw.utilities import image, processpool
 from uw.like2.pipeline import check_ts
 
 # the default nside
@@ -237,11 +237,17 @@ class ResidualTS(object):
 
         par_sets : list of list of float or None
             if not None, sets of parameters to apply to the model
+
+        seed : bool
+            if True, start each fit from the normalization found at the previous position, if
+            it had a positive TS, rather than the default. Positions should be neighbours.
         """
         self.roi = roi
         self.model = eval(kwargs.pop('model'))
         sources.set_default_bounds(self.model)
         self.pars = kwargs.pop('par_sets', None)
+        self.seed = kwargs.pop('seed', False)
+        self.last_norm = None
         self.sourcename='test'
         self.source = roi.add_source(name=self.sourcename, skydir = roi.roi_dir, model=self.model)
         roi.get_source(self.sourcename) # to select
@@ -265,6 +271,8 @@ class ResidualTS(object):
         if pars is not None:
             self.model.set_all_parameters(pars)
             self.source.changed=True
+        elif self.seed and self.last_norm is not None:
+            self.model[0]=self.last_norm # neighbour's solution
         else:
             self.model[0]=1e-13 # initial value 
         try:
@@ -272,6 +280,8 @@ class ResidualTS(object):
             ts = self.roi.TS()
         except:
             ts=0
+        if pars is None:
+            self.last_norm = self.model[0] if ts>0 else None
         return max(0, ts)
 
     def tsfun(self, skydir):
@@ -316,6 +326,129 @@ class ResidualUpperLimit(ResidualTS):
                 return 0
  
 
+class FastTS(object):
+    """ Fast residual TS for a test point source with a fixed spectral shape, from a Newton solution
+    for its normalization with the rest of the model fixed, as in like.roi_tsmap.FastTSCalc.
+
+    Uses the current model_pixels of each BandLike as the background, and, for each band, a table
+    of the PSF values as a function of angle (the stencil) to evaluate a batch of positions together.
+    """
+    def __init__(self, roi, **kwargs):
+        """
+        roi : a ROI_user object. The model should not include a test source
+
+        model : a string
+            must evaluate to a Models.Model. e.g. 'LogParabola(6e-14, 1.2, 0, 4500)'
+        percent : float
+            PSF containment, in percent, for the radius of the stencil
+        npts : int
+            number of angles in the stencil table
+        tol : float
+            convergence criterion, for the change of the log likelihood
+        max_iter : int
+            maximum number of Newton iterations
+        maxsize : int
+            limit to the number of (position, pixel) pairs evaluated together
+        """
+        self.roi = roi
+        self.model = eval(kwargs.pop('model', 'LogParabola(1e-13, 2.2, 0, 1000.)'))
+        percent = kwargs.pop('percent', 99.)
+        npts = kwargs.pop('npts', 400)
+        self.tol = kwargs.pop('tol', 1e-3)
+        self.max_iter = kwargs.pop('max_iter', 50)
+        self.maxsize = kwargs.pop('maxsize', 10000000)
+        self.bandlikes = list(roi.selected)
+        self.expected = np.array([b.band.integrator(self.model) for b in self.bandlikes])
+        self.stencils = []
+        for b in self.bandlikes:
+            if not b.band.has_pixels:
+                self.stencils.append(None); continue
+            psf = b.band.psf
+            # angles concentrated near zero, where the PSF varies most
+            rgrid = np.radians(psf.inverse_integral(percent)) * np.linspace(0,1,npts)**2
+            self.stencils.append((rgrid, psf(rgrid)*b.band.pixel_area))
+
+    def ts(self, skydirs):
+        """ return an array of the TS values for a list of SkyDir positions"""
+        skydirs = list(skydirs)
+        radec = np.radians(np.array([(sd.ra(), sd.dec()) for sd in skydirs], float).reshape(-1,2))
+        ra, dec = radec[:,0], radec[:,1]
+        svecs = np.array([np.cos(dec)*np.cos(ra), np.cos(dec)*np.sin(ra), np.sin(dec)]).T
+
+        # the aperture term: expected counts for unit normalization, in each band
+        aperture = np.zeros(len(skydirs))
+        for b, expected in zip(self.bandlikes, self.expected):
+            overlap = np.array([b.band.psf.overlap(self.roi.roi_dir, b.band.radius, sd) for sd in skydirs])
+            aperture += b.unweight * b.exposure_factor * expected * overlap
+
+        npix = sum(b.pixels for b in self.bandlikes if b.band.has_pixels)
+        step = max(1, self.maxsize//max(npix,1))
+        ts = np.empty(len(skydirs))
+        for i in range(0, len(skydirs), step):
+            terms = []
+            for b, expected, stencil in zip(self.bandlikes, self.expected, self.stencils):
+                if stencil is None: continue
+                cosdelta = np.dot(svecs[i:i+step], b.band.pixel_vectors.T)
+                delta = 2*np.arcsin(np.sqrt(np.clip((1-cosdelta)/2, 0, 1)))
+                # ratio of the test source prediction to the model, for unit normalization
+                t = expected * np.interp(delta, stencil[0], stencil[1], right=0) / b.model_pixels
+                terms.append((b.unweight * np.asarray(b.data, float), t))
+            ts[i:i+step] = self.solve(terms, aperture[i:i+step])
+        return ts
+
+    def solve(self, terms, aperture):
+        """ Newton iterations for the normalizations, all positions together, starting from zero.
+        The derivative of the log likelihood is convex and decreasing, so the iterations increase
+        monotonically to the solution, or stay at zero.
+
+        terms : list of (weighted data, ratio) for each band, the ratio an array (positions x pixels)
+        aperture : array of the aperture terms for each position
+        returns array of TS values
+        """
+        alpha = np.zeros(len(aperture))
+        for k in range(self.max_iter):
+            f1 = -aperture.copy()
+            f2 = np.zeros(len(aperture))
+            for wd, t in terms:
+                q = t / (1 + alpha[:,None]*t)
+                f1 += np.dot(q, wd)
+                f2 -= np.dot(q**2, wd)
+            step = np.where(f2<0, -f1/np.where(f2<0, f2, -1), 0)
+            step = np.maximum(step, -alpha) # normalization not negative
+            alpha += step
+            if np.all(np.abs(f1*step)<self.tol): break
+        loglike = -alpha*aperture
+        for wd, t in terms:
+            loglike += np.dot(np.log1p(alpha[:,None]*t), wd)
+        return np.maximum(0, 2*loglike)
+
+    def tsfun(self, skydir):
+        return self.ts([skydir])[0]
+
+    def batch(self, skydirs):
+        """ for ROItables: the values for a list of positions"""
+        return self.ts(skydirs)
+
+    def __call__(self, v):
+        skydir = v if isinstance(v, SkyDir) else SkyDir(Hep3Vector(v[0],v[1],v[2]))
+        return self.tsfun(skydir)
+
+
+def _start_block(skyfun):
+    """ forget the solution of a seeded sky function: the positions of a block are only neighbours
+    of each other, not of those of the previous block evaluated by the same process
+    """
+    if getattr(skyfun, 'last_norm', None) is not None:
+        skyfun.last_norm = None
+
+def _table_task(indices):
+    """ evaluate the sky function for a block of positions, with the (skyfun, positions) context
+    of ROItables.evaluate; return list of (index, value)"""
+    skyfun, pos_list = processpool.context()
+    _start_block(skyfun)
+    return [(i, skyfun(pos_list[i])) for i in indices]
+
+
 class ROItables(object):
     """ manage one or more tables of values subdividing a HEALpix roi
     
@@ -325,6 +458,17 @@ class ROItables(object):
                 (ResidualTS,'ts',  dict(photon_index=2.0),) , 
                 (KdeMap,    'kde', dict()),
             If skyfunction is a string, evaluate it 
+        processes : int
+            number of worker processes to evaluate the positions; if 1, evaluate serially here.
+            None means the number of cores
+        checkpoint : float
+            minimum time, in s, between saving the partial table, in a file with suffix ".partial".
+            If that file exists, the values in it are not evaluated again. Set None to disable.
+        block : int
+            number of consecutive positions given to a worker at a time
+        seed : bool
+            if True, passed to the sky functions, to start each fit from the previous position's
+            solution. The positions of a block are neighbours in the ring scheme.
     """
     
     def __init__(self, outdir, nside, roi_nside=12, **kwargs):
@@ -335,20 +479,63 @@ class ROItables(object):
                 (KdeMap,     'kde', dict()),
               ),
             )
+        self.processes = kwargs.pop('processes', 1)
+        self.checkpoint = kwargs.pop('checkpoint', 300.)
+        self.block = kwargs.pop('block', 16)
+        self.seed = kwargs.pop('seed', False)
         self.subdirs = [os.path.join(outdir, name+'_table_%d' %nside) for s, name, kw in self.skyfuns]
         for subdir in self.subdirs: 
             if not os.path.exists(subdir):  os.makedirs(subdir)
                     
     def process_table(self, skyfun, name, pos_list, outfile=None, **kwargs):
         sys.stdout.flush()
-        skytable = np.array([skyfun(p) for p in pos_list])
+        values = self.evaluate(skyfun, pos_list, outfile)
+        skytable = np.array(values)
         print ' min=%6.2e, max=%6.2e, mean=%6.2e ' \
             % (skytable.min(), skytable.max(),skytable.mean()) ,
         if outfile is not None:
             print '--> %s' % outfile
             pickle.dump(skytable, open(outfile,'wb'))
+            if os.path.exists(outfile+'.partial'):
+                os.remove(outfile+'.partial')
         else: print  
         if hasattr(skyfun,'reset'): skyfun.reset() 
+
+    def evaluate(self, skyfun, pos_list, outfile=None):
+        """ return a list of the values of skyfun for the positions in pos_list.
+        Positions in the partial file for outfile, if any, are skipped, and it is updated
+        at intervals of self.checkpoint seconds.
+        """
+        if hasattr(skyfun, 'batch'):
+            return list(skyfun.batch(pos_list))
+        n = len(pos_list)
+        partial = outfile+'.partial' if outfile is not None and self.checkpoint is not None else None
+        done = {}
+        if partial is not None and os.path.exists(partial):
+            saved = pickle.load(open(partial, 'rb'))
+            if saved['n']==n:
+                done = saved['values']
+                print 'resuming with %d/%d values from %s' % (len(done), n, partial),
+        todo = [i for i in range(n) if i not in done]
+        blocks = [todo[k:k+self.block] for k in range(0, len(todo), self.block)]
+
+        last = [time.time()]
+        def save():
+            if partial is None or time.time()-last[0] < self.checkpoint: return
+            with open(partial+'.tmp', 'wb') as out:
+                pickle.dump(dict(n=n, values=done), out)
+            os.rename(partial+'.tmp', partial)
+            last[0] = time.time()
+
+        results = processpool.imap(_table_task, blocks, self.processes, 
+            context=(skyfun, pos_list), ordered=False)
+        try:
+            for result in results:
+                done.update(result)
+                save()
+        finally:
+            results.close()
+        return [done[i] for i in range(n)]
   
     def __call__(self, roi):
         index = int(roi.name[5:])
@@ -356,7 +543,8 @@ class ROItables(object):
           
         for i,fun in enumerate(self.skyfuns):
             skyfun = fun[0] if type(fun[0])!=types.StringType else eval(fun[0])
-            self.process_table(skyfun(roi, **fun[2]), fun[1], pos_list, 
+            kw = dict(fun[2], seed=True) if self.seed else fun[2]
+            self.process_table(skyfun(roi, **kw), fun[1], pos_list, 
                 os.path.join(self.subdirs[i], roi.name+'.pickle'))
 
 
@@ -427,6 +615,7 @@ class DisplayTable(object):
         return zea
 
 table_info={'ts':  (ResidualTS, dict(model='LogParabola(1e-13, 2.2, 0, 1000.)')),
+            'fts': (FastTS, dict(model='LogParabola(1e-13, 2.2, 0, 1000.)')),
             'kde': (KdeMap, dict()),
             'tsx': (ResidualTS, dict(model='LogParabola(1e-12, 2.3, 0, 1000.)')),
             'tsp': (ResidualTS, dict(model='ExpCutoff(1e-13,1.5, 3000.)')),
@@ -9,7 +9,7 @@ import numpy as np
 import pandas as pd
 from scipy import optimize
 from skymaps import SkyDir, Band
-from uw.utilities import keyword_options
+from uw.utilities import keyword_options, processpool
 from uw.like2 import (main, tools, sedfuns, maps, sources, localization, roimodel, seeds,)
 
 
@@ -45,6 +45,8 @@ class Process(main.MultiROI):
         ('tables_flag',   False,  'set True for tables run; all else ignored'),
         #('xtables_flag',  False,  'set True for special tables run; all else ignored'),
         ('tables_nside',  512,    'nside to use for table generation'),
+        ('tables_processes', 1,   'number of processes for table generation; None for all cores'),
+        ('tables_seed',   False,  'set True to start each table fit from the neighbouring solution'),
         ('table_keys',    None,   'list of keys for table generation: if None, all else ignored'),
         ('seed_key',      None,   'set to name of key for seed check run'),
         ('update_positions_flag',False,  'set True to update positions before fitting'),
@@ -358,7 +360,8 @@ class Process(main.MultiROI):
             return
         tinfo = [maps.table_info[key] for key in mapkeys]
         skyfuns = [(entry[0], key, entry[1]) for key,entry in zip(mapkeys, tinfo)]  
-        rt = maps.ROItables(self.outdir, nside=self.tables_nside, skyfuns=skyfuns )
+        rt = maps.ROItables(self.outdir, nside=self.tables_nside, skyfuns=skyfuns,
+                processes=self.tables_processes, seed=self.tables_seed)
         rt(self)
         
     def update_positions(self, tsmin=10, qualmax=8):
@@ -452,7 +455,72 @@ class BatchJob(Process):
         
     def __call__(self, roi_index):
         self.process_roi(roi_index)
-    
+
+
+def _pool_task(index):
+    """ process one ROI with the Process object of pool_process; return (index, elapsed time, error message or None)"""
+    import traceback
+    t = time.time()
+    try:
+        processpool.context().process_roi(index)
+        return index, time.time()-t, None
+    except Exception, msg:
+        return index, time.time()-t, '%s\n%s' % (msg, traceback.format_exc())
+
+def pool_process(config_dir='.', roi_list=None, processes=None, order='latitude',
+        warmup=True, maxtasksperchild=None, **kwargs):
+    """ Process a list of ROIs with a local pool of worker processes
+
+    The configuration, dataset, IRFs and, if warmup, diffuse maps are loaded once, here, and
+    are shared read-only with the workers, which are forked from this process. ROI indices are
+    handed out one at a time as workers become free, so that the slow Galactic-plane ROIs do
+    not hold up the others; ordering them first helps further.
+    Each ROI writes its results (pickle, log, plots) as usual when it finishes; a summary line is
+    appended to outdir/pool_process.csv.
+
+    config_dir : string
+    roi_list : list of int | None
+        ROI indices; if None, all 1728
+    processes : int | None
+        number of workers; if None, the number of cores
+    order : 'latitude' | None
+        if 'latitude', process ROIs in order of increasing |b|
+    warmup : bool
+        set up the first ROI before forking, to load all lazily-loaded data
+    maxtasksperchild : int | None
+        passed to multiprocessing.Pool, to limit memory growth of the workers, see utilities.processpool
+    kwargs : passed to Process
+
+    returns a DataFrame with the elapsed time and error message, if any, indexed by ROI
+    """
+    if roi_list is None: roi_list = range(1728)
+    roi_list = list(roi_list)
+    if order=='latitude':
+        roi_list.sort(key=lambda i: abs(Band(12).dir(i).b()))
+    proc = Process(config_dir, **kwargs)
+    proc.config.dataset.load()
+    if warmup and len(roi_list)>0:
+        proc.setup_roi(roi_list[0])
+    outdir = proc.outdir if proc.outdir is not None else '.'
+    if not os.path.exists(outdir): os.makedirs(outdir)
+    summary = open(os.path.join(outdir, 'pool_process.csv'), 'a')
+
+    results = []
+    done = processpool.imap(_pool_task, roi_list, processes, context=proc,
+                ordered=False, maxtasksperchild=maxtasksperchild)
+    try:
+        for index, elapsed, error in done:
+            results.append((index, elapsed, error))
+            summary.write('%d,%.1f,%s\n' % (index, elapsed, 'ok' if error is None else 'failed'))
+            summary.flush()
+            print >>sys.stderr, 'ROI #%04d %s in %.0f s (%d/%d)' % (index,
+                'done' if error is None else 'FAILED', elapsed, len(results), len(roi_list))
+            if error is not None: print >>sys.stderr, error
+    finally:
+        done.close()
+        summary.close()
+    return pd.DataFrame(results, columns=['roi', 'elapsed', 'error']).set_index('roi').sort_index()
+
 
 def fit_isotropic(roi, nbands=8, folder='isotropic_fit'):
     """ fit only the front and back"""
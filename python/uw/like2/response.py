@@ -14,6 +14,9 @@ from . import convolution, diffuse
 
 class ResponseException(Exception): pass
 
+# set to a convolution.GridCache object to save and reuse convolved diffuse grids
+grid_cache = None
+
 diffuse_grid_defaults = (
         ('pixelsize', 0.25, 'Size of pixels to use for convolution grid'),
         ('npix',      61,   'Number of pixels (must be an odd number'),
@@ -71,6 +74,24 @@ class Response(object):
     def __call__(self, skydir):
         """return the counts/sr for the source at the position"""
         raise NotImplemented
+
+    def densities(self, ra, dec, vectors=None):
+        """ return an array of the counts/sr for the source at a set of positions
+        ra, dec : arrays of float, in degrees
+        vectors : (n x 3) array of the corresponding unit vectors | None
+        This default evaluates one position at a time; subclasses use array evaluation
+        """
+        return np.array([self(skymaps.SkyDir(r,d)) for r,d in zip(ra,dec)], float)
+        
+    def spectral_terms(self):
+        """ return a tuple (scale, aperture, gradient) describing the dependence on the spectral model:
+            pix_counts = pixel_values * scale
+            counts     = scale * aperture
+            gradient   : derivative of scale with respect to the free parameters
+        Must be implemented by subclasses
+        """
+        raise NotImplementedError
+
     @property
     def spectral_model(self):
         return self.source.model
@@ -83,6 +104,23 @@ class NoResponse(Response):
         self.pix_counts=0
     def __call__(self, skydir):
         return 0.
+    def densities(self, ra, dec, vectors=None):
+        return np.zeros(len(ra))
+    def spectral_terms(self):
+        return 0., 0., np.zeros(np.sum(self.spectral_model.free))
+
+def unit_vectors(ra, dec):
+    """ return an (n x 3) array of the equatorial unit vectors for arrays of ra, dec in degrees
+    """
+    return np.array(healpy.dir2vec(ra, dec, lonlat=True)).T.reshape(-1,3)
+
+def point_pixel_values(band, skydirs):
+    """ return a (sources x pixels) array of the PointResponse pixel_values for point sources at
+    the list of positions, from a single vectorized PSF evaluation; or None if not supported by the PSF
+    """
+    if not band.has_pixels or len(skydirs)==0 or not hasattr(band.psf, 'wsdl_values'):
+        return None
+    return band.psf.wsdl_values(skydirs, pixel_vectors=band.pixel_vectors) * band.pixel_area
 
 class PointResponse(Response):
     """Manage predictions of the response of a point source
@@ -93,12 +131,25 @@ class PointResponse(Response):
         grad : gradient
         
     """
+    def __init__(self, source, band, roi=None, pixel_values=None, **kwargs):
+        """ pixel_values : None | array of float
+                if set, precomputed pixel values, see point_pixel_values
+        """
+        self._pixel_values = pixel_values
+        super(PointResponse, self).__init__(source, band, roi, **kwargs)
 
-    def initialize(self):
+    def initialize(self, pixel_values=None):
+        """ pixel_values : None | array of float
+                if set, precomputed pixel values, see point_pixel_values
+        """
+        if pixel_values is None:
+            pixel_values, self._pixel_values = getattr(self, '_pixel_values', None), None
         self.overlap = self.band.psf.overlap(self.roicenter, self.band.radius, self.source.skydir)
         self._exposure_ratio = self.band.exposure(self.source.skydir)/self.band.exposure(self.roicenter)
         if self.band.has_pixels:
-            if hasattr(self.band.psf, 'cpsf'):
+            if pixel_values is not None:
+                self.pixel_values = pixel_values
+            elif hasattr(self.band.psf, 'cpsf'):
                 # old PSF class, uses C++ code for speed
                 wsdl = self.band.wsdl
                 rvals  = np.empty(len(wsdl),dtype=float)
@@ -143,11 +194,26 @@ class PointResponse(Response):
 
     def __call__(self, skydir):
         return self.band.psf(skydir.difference(self.source.skydir))[0]  * self.expected
+
+    def densities(self, ra, dec, vectors=None):
+        if not hasattr(self.band.psf, 'wsdl_values'):
+            # PSF does not take an array of separations
+            return super(PointResponse, self).densities(ra, dec)
+        if vectors is None:
+            vectors = unit_vectors(ra, dec)
+        sd = self.source.skydir
+        cosdelta = np.dot(vectors, unit_vectors(sd.ra(), sd.dec())[0])
+        delta = 2*np.arcsin(np.sqrt(np.clip((1-cosdelta)/2, 0, 1)))
+        return self.band.psf(delta) * self.expected
+
+    def spectral_terms(self):
+        return self.expected, self.overlap, self.model_grad
      
 
     
 class DiffuseResponse(Response):
         
+    cacheable = True # use grid_cache if set
     defaults = diffuse_grid_defaults
     @keyword_options.decorate(defaults)
     def __init__(self, source, band, roi, **kwargs):
@@ -174,9 +240,13 @@ class DiffuseResponse(Response):
             cv = healpy.dir2vec(c.l(),c.b(),lonlat=True)
             hplist = healpy.query_disc(self.dmodel.nside,cv, self.band.radius_in_rad)
             assert skymaps.Band(self.dmodel.nside).index(self.roicenter) in hplist
-            dirs = map(self.dmodel.dirfun, hplist)
             self.evalpoints = lambda dirs : np.array(map(self.dmodel, dirs)) * self.corr
-            self.ap_average = self.evalpoints(dirs).mean()
+            if hasattr(self.dmodel, 'values'):
+                # evaluate the whole band at once from the interpolated plane
+                self.ap_average = self.dmodel.values(hplist).mean() * self.corr
+            else:
+                dirs = map(self.dmodel.dirfun, hplist)
+                self.ap_average = self.evalpoints(dirs).mean()
         
         else:
             self.create_grid() # will raise exception if no overlap
@@ -188,7 +258,11 @@ class DiffuseResponse(Response):
         self.delta_e = self.band.emax - self.band.emin
         self.factor = self.ap_average * self.band.solid_angle * self.delta_e
         if self.band.has_pixels:
-            self.pixel_values = self.evalpoints(self.band.wsdl) * self.band.pixel_area * self.delta_e
+            if getattr(self, 'preconvolved', False) and hasattr(self.dmodel, 'evaluate'):
+                pixel_values = self.dmodel.evaluate(self.band.pixel_vectors) * self.corr
+            else:
+                pixel_values = self.evalpoints(self.band.wsdl)
+            self.pixel_values = pixel_values * self.band.pixel_area * self.delta_e
 
         self.evaluate()
         
@@ -197,8 +271,31 @@ class DiffuseResponse(Response):
         grid = self.grid= convolution.ConvolvableGrid(center=self.roicenter, 
                 npix=self.npix if self.energy>1000 else self.npix2, 
                 pixelsize=self.pixelsize)
-        # this may be overridden
-        self.fill_grid()
+        if grid_cache is None or not self.cacheable:
+            # this may be overridden
+            self.fill_grid()
+            return
+        def fill():
+            self.fill_grid()
+            # save the inputs to the convolution too, for show
+            return np.array([grid.cvals, grid.bg_vals, grid.psf_vals])
+        grid.cvals, grid.bg_vals, grid.psf_vals = grid_cache(self.grid_key(), fill)
+
+    def grid_key(self):
+        """ dict of the quantities, other than the IRF and livetime, that determine the convolved grid
+        """
+        c = self.roicenter
+        return dict(response=self.__class__.__name__,
+            diffuse=convolution.file_signature(getattr(self.dmodel, 'fullfilename', repr(self.dmodel))),
+            event_type=self.band.event_type,
+            energy=round(self.energy,2),
+            center=(round(c.ra(),5), round(c.dec(),5)),
+            npix=self.grid.npix, 
+            pixelsize=self.grid.pixelsize,
+            corr=repr(getattr(self, 'corr', None)),
+            exposure=self.band.exposure.__class__.__name__, # C++ or HEALPix lookup
+            layers=('cvals','bg_vals','psf_vals'),
+            )
 
             
     def fill_grid(self):
@@ -215,7 +312,7 @@ class DiffuseResponse(Response):
         self.grid.convolve()
         
     def evaluate(self):
-        norm = self.source.model(self.band.energy)
+        self.norm = norm = self.source.model(self.band.energy)
         self.counts = norm * self.factor
         if self.band.has_pixels:
             self.pix_counts = self.pixel_values * norm
@@ -231,8 +328,21 @@ class DiffuseResponse(Response):
         pixterm = ( self.pixel_values * weights ).sum() if self.band.has_pixels else 0
         return (self.factor*exposure_factor - pixterm) * model.gradient(self.energy)[model.free] 
         
+    def spectral_terms(self):
+        model = self.spectral_model
+        return self.norm, self.factor, model.gradient(self.energy)[model.free]
+
     def __call__(self, skydir):
-        return self.evalpoints([skydir])[0] * self.delta_e
+        return self.evalpoints([skydir])[0] * self.delta_e * self.norm
+
+    def densities(self, ra, dec, vectors=None):
+        if getattr(self, 'preconvolved', False) and hasattr(self.dmodel, 'evaluate'):
+            if vectors is None:
+                vectors = unit_vectors(ra, dec)
+            values = self.dmodel.evaluate(vectors) * self.corr
+        else:
+            values = self.evalpoints(map(skymaps.SkyDir, ra, dec))
+        return values * self.delta_e * self.norm
     
     def _keyword_check(self, roi_index):
         # check for extra keywords from diffuse spec.
@@ -416,6 +526,8 @@ class CachedDiffuseResponse(DiffuseResponse):
 
 class IsotropicResponse(DiffuseResponse):
 
+    cacheable = False # correction is set in fill_grid
+
     defaults = diffuse_grid_defaults
     @keyword_options.decorate(defaults)    
     def __init__(self, source, band, roi, **kwargs):
@@ -434,6 +546,11 @@ class IsotropicResponse(DiffuseResponse):
             self.source.model.ct=self.band.event_type
         return super(IsotropicResponse, self).grad(weights, exposure_factor)
 
+    def spectral_terms(self):
+        if hasattr(self.source.model, 'ct'):
+            self.source.model.ct=self.band.event_type
+        return super(IsotropicResponse, self).spectral_terms()
+
 
     def fill_grid(self):
         # fill the grid for evaluating counts integral over ROI, individual pixel predictions
@@ -593,7 +710,7 @@ class ExtendedResponse(DiffuseResponse):
         self.initmodel = self.source.model.copy()
         
     def evaluate(self):
-        total_counts = self.exposure_integral()
+        self.total_counts = total_counts = self.exposure_integral()
         self.counts = total_counts * self.factor
         if self.band.has_pixels:
             self.pix_counts = self.pixel_values * total_counts
@@ -613,11 +730,18 @@ class ExtendedResponse(DiffuseResponse):
         pixterm = (weights*self.pixel_values).sum() if self.band.has_pixels else 0
         return g * (apterm - pixterm)
 
+    def spectral_terms(self):
+        model = self.spectral_model
+        return self.total_counts, self.factor, self.band.integrator( model.gradient)[model.free]
+
     def __call__(self, skydir, force=False):
         """ return value of perhaps convolved grid for the position
         skydir : SkyDir object | [SkyDir]
         """
         return self.grid(skydir, self.cvals) / self.exposure_at_center * self.counts/self.factor
+
+    def densities(self, ra, dec, vectors=None):
+        return self(map(skymaps.SkyDir, ra, dec))
         
     def __repr__(self):
         return '%s.%s: \n\tsource: %s\n\tband  : %s\n\tpixelsize: %.1f, npix: %d' % (
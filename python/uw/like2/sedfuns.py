@@ -8,11 +8,53 @@ import os, pickle
 import numpy as np
 import pandas as pd
 
-from uw.utilities import ( keyword_options)
+from uw.utilities import ( keyword_options, processpool)
 from . import ( plotting, tools, loglikelihood, sources, bands)
 # 2/decade above 31.6 GeV
 energybins=np.concatenate( [np.logspace(2,4.25,10), np.logspace(4.5,6,4)])
-       
+
+class BandProfile(object):
+    """ The log likelihood for a set of bands as a function of the energy flux of a source, from
+    cached pixel predictions of the source and of the rest of the model.
+    Equivalent to an EnergyFluxView with the bands selected, but does not update the BandLike
+    objects, and evaluates an array of energy fluxes at once
+    """
+    def __init__(self, bandlikes, source_name, eflux):
+        """ bandlikes : list of BandLike objects, in the current state of the model
+            source_name : string
+            eflux : float
+                energy flux of the source, in eV units, for its current normalization
+        """
+        self.eflux = eflux
+        data, back, signal = [], [], []
+        self.back_counts = self.signal_counts = self.counts = 0
+        for bl in bandlikes:
+            bs = bl[source_name]
+            self.back_counts += bl.unweight * bl.exposure_factor * (bl.counts - bs.counts)
+            self.signal_counts += bl.unweight * bl.exposure_factor * bs.counts / eflux
+            self.counts += bs.counts / eflux
+            if bl.pixels==0: continue
+            # pixels with no data do not contribute
+            sel = bl.data>0
+            data.append(bl.unweight * bl.data[sel])
+            back.append((bl.model_pixels - bs.pix_counts)[sel])
+            signal.append(bs.pix_counts[sel] / eflux)
+        self.data, self.back, self.signal = [np.concatenate(x) if len(x)>0 else np.zeros(0)
+            for x in (data, back, signal)]
+
+    def __call__(self, eflux):
+        """eflux : float or array of float
+            energy flux in eV units
+        """
+        x = np.maximum(0, np.atleast_1d(np.asarray(eflux, float)))
+        ret = np.log(self.back + np.outer(x, self.signal)).dot(self.data) \
+            - self.back_counts - x * self.signal_counts
+        return ret if np.ndim(eflux)>0 else ret[0]
+
+    def npred(self, eflux):
+        """ predicted counts from the source for the energy flux """
+        return eflux * self.counts
+
 class SED(tools.WithMixin):
     """ measure the energy flux vs. energy for a given source
     It can be set for all bands, just the band(s) at given energy, or a single band:
@@ -101,7 +143,7 @@ class SED(tools.WithMixin):
         self.restore()
         return np.array(pp)
         
-    def sed_rec(self, event_type=None, tol=0.1):
+    def sed_rec(self, event_type=None, tol=0.1, batched=False):
         """ return a numpy.recarray with values for each band (or set of bands)
            elow ehigh       -- energy limits
            flux lflux uflux -- flux at max, upper and lower 1-sigma
@@ -112,7 +154,10 @@ class SED(tools.WithMixin):
            delta_ts         -- TS difference, fit-model
            pull             -- signed square root of delta_ts
            zero_fract       -- predicted fraction of the time expect zero flux
+        If batched is set, use batched_sed_rec
         """
+        if batched:
+            return self.batched_sed_rec(event_type, tol)
         names = 'elow ehigh flux lflux uflux npred pindex ts mflux  delta_ts pull maxdev zero_fract'.split()
         rec = tools.RecArray(names, dtype=dict(names=names, formats=['>f4']*len(names)) )
         
@@ -138,33 +183,106 @@ class SED(tools.WithMixin):
                 rec.append(elow,ehigh, 0, 0, np.nan, 0,0,0, np.nan, np.nan, np.nan, np.nan, np.nan )
                 continue
             
-            w = pf.poiss
-            err = pf.maxdev
-            lf,uf = w.errors
-            maxl  = w.flux
-            mf    = self.func.eflux
-            self.func(maxl) # set to maxl for npred
-            npred = sum([bs[self.source_name].counts for bs in self.rs.selected])
-            
-            # get spectral function evaluate exponential slope by finite difference
-            m = self.rs.get_model(self.source_name)
-            x = np.sqrt(xlo*xhi)
-            delta=0.01 # 1%
-            pindex= (1-m((1+delta)*x)/m(x))/delta
-            
-            delta_ts = 2.*(self(maxl) - self(mf) )
-            zf =   w.zero_fraction()
-            if lf>0 :
-                pull = np.sign(maxl-mf) * np.sqrt(max(0, delta_ts))
-                assert not np.isnan(pull), 'row {}: pull = {}'.format(i,pull)
-                rec.append(xlo, xhi, maxl, lf, uf, npred, pindex, w.ts, mf, delta_ts, pull, err, zf)
-            else:
-                pull = -np.sqrt(max(0, delta_ts))
-                rec.append(xlo, xhi, 0, 0, w.cdfcinv(0.05), 0,pindex, 0, mf, delta_ts, pull, err, zf )
+            def npred(maxl):
+                self.func(maxl) # set to maxl for npred
+                return sum([bs[self.source_name].counts for bs in self.rs.selected])
+            self._append_fit(rec, i, xlo, xhi, pf, self.func.eflux, self, npred)
             
         self.restore()
         return rec()
 
+    def _append_fit(self, rec, i, xlo, xhi, pf, mf, loglike, npred):
+        """ append a row to the sed_rec for a fit
+            pf : PoissonFitter object
+            mf : energy flux predicted by the model
+            loglike, npred : functions of energy flux
+        """
+        w = pf.poiss
+        err = pf.maxdev
+        lf,uf = w.errors
+        maxl  = w.flux
+        npred = npred(maxl)
+        
+        # get spectral function evaluate exponential slope by finite difference
+        m = self.rs.get_model(self.source_name)
+        x = np.sqrt(xlo*xhi)
+        delta=0.01 # 1%
+        pindex= (1-m((1+delta)*x)/m(x))/delta
+        
+        delta_ts = 2.*(loglike(maxl) - loglike(mf) )
+        zf =   w.zero_fraction()
+        if lf>0 :
+            pull = np.sign(maxl-mf) * np.sqrt(max(0, delta_ts))
+            assert not np.isnan(pull), 'row {}: pull = {}'.format(i,pull)
+            rec.append(xlo, xhi, maxl, lf, uf, npred, pindex, w.ts, mf, delta_ts, pull, err, zf)
+        else:
+            pull = -np.sqrt(max(0, delta_ts))
+            rec.append(xlo, xhi, 0, 0, w.cdfcinv(0.05), 0,pindex, 0, mf, delta_ts, pull, err, zf )
+
+    def profiles(self, event_type=None):
+        """ return a list of (elow, ehigh, profile) for the energy bins, where profile is a BandProfile
+        for the bands in the bin, or None if there is no data. The profile's eflux is the model
+        energy flux at sqrt(elow*ehigh), for the nominal bin edges
+        """
+        ebins = self.energybins
+        if event_type is not None:
+            ebins = filter(lambda e: e>=bands.event_type_min_energy[event_type], ebins)
+        self.restore()
+        model = self.func.model
+        ret = []
+        for elow,ehigh in zip(ebins[:-1], ebins[1:]):
+            try:
+                self.rs.select(event_type=event_type, elow=elow, ehigh=ehigh)
+            except AssertionError:
+                ret.append((elow, ehigh, None)); continue
+            selected = self.rs.selected
+            if not np.any([b.band.has_pixels for b in selected]):
+                ret.append((elow, ehigh, None)); continue
+            energy = np.sqrt(elow*ehigh)
+            eflux = model(energy) * energy**2 * 1e6
+            ret.append((self.rs.emin, self.rs.emax, BandProfile(selected, self.source_name, eflux)))
+        self.rs.select()
+        return ret
+
+    def profile_grid(self, efluxes, event_type=None):
+        """ return a (bins x efluxes) array of the log likelihood for all energy bins, on a shared 
+        grid of energy flux values; nan for bins with no data
+        """
+        efluxes = np.asarray(efluxes, float)
+        return np.array([p(efluxes) if p is not None else np.full(len(efluxes), np.nan)
+            for elow,ehigh,p in self.profiles(event_type)])
+
+    def batched_sed_rec(self, event_type=None, tol=0.1, ngrid=41):
+        """ return the sed_rec, using BandProfile functions for the likelihood of each energy bin.
+        All bins are first evaluated together on a shared grid of energy flux, to start the
+        Poisson fits.
+        """
+        names = 'elow ehigh flux lflux uflux npred pindex ts mflux  delta_ts pull maxdev zero_fract'.split()
+        rec = tools.RecArray(names, dtype=dict(names=names, formats=['>f4']*len(names)) )
+        model = self.rs.get_model(self.source_name)
+        profiles = self.profiles(event_type)
+        # grid centered on the model energy flux at the reference energy
+        mf0 = model(model.e0) * model.e0**2 * 1e6
+        grid = mf0 * np.logspace(-3, 3, ngrid)
+        values = np.array([p(grid) if p is not None else np.zeros(ngrid) for xlo,xhi,p in profiles])
+        for i,((xlo,xhi,p), v) in enumerate(zip(profiles, values)):
+            if p is None:
+                rec.append(xlo,xhi, 0, 0, np.nan, 0,0,0, np.nan, np.nan, np.nan, np.nan,     np.nan )
+                continue
+            mf = p.eflux # model flux at the reference energy of the profile, as for EnergyFluxView
+            try:
+                pf = loglikelihood.PoissonFitter(p, scale=grid[np.argmax(v)], tol=tol)
+            except Exception, msg:
+                print 'Fail poiss fit for %.0f-%.0f MeV: %s ' % (xlo,xhi,msg)
+                rec.append(xlo,xhi, 0, 0, np.nan, 0,0,0, np.nan, np.nan, np.nan, np.nan,     np.nan )
+                continue
+            if np.isnan(pf.wprime):
+                print 'Fail poiss fit for %.0f-%.0f MeV: %s ' % (xlo,xhi,'bad poiss')
+                rec.append(xlo,xhi, 0, 0, np.nan, 0,0,0, np.nan, np.nan, np.nan, np.nan, np.nan )
+                continue
+            self._append_fit(rec, i, xlo, xhi, pf, mf, p, p.npred)
+        return rec()
+
     def data_frame(self, event_type=None, tol=0.1):
         """DataFrame summary of the sed_rec"""
         si = self.sed_rec(event_type,tol)
@@ -281,6 +399,30 @@ def print_sed(roi, source_name=None):
     pd.set_option('display.float_format', t)
                
 
+def _sed_task(args):
+    """ the batched sed_rec for a source of the ROI of sed_recs, the processpool context"""
+    source_name, event_type, tol = args
+    try:
+        with SED(processpool.context(), source_name, quiet=True) as sf:
+            return source_name, sf.sed_rec(event_type=event_type, tol=tol, batched=True), None
+    except Exception, msg:
+        return source_name, None, str(msg)
+
+def sed_recs(roi, source_names, event_type=None, tol=0.1, processes=1):
+    """ return a dict of the batched sed_rec for each of a list of sources, or None if it failed
+    
+    processes : int
+        if >1, distribute the sources over a pool of processes, each with a copy of the ROI
+    """
+    tasks = [(name, event_type, tol) for name in source_names]
+    results = list(processpool.imap(_sed_task, tasks, processes, context=roi))
+    ret = dict()
+    for name, rec, msg in results:
+        if msg is not None:
+            print 'Failed SED for source %s: %s' % (name, msg)
+        ret[name] = rec
+    return ret
+
 def makesed_all(roi, **kwargs):
     """ add sed information to each free local source
     
@@ -290,6 +432,10 @@ def makesed_all(roi, **kwargs):
         showts : bool
         ndf : int
             default 10, for fit quality
+        batched : bool
+            default False, set to use SED.batched_sed_rec
+        processes : int
+            default 1; if >1, the batched SEDs are computed in a pool of processes, see sed_recs
     other kwargs passed to sed.Plot().__call__
     """
     from scipy import stats # for chi2 
@@ -300,15 +446,24 @@ def makesed_all(roi, **kwargs):
     if sedfig_dir is not None and not os.path.exists(sedfig_dir): os.mkdir(sedfig_dir)
     showts = kwargs.pop('showts', True)
     poisson_tolerance = kwargs.pop('poisson_tolerance', 0.50)
+    batched = kwargs.pop('batched', False)
+    processes = kwargs.pop('processes', 1)
     initw = roi.log_like()
 
     sources = [s for s in roi.sources if s.skydir is not None and np.any(s.spectral_model.free)]
     print 'sources:', [s.name for s in sources]
+    sedrecs = sed_recs(roi, [s.name for s in sources], tol=poisson_tolerance, 
+        processes=processes) if processes>1 else dict()
     for source in sources:
         with SED(roi, source.name, ) as sf:
             print source.name,':',
             try:
-                source.sedrec = sf.sed_rec( tol=poisson_tolerance)
+                if source.name in sedrecs:
+                    source.sedrec = sedrecs[source.name]
+                    if source.sedrec is None:
+                        raise Exception('batched SED failed')
+                else:
+                    source.sedrec = sf.sed_rec( tol=poisson_tolerance, batched=batched)
                 source.ts = roi.TS(source.name)
                 qual = sum(source.sedrec.pull**2)
                 pval = 1.- stats.chi2.cdf(qual, ndf)
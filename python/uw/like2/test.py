@@ -18,11 +18,14 @@ from uw.like2 import ( configuration,
     to_xml, from_xml,
     dataset,
     bandlike,
+    parameterset,
     views,
     sedfuns,
     associate,
     main,
+    convolution,
     )
+from uw.utilities import convolution as utilities_convolution
 
 # globals: references set by setUp methods in classes as needed
 config_dir = '/tmp/like2' # os.path.expandvars('$HOME/test') #skymodels/P202/uw29')
@@ -264,6 +267,38 @@ class TestDiffuse(TestSetup):
 #        self.response_check(resp, (744, 1386, 57037))
 
     
+class TestConvolution(TestSetup):
+    def setUp(self, **kwargs):
+        super(TestConvolution,self).setUp(**kwargs)
+        self.back_band = bands.EnergyBand(self.config, self.skydir, event_type=1)
+
+    def test_kernel_cache(self):
+        """-->fill the PSF kernel twice: the second fill is a cache hit"""
+        grid = convolution.ConvolvableGrid(self.skydir, npix=61)
+        psf = self.back_band.psf
+        grid.psf_fill(psf)
+        first, size = grid.psf_vals, len(utilities_convolution.kernel_cache)
+        grid.psf_fill(psf)
+        self.assertTrue(grid.psf_vals is first, msg='expect the cached kernel')
+        self.assertEquals(size, len(utilities_convolution.kernel_cache))
+        self.assertAlmostEquals(1.0, grid.psf_vals.sum())
+
+    def test_fill(self):
+        """-->fill by evaluate agrees with the C++ grid, for a center at high latitude across l=0"""
+        class Linear(object):
+            # a function of direction that distinguishes all three axes
+            def __call__(self, skydir):
+                v = skydir.dir()
+                return 4 + v.x() + 2*v.y() + 3*v.z()
+            def evaluate(self, unit_vectors):
+                return 4 + np.dot(unit_vectors, [1,2,3])
+        f = Linear()
+        for l in (0.5, 359.5):
+            grid = convolution.ConvolvableGrid(SkyDir(l, 60, SkyDir.GALACTIC), npix=51, pixelsize=0.25)
+            vectorized, pyfun = grid.fill(f), grid.fill(lambda sd: f(sd))
+            self.assertTrue(np.allclose(vectorized, pyfun, rtol=1e-6), 
+                msg='max difference %.2e' % np.abs(vectorized-pyfun).max())
+
 class TestPoint(TestSetup):
     def setUp(self, **kwargs):
         super(TestPoint,self).setUp(**kwargs)
@@ -485,6 +520,100 @@ class TestLikelihood(TestSetup):
         self.assertAlmostEquals(blike.log_like(), prev,delta=0.1)
         
     
+class SimpleBand(object):
+    """ Stand-in for an EnergyBand: a square of pixels with Poisson data, a gaussian PSF and a
+    constant exposure, for tests of the likelihood that do not need data files
+    """
+    class PSF(object):
+        def __init__(self, sigma):
+            self.sigma = np.radians(sigma)
+        def __call__(self, delta):
+            return np.exp(-0.5*(np.asarray(delta)/self.sigma)**2)/(2*np.pi*self.sigma**2)
+        def wsdl_value(self, skydir, wsdl):
+            return self(np.array([skydir.difference(w) for w in wsdl]))
+        def overlap(self, roi_dir, radius, skydir):
+            return 0.9
+    class Exposure(object):
+        correction = 1.0
+        def __call__(self, skydir, energy=None):
+            return 3e10
+
+    def __init__(self, roi_dir, energy, event_type, rng, npix=10, pixelsize=0.5):
+        self.skydir, self.energy, self.event_type = roi_dir, energy, event_type
+        self.emin, self.emax = energy/10**0.125, energy*10**0.125
+        self.radius = 5
+        offsets = (np.arange(npix)-(npix-1)/2.)*pixelsize
+        self.wsdl = [SkyDir(roi_dir.ra()+x/np.cos(np.radians(roi_dir.dec())), roi_dir.dec()+y)
+            for x in offsets for y in offsets]
+        self.pixel_area = np.radians(pixelsize)**2
+        self.pixels = len(self.wsdl)
+        self.has_pixels = True
+        self.pix_counts = rng.poisson(2, self.pixels).astype(float)
+        self.psf = SimpleBand.PSF(1.0 if event_type==0 else 1.5)
+        self.exposure = SimpleBand.Exposure()
+        self.integrator = exposure.ExposureIntegral(self.exposure, roi_dir, self.emin, self.emax)
+
+class SimpleBandSet(list):
+    """ Stand-in for a BandSet of SimpleBand objects"""
+    def __init__(self, bands, roi_dir):
+        super(SimpleBandSet, self).__init__(bands)
+        self.roi_dir = roi_dir
+        self.config = self
+    def event_type_name(self, event_type):
+        return ('front', 'back')[event_type]
+
+class SimpleSources(list):
+    """ Stand-in for an ROImodel: a list of sources, with the free mask and parameters"""
+    def __init__(self, srcs):
+        super(SimpleSources, self).__init__(srcs)
+        self.free = np.array([np.any(s.model.free) for s in srcs])
+        self.parameters = parameterset.ParameterSet(self)
+
+class TestPacked(unittest.TestCase):
+    """Compare the PackedBandLike engine with the BandLike loop, for point sources in 
+    SimpleBand objects
+    """
+    def setUp(self):
+        self.config = bandlike.config # the global is set by BandLikeList
+        rng = np.random.RandomState(0)
+        roi_dir = SkyDir(100, 30)
+        bands = SimpleBandSet([SimpleBand(roi_dir, energy, event_type, rng)
+            for energy in (300, 1000, 3000) for event_type in (0,1)], roi_dir)
+        srcs = [sources.PointSource(name='src%d'%i, skydir=SkyDir(100+dx, 30+dy), 
+                    model=sources.PowerLaw(norm, 2.2))
+            for i,(dx,dy,norm) in enumerate([(0,0,1e-12), (1.5,-1,5e-13), (-1,1,2e-12)])]
+        srcs[-1].model.free[:] = False
+        self.bl = bandlike.BandLikeList(bands, SimpleSources(srcs))
+    def tearDown(self):
+        bandlike.config = self.config
+
+    def test_likelihood(self):
+        """--> likelihood and gradient, packed and not, before and after a change"""
+        bl = self.bl
+        loglike, grad = bl.log_like(), bl.gradient()
+        bl.set_packed(True)
+        self.assertAlmostEqual(loglike, bl.log_like(), delta=1e-9*abs(loglike))
+        self.assertTrue(np.allclose(grad, bl.gradient(), rtol=1e-9, atol=1e-9*abs(grad).max()), 
+            msg='%s, %s' % (grad, bl.gradient()))
+        bl.sources.parameters[1] += 0.1
+        bl.update()
+        loglike, grad = bl.log_like(), bl.gradient()
+        bl.set_packed(False)
+        bl.update()
+        self.assertAlmostEqual(loglike, bl.log_like(), delta=1e-9*abs(loglike))
+        self.assertTrue(np.allclose(grad, bl.gradient(), rtol=1e-9, atol=1e-9*abs(grad).max()), 
+            msg='%s, %s' % (grad, bl.gradient()))
+
+    def test_hessian(self):
+        """--> analytic hessian, with and without packing, and numerical derivative of the gradient"""
+        bl = self.bl
+        hess = bl.hessian()
+        numeric = bl.hessian(analytic=False)
+        scale = np.abs(hess).max()
+        self.assertTrue(np.allclose(hess, numeric, rtol=1e-4, atol=1e-5*scale), msg='%s\n%s' % (hess, numeric))
+        bl.set_packed(True)
+        self.assertTrue(np.allclose(hess, bl.hessian(), rtol=1e-9, atol=1e-9*scale))
+        
 class TestAddRemoveSource(TestSetup):
     def setUp(self):
         self.bl = setup('blike')
@@ -597,11 +726,13 @@ test_cases = (
     TestConfig, 
     TestPoint, 
     TestDiffuse, 
+    TestConvolution,
     TestExtended, 
     TestROImodel, 
     TestXML,
     TestBands, 
     TestLikelihood,
+    TestPacked,
     # changes fitter test? TestAddRemoveSource,
     TestFitterView,
     TestSED,
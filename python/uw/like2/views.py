@@ -205,6 +205,8 @@ class FitterMixin(object):
         estimate_errors = kwargs.pop('estimate_errors', True)
         if not quiet: print 'using optimize.fmin_l_bfgs_b with parameter bounds %s\n, kw= %s'% (
                             self.bounds, kwargs)
+        # the model may have been changed by other means since the last call, e.g., fixed parameters
+        self._memo = None
         parz = self.get_parameters()
         winit = self.log_like()
         assert len(parz)==len(self.gradient()), 'tracking a bug'
@@ -215,9 +217,9 @@ class FitterMixin(object):
             epsilon=1e-08, 
             iprint=-1, maxfun=15000, maxiter=15000)
         fit_args.update(kwargs)
-        # run the fit
-        ret = optimize.fmin_l_bfgs_b(self, parz, 
-                bounds=self.bounds,  fprime=self.gradient, **fit_args)
+        # run the fit, with the value and gradient from a single update per iterate
+        ret = optimize.fmin_l_bfgs_b(self.value_and_gradient, parz, 
+                bounds=self.bounds, **fit_args)
 	self.fmin_ret=ret
         if ret[2]['warnflag']>0: 
             print 'Fit failure: check parameters'
@@ -239,6 +241,32 @@ class FitterMixin(object):
             self.covariance = None
             return f[1], f[0], np.nan
         
+    def memoized(self, name, pars, func):
+        """ return func(), evaluated with the parameters set to pars (or the current ones if None)
+        
+        The result is kept, with the value, gradient and hessian for the same point, until 
+        any free parameter of the model changes, or the likelihood is updated or initialized
+        (see BandLikeList.generation), so that the optimizer, the error estimate and 
+        delta_loglike do not repeat the update of the likelihood.
+        """
+        if pars is not None and np.any(np.asarray(pars)!=self.get_parameters()):
+            self.set_parameters(pars)
+        key = np.array(self.blike.sources.parameters.get_parameters(), float)
+        generation = getattr(self.blike, 'generation', None)
+        memo = getattr(self, '_memo', None)
+        if memo is None or memo['generation']!=generation or not np.array_equal(memo['key'], key):
+            memo = self._memo = dict(key=key, generation=generation)
+        if name not in memo:
+            memo[name] = func()
+        return memo[name]
+
+    def value_and_gradient(self, pars=None):
+        """ return the negative log likelihood and its gradient at pars, for the optimizer"""
+        return self(pars), self.gradient(pars)
+    
+    def _value(self):
+        self.calls+=1
+        return -self.blike.log_like()
         
     def modify(self, fraction):
         """change iniital set to fraction of current change; restore will make it permanent
@@ -340,19 +368,15 @@ class FitterView(FitPlotMixin, FitterMixin, FitterSummaryMixin, tools.WithMixin)
     def bounds(self):
         return np.concatenate([s.model.bounds[s.model.free] for s in self.sources]) 
     def __call__(self, pars=None):
-        if pars is not None: self.set_parameters(pars)
-        self.calls+=1
-        return -self.blike.log_like()
+        return self.memoized('value', pars, self._value)
     def log_like(self, summed=True):
         """assume that parameters are set, possibility of individual likelihoods"""
         return self.blike.log_like(summed)
 
     def gradient(self,pars=None):
-        if pars is not None: self.set_parameters(pars)
-        return self.blike.gradient()
+        return self.memoized('gradient', pars, self.blike.gradient).copy()
     def hessian(self, pars=None):
-        if pars is not None: self.set_parameters(pars)
-        return self.blike.hessian()
+        return self.memoized('hessian', pars, self.blike.hessian).copy()
     @property
     def parameter_names(self):
         return self.parameters.parameter_names
@@ -395,19 +419,15 @@ class SubsetFitterView(parameterset.ParSubSet, FitPlotMixin, FitterMixin, Fitter
         super(SubsetFitterView,self).set_parameters(pars)
         self.blike.update()
     def __call__(self, pars=None):
-        if pars is not None: self.set_parameters(pars)
-        self.calls +=1
-        return -self.blike.log_like()
+        return self.memoized('value', pars, self._value)
         
     def log_like(self, summed=True):
         """assume that parameters are set, possibility of individual likelihoods"""
         return self.blike.log_like(summed)
     def gradient(self, pars=None):
-        if pars is not None: self.set_parameters(pars)
-        return self.blike.gradient()[self.mask]
+        return self.memoized('gradient', pars, lambda: self.blike.gradient()[self.mask]).copy()
     def hessian(self,pars=None):
-        if pars is not None: self.set_parameters(pars)
-        return self.blike.hessian(self.mask) 
+        return self.memoized('hessian', pars, lambda: self.blike.hessian(self.mask)).copy()
         
     def ts(self):
         """ simple test statistic """
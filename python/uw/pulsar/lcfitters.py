@@ -20,9 +20,14 @@ from copy import deepcopy
 import scipy
 from scipy.optimize import fmin,fmin_tnc,leastsq
 from uw.pulsar.stats import z2mw,hm,hmw
+from uw.utilities import processpool
 
 SECSPERDAY = 86400.
 
+def _bootstrap_task(args):
+    """ fit one resample with the fitter of bootstrap_errors, the processpool context"""
+    return processpool.context()._bootstrap_fit(*args)
+
 def shifted(m,delta=0.5):
     """ Produce a copy of a binned profile shifted in phase by delta."""
     f = np.fft.fft(m,axis=-1) 
@@ -79,6 +84,8 @@ def LCFitter(template,phases,weights=None,log10_ens=None,times=1,
 
 class UnweightedLCFitter(object):
 
+    multiplicity = None # photon multiplicities for a weighted bootstrap resample
+
     def __init__(self,template,phases,**kwargs):
         self.template = template
         self.phases = np.asarray(phases)
@@ -117,7 +124,7 @@ class UnweightedLCFitter(object):
         #if (not t.shift_mode) and np.any(p<0):
         if ((t.norm()>1) or (not params_ok)):
             return 2e20
-        rvals = -np.log(t(self.phases)).sum()
+        rvals = -self._sum(np.log(t(self.phases)))
         if np.isnan(rvals): return 2e20 # NB need to do better accounting of norm
         return rvals
 
@@ -136,7 +143,14 @@ class UnweightedLCFitter(object):
     def unbinned_gradient(self,p,*args):
         t = self.template
         t.set_parameters(p);
-        return -(t.gradient(self.phases)/t(self.phases)).sum(axis=1)
+        return -self._sum(t.gradient(self.phases)/t(self.phases),axis=1)
+
+    def _sum(self,x,axis=None):
+        """ Sum over photons, counting each photon according to its
+            bootstrap multiplicity if set."""
+        if self.multiplicity is None:
+            return x.sum(axis=axis)
+        return (x*self.multiplicity).sum(axis=axis)
 
     def binned_gradient(self,p,*args):
         t = self.template
@@ -349,36 +363,76 @@ class UnweightedLCFitter(object):
         self.template.set_errors(np.diag(self.cov_matrix)**0.5)
         return True
 
-    def bootstrap_errors(self,nsamp=100,fit_kwargs={},set_errors=False):
-        p0 = self.phases; w0 = self.weights
-        param0 = self.template.get_parameters().copy()
-        n = len(p0)
-        results = np.empty([nsamp,len(self.template.get_parameters())])
+    def bootstrap_errors(self,nsamp=100,fit_kwargs={},set_errors=False,
+                         processes=1,seed=None,resample='copy'):
+        """ Estimate the parameter errors from fits to bootstrap resamples
+            of the photons.  Up to 2*nsamp resamples are tried to obtain
+            nsamp successful fits.
+
+            processes -- number of worker processes; each fits with its
+                         own copy of the fitter and template
+            seed      -- seed for generating the resamples; for a given
+                         seed the results do not depend on processes
+            resample  -- 'copy' to fit resampled copies of the phases (and
+                         weights); 'weights' to fit the original phases,
+                         counting each photon by the number of times it
+                         was drawn (unbinned likelihood only)
+
+            Returns an array (nsamp x nparam) of the fit parameters.
+        """
+        fit_kwargs = dict(fit_kwargs)
         fit_kwargs['estimate_errors'] = False # never estimate errors
         if 'unbinned' not in fit_kwargs.keys():
             fit_kwargs['unbinned'] = True
+        if (resample=='weights') and (not fit_kwargs['unbinned']):
+            raise ValueError('Weighted resampling requires the unbinned likelihood.')
+        seeds = np.random.RandomState(seed).randint(0,2**31-1,size=2*nsamp)
+        tasks = [(s,fit_kwargs,resample) for s in seeds]
+        fits = processpool.imap(_bootstrap_task,tasks,processes,context=self)
+        results = np.empty([nsamp,len(self.template.get_parameters())])
         counter = 0
-        for i in xrange(nsamp*2):
-            if counter == nsamp:
-                break
-            if i == (2*nsamp-1):
-                self.phases = p0; self.weights = w0
-                raise ValueError('Could not construct bootstrap sample.  Giving up.')
-            a = (np.random.rand(n)*n).astype(int)
-            self.phases = p0[a]
-            if w0 is not None:
-                self.weights = w0[a]
-            if not fit_kwargs['unbinned']:
-                self._hist_setup()
-            if self.fit(**fit_kwargs):
-                results[counter,:] = self.template.get_parameters()
+        try:
+            # results arrive in order of the seeds; stop at nsamp good fits
+            for p in fits:
+                if p is None: continue
+                results[counter,:] = p
                 counter += 1
-            self.template.set_parameters(param0)
+                if counter == nsamp: break
+        finally:
+            fits.close() # stop the workers still fitting resamples
+        if counter < nsamp:
+            raise ValueError('Could not construct bootstrap sample.  Giving up.')
         if set_errors:
             self.template.set_errors(np.std(results,axis=0))
-        self.phases = p0; self.weights = w0
         return results
 
+    def _bootstrap_fit(self,seed,fit_kwargs,resample='copy'):
+        """ Fit the bootstrap resample generated from seed, then restore
+            the data and parameters.  Return the fit parameters, or None
+            if the fit failed."""
+        p0 = self.phases; w0 = self.weights
+        param0 = self.template.get_parameters().copy()
+        n = len(p0)
+        a = (np.random.RandomState(seed).rand(n)*n).astype(int)
+        try:
+            if resample == 'weights':
+                self.multiplicity = np.bincount(a,minlength=n).astype(float)
+            else:
+                self.phases = p0[a]
+                if w0 is not None:
+                    self.weights = w0[a]
+                if not fit_kwargs['unbinned']:
+                    self._hist_setup()
+            if self.fit(**fit_kwargs):
+                return self.template.get_parameters().copy()
+            return None
+        finally:
+            self.phases = p0; self.weights = w0
+            self.multiplicity = None
+            if not fit_kwargs['unbinned']:
+                self._hist_setup()
+            self.template.set_parameters(param0)
+
     def __str__(self):
         if 'll' in self.__dict__.keys():
             return '\nLog Likelihood for fit: %.2f\n'%(self.ll) + str(self.template)
@@ -558,7 +612,7 @@ class WeightedLCFitter(UnweightedLCFitter):
         if ((t.norm()>1) or (not params_ok)):
         #if (t.norm()>1) or (not t.shift_mode and np.any(p<0)):
             return 2e20
-        return -np.log(1+self.weights*(t(self.phases)-1)).sum()
+        return -self._sum(np.log(1+self.weights*(t(self.phases)-1)))
         #return -np.log(1+self.weights*(self.template(self.phases,suppress_bg=True)-1)).sum()
 
     def binned_loglikelihood(self,p,*args):
@@ -580,7 +634,7 @@ class WeightedLCFitter(UnweightedLCFitter):
             return np.ones_like(p)*2e20
         numer = self.weights*t.gradient(self.phases)
         denom = 1+self.weights*(t(self.phases)-1)
-        return -(numer/denom).sum(axis=1)
+        return -self._sum(numer/denom,axis=1)
 
     def binned_gradient(self,p,*args):
         t = self.template
@@ -382,8 +382,37 @@ class LCWrappedFunction(LCPrimitive):
 
         This introduces an additional parameteric dependence which must
         be accounted for by computation of the gradient.
+
+        The profile and gradient can be evaluated in one of three modes
+        (see set_eval_mode):
+        'direct'  -- sum the images of base_func/base_grad (default)
+        'table'   -- interpolate in tables of the wrapped profile and its
+                     gradient on a fine phase grid; the tables are rebuilt
+                     only when the parameters change
+        'fourier' -- sum the Fourier series of the wrapped profile, for
+                     subclasses implementing fourier_coefficients
+        Energy-dependent primitives always use 'direct'.
     """
 
+    eval_mode = 'direct'
+    table_size = 2**14
+
+    def set_eval_mode(self,mode='direct',table_size=None):
+        """ Select 'direct', 'table', or 'fourier' evaluation."""
+        if mode not in ['direct','table','fourier']:
+            raise ValueError('Unknown evaluation mode %s'%mode)
+        if (mode=='fourier') and (self.fourier_coefficients() is None):
+            raise NotImplementedError(
+                'No Fourier series available for %s.'%self.name)
+        self.eval_mode = mode
+        if table_size is not None:
+            self.table_size = table_size
+        self._tables = {}
+
+    def _mode(self):
+        if self.is_energy_dependent(): return 'direct'
+        return self.eval_mode
+
     def _norm(self,nwraps,log10_ens=3):
         """ Compute the truncated portion of the template."""
         #return self.p[0]-self.base_int(-nwraps,nwraps+1)
@@ -403,6 +432,31 @@ class LCWrappedFunction(LCPrimitive):
 
     def __call__(self,phases,log10_ens=3):
         """ Return wrapped template + DC component corresponding to truncation."""
+        mode = self._mode()
+        if mode == 'table':
+            return self._interpolate('func',phases)
+        if mode == 'fourier':
+            return self._fourier(phases,log10_ens)[0]
+        return self._direct_call(phases,log10_ens)
+
+    def gradient(self,phases,log10_ens=3,free=False):
+        """ Return the gradient evaluated at a vector of phases.
+
+            output : a num_parameter x len(phases) ndarray, 
+                     the num_parameter-dim gradient at each phase
+        """
+        mode = self._mode()
+        if mode == 'table':
+            results = self._interpolate('grad',phases)
+        elif mode == 'fourier':
+            results = self._fourier(phases,log10_ens,gradient=True)[1]
+        else:
+            results = self._direct_gradient(phases,log10_ens)
+        if free:
+            return results[self.free]
+        return results
+
+    def _direct_call(self,phases,log10_ens=3):
         results = self.base_func(phases,log10_ens)
         for i in xrange(1,MAXWRAPS+1):
             t = self.base_func(phases,log10_ens,index= i)
@@ -411,12 +465,7 @@ class LCWrappedFunction(LCPrimitive):
             if (i>=MINWRAPS) and (np.all(t < WRAPEPS)): break
         return results+self._norm(i,log10_ens)
 
-    def gradient(self,phases,log10_ens=3,free=False):
-        """ Return the gradient evaluated at a vector of phases.
-
-            output : a num_parameter x len(phases) ndarray, 
-                     the num_parameter-dim gradient at each phase
-        """
+    def _direct_gradient(self,phases,log10_ens=3):
         results = self.base_grad(phases,log10_ens)
         for i in xrange(1,MAXWRAPS+1):
             t = self.base_grad(phases,log10_ens,index=i)
@@ -427,10 +476,57 @@ class LCWrappedFunction(LCPrimitive):
         if gn is not None:
             for i in xrange(len(gn)):
                 results[i,:] += gn[i]
-        if free:
-            return results[self.free]
         return results
 
+    def _interpolate(self,which,phases):
+        """ Linear interpolation in the table of the profile ('func') or
+            gradient ('grad'), rebuilding it if the parameters changed."""
+        if not hasattr(self,'_tables'): self._tables = {}
+        n = self.table_size
+        key = (tuple(self.p),n)
+        if which not in self._tables or self._tables[which][0] != key:
+            dom = np.linspace(0,1,n+1)
+            if which == 'func':
+                table = self._direct_call(dom)
+            else:
+                table = self._direct_gradient(dom)
+            self._tables[which] = key,table
+        table = self._tables[which][1]
+        x = np.mod(phases,1)*n
+        i = np.minimum(x.astype(int),n-1)
+        dx = x-i
+        return table[...,i]*(1-dx) + table[...,i+1]*dx
+
+    def fourier_coefficients(self,log10_ens=3):
+        """ Return the coefficients c_k, k=1..K, of the series
+            f = 1 + 2 sum_k c_k cos(2 pi k (phi-loc)) for a symmetric
+            wrapped profile, and their derivatives with respect to the
+            width, or None if not implemented."""
+        return None
+
+    def _fourier(self,phases,log10_ens=3,gradient=False):
+        """ Evaluate the profile, and optionally its gradient with respect
+            to (width, location), from the Fourier series, generating the
+            harmonics by recurrence."""
+        c,dc = self.fourier_coefficients(log10_ens)
+        z = np.exp((TWOPI*1j)*(np.asarray(phases)-self.p[-1]))
+        zk = z.copy()
+        f = np.zeros(z.shape)
+        if gradient:
+            g = np.zeros((2,)+z.shape)
+        for k in xrange(len(c)):
+            f += c[k]*zk.real
+            if gradient:
+                g[0] += dc[k]*zk.real
+                g[1] += (c[k]*(k+1))*zk.imag
+            if k < len(c)-1: zk *= z
+        f = 1+2*f
+        if gradient:
+            g[0] *= 2
+            g[1] *= 2*TWOPI
+            return f,g
+        return f,None
+
     def integrate(self,x1,x2,log10_ens=3):
         #if(x1==0) and (x2==0): return 1.
         # NB -- this method is probably overkill now.
@@ -489,6 +585,15 @@ class LCGaussian(LCWrappedFunction):
         z2 = (x2 + index - x0)/width
         return 0.5*(erf(z2/ROOT2)-erf(z1/ROOT2))
 
+    def fourier_coefficients(self,log10_ens=3):
+        """ The wrapped normal has c_k = exp(-2 (pi k width)^2); the
+            series is truncated where c_k falls below WRAPEPS."""
+        e,width,x0 = self._make_p(log10_ens)
+        nharm = int(np.ceil((-np.log(WRAPEPS)/(2*PI**2))**0.5/width))
+        k = np.arange(1,nharm+1)
+        c = np.exp(-2*(PI*k*width)**2)
+        return c,-4*(PI*k)**2*width*c
+
     def random(self,n):
         if hasattr(n,'__len__'):
             n = len(n)
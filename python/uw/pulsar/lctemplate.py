@@ -178,6 +178,19 @@ class LCTemplate(object):
         self._cache = 0.5*(t[1:]+t[:-1]) 
         self._cache_out_of_date = False
 
+    def set_eval_mode(self,mode='direct',table_size=None):
+        """ Set the evaluation mode ('direct', 'table', or 'fourier') of
+            the wrapped primitives; see LCWrappedFunction.  Unlike the
+            use_cache option, the table mode interpolates and also applies
+            to the gradient.  Primitives without a Fourier series are left
+            in direct mode."""
+        for prim in self.primitives:
+            if not hasattr(prim,'set_eval_mode'): continue
+            try:
+                prim.set_eval_mode(mode,table_size=table_size)
+            except NotImplementedError:
+                prim.set_eval_mode('direct',table_size=table_size)
+
     def single_component(self,index,phases,log10_ens=3):
         """ Evaluate a single component of template."""
         n = self.norms(log10_ens)[index]
@@ -212,25 +212,40 @@ class Polyco:
         return polyconame
 
     def make_keys(self):
-        """Keys for a binary search.  Use the edges."""
+        """Keys for a binary search.  Use the edges.
+        
+        Also pack the entries into arrays for vectorized evaluation."""
         keys = np.asarray([e.tstop for e in self.entries])
         sorting = np.argsort(keys)
         self.entries = np.asarray(self.entries)[sorting]
         self.keys = np.append(self.entries[0].tstart,keys[sorting])
+        ncoeff = max([e.ncoeff for e in self.entries])
+        self.tmids = np.asarray([e.tmid for e in self.entries],dtype=np.float64)
+        self.rphases = np.asarray([e.rphase for e in self.entries],dtype=np.float64)
+        self.f0s = np.asarray([e.f0 for e in self.entries],dtype=np.float64)
+        self.uids = np.asarray([e.uid for e in self.entries])
+        # pad with zeros to the largest number of coefficients
+        self.coeffs = np.zeros([len(self.entries),ncoeff],dtype=np.float64)
+        for i,e in enumerate(self.entries):
+            self.coeffs[i,:e.ncoeff] = e.coeffs[:e.ncoeff]
+
+    def _entry_index(self,t):
+        """Return the index into self.entries for time(s) t (in MJD)."""
+        idx = np.searchsorted(self.keys,t)
+        if np.any(idx == len(self.keys)):
+            print 'The following MJDS were beyond the end of the polyco validity (%s):'%(self.keys[-1])
+            print t[idx == len(self.keys)] if type(t) is type(np.array([1])) else t
+            raise IndexError
+        if np.any(idx==0):
+            print 'The following MJDS were before the start of the polyco validity (%s):'%(self.keys[0])
+            print t[idx == 0] if type(t) is type(np.array([1])) else t
+            raise IndexError
+        return idx-1
 
     def getentry(self,t,use_keys=True):
         '''Returns the polyco entry corresponding to time t (in MJD)'''
         if use_keys:
-            idx = np.searchsorted(self.keys,t)
-            if np.any(idx == len(self.keys)):
-                print 'The following MJDS were beyond the end of the polyco validity (%s):'%(self.keys[-1])
-                print t[idx == len(self.keys)] if type(t) is type(np.array([1])) else t
-                raise IndexError
-            if np.any(idx==0):
-                print 'The following MJDS were before the start of the polyco validity (%s):'%(self.keys[0])
-                print t[idx == 0] if type(t) is type(np.array([1])) else t
-                raise IndexError
-            return self.entries[idx-1]
+            return self.entries[self._entry_index(t)]
         for pe in self.entries:
             if pe.valid(t):
                 return pe
@@ -239,32 +254,55 @@ class Polyco:
         sys.exit(9)
         return None
 
-    def _vec_eval(self,times,func):
-        if not hasattr(times,'__len__'):
-            times = [times]
-        pces = self.getentry(times,use_keys=True)
-        self.ids = np.asarray([pc.uid for pc in pces])
-        return np.asarray(map(func,pces,times))
+    def vec_evaluate(self,times,absphase=False):
+        """ Return phases, frequencies (Hz) and frequency derivatives
+            (Hz/s) for a vector of times (MJD @ GEO).
+
+            The entry for each time is found with a binary search and the
+            polynomials are evaluated with Horner's rule on whole arrays,
+            in the same order of operations as PolycoEntry.evalphase, etc.
+            If absphase, include the integer part of the phase.
+        """
+        times = np.asarray(times,dtype=np.float64).ravel()
+        idx = self._entry_index(times)
+        self.ids = self.uids[idx]
+        dt = (times-self.tmids[idx])*1440.0
+        coeffs = self.coeffs
+        ncoeff = coeffs.shape[1]
+        phase = coeffs[idx,ncoeff-1]
+        freq = np.zeros_like(dt)
+        freqd = np.zeros_like(dt)
+        for i in range(ncoeff-2,-1,-1):
+            # derivatives of the polynomial by the same recursion
+            freqd = freqd*dt + 2*freq
+            freq = freq*dt + phase
+            phase = coeffs[idx,i] + dt*phase
+        phase += self.rphases[idx] + dt*60.0*self.f0s[idx]
+        if not absphase:
+            phase -= np.floor(phase)
+        freq = self.f0s[idx] + freq/60.0
+        freqd = freqd/(60.0*60.0)
+        return phase,freq,freqd
 
     def vec_evalphase(self,times):
         """ Return the phases for a vector of times; NB times should be in
             MJD @ GEO."""
-        return self._vec_eval(times,PolycoEntry.evalphase)
+        return self.vec_evaluate(times)[0]
 
     def vec_evalabsphase(self,times):
         """ Return the phases for a vector of times; NB times should be in
             MJD @ GEO."""
-        return self._vec_eval(times,PolycoEntry.evalabsphase)
+        return self.vec_evaluate(times,absphase=True)[0]
 
     def vec_evalfreq(self,times):
         """ Return the phases for a vector of times; NB times should be in
             MJD @ GEO."""
-        return self._vec_eval(times,PolycoEntry.evalfreq)
+        return self.vec_evaluate(times)[1]
 
     def vec_evalfreqderiv(self,times):
         """ Return the phases for a vector of times; NB times should be in
             MJD @ GEO."""
-        return self._vec_eval(times,PolycoEntry.evalfreqderiv)
+        return self.vec_evaluate(times)[2]
 
     def invert_phase_shift(self,t0,phi):
         """ Compute the time lapse (in s) corresponding to phi at t0."""
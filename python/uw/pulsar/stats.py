@@ -104,25 +104,45 @@ def sigma_trials(sigma,trials):
       return (sigma**2 - 2*np.log(trials))**0.5
 
 
-def z2m(phases,m=2):
-    """ Return the Z^2_m test for each harmonic up to the specified m.
-        See de Jager et al. 1989 for definition.    
-    """
-
-    phases = np.asarray(phases)*TWOPI #phase in radians
-    n = len(phases)
+def harmonic_sums(phases,m=2,weights=None,chunk_size=2**18):
+    """ Return the complex trigonometric moments sum_j w_j exp(2 pi i k phi_j)
+        for each harmonic k = 1..m.
 
-    if n < 5e3:  #faster for 100s to 1000s of phases, but requires ~20x memory of alternative
+        Only one complex exponential is evaluated per phase; the harmonics
+        follow from the recurrence exp(ik phi) = exp(i(k-1)phi) exp(i phi).
+        The phases are processed in chunks of about chunk_size values, so the
+        memory needed does not depend on the number of phases.
 
-        s = (np.cos(np.outer(np.arange(1,m+1),phases))).sum(axis=1)**2 +\
-            (np.sin(np.outer(np.arange(1,m+1),phases))).sum(axis=1)**2
+        phases   -- phases (0 to 1); a 2-d array, e.g. (trials x photons),
+                    gives the moments for each row in one batch
+        weights  -- optional weights, one per element of the last axis
 
-    else:
+        Returns a complex array with shape phases.shape[:-1] + (m,).
+    """
+    phases = np.asarray(phases,dtype=float)
+    if weights is not None: weights = np.asarray(weights,dtype=float)
+    n = phases.shape[-1]
+    nrow = int(np.prod(phases.shape[:-1]))
+    step = max(1,chunk_size//max(1,nrow))
+    s = np.zeros(phases.shape[:-1]+(m,),dtype=complex)
+    for i in xrange(0,n,step):
+        z = np.exp((TWOPI*1j)*phases[...,i:i+step])
+        zk = z.copy() if weights is None else z*weights[i:i+step]
+        for k in xrange(m):
+            s[...,k] += zk.sum(axis=-1)
+            if k < m-1: zk *= z
+    return s
 
-        s = (np.asarray([(np.cos(k*phases)).sum() for k in xrange(1,m+1)]))**2 +\
-            (np.asarray([(np.sin(k*phases)).sum() for k in xrange(1,m+1)]))**2
+def z2m(phases,m=2):
+    """ Return the Z^2_m test for each harmonic up to the specified m.
+        See de Jager et al. 1989 for definition.    
 
-    return (2./n)*np.cumsum(s)
+        A 2-d array of phases gives the result for each row.
+    """
+    phases = np.asarray(phases)
+    n = phases.shape[-1]
+    s = np.abs(harmonic_sums(phases,m))**2
+    return (2./n)*np.cumsum(s,axis=-1)
 
 def z2mw(phases,weights,m=2):
    """ Return the Z^2_m test for each harmonic up to the specified m.
@@ -131,13 +151,9 @@ def z2mw(phases,weights,m=2):
        well-distributed or assumed to be fixed, the CLT applies and the
        statistic remains calibrated.  Nice!
     """
-
-   phases = np.asarray(phases)*(2*np.pi) #phase in radians
-
-   s = (np.asarray([(np.cos(k*phases)*weights).sum() for k in xrange(1,m+1)]))**2 +\
-       (np.asarray([(np.sin(k*phases)*weights).sum() for k in xrange(1,m+1)]))**2
-
-   return np.cumsum(s) * (2./(weights**2).sum())
+   weights = np.asarray(weights)
+   s = np.abs(harmonic_sums(phases,m,weights=weights))**2
+   return np.cumsum(s,axis=-1) * (2./(weights**2).sum())
 
 def sf_z2m(ts,m=2):
     """ Return the survival function (chance probability) according to the
@@ -158,13 +174,10 @@ def em_four(phases,m=2,weights=None):
     """ Return the empirical Fourier coefficients up to the mth harmonic.
         These are derived from the empirical trignometric moments."""
    
-    phases = np.asarray(phases)*TWOPI #phase in radians
-
     n = len(phases) if weights is None else weights.sum()
-    weights = 1. if weights is None else weights
 
-    aks = (1./n)*np.asarray([(weights*np.cos(k*phases)).sum() for k in xrange(1,m+1)])
-    bks = (1./n)*np.asarray([(weights*np.sin(k*phases)).sum() for k in xrange(1,m+1)])
+    s = harmonic_sums(phases,m,weights=weights)*(1./n)
+    aks,bks = s.real,s.imag
 
     return aks,bks
 
@@ -186,12 +199,9 @@ def hm(phases,m=20,c=4):
         m == maximum search harmonic
         c == offset for each successive harmonic
     """
-    phases = np.asarray(phases)*(2*np.pi) #phase in radians
-
-    s = (np.asarray([(np.cos(k*phases)).sum() for k in xrange(1,m+1)]))**2 +\
-        (np.asarray([(np.sin(k*phases)).sum() for k in xrange(1,m+1)]))**2
-
-    return ((2./len(phases))*np.cumsum(s) - c*np.arange(0,m)).max()
+    phases = np.asarray(phases)
+    s = np.abs(harmonic_sums(phases,m))**2
+    return ((2./phases.shape[-1])*np.cumsum(s,axis=-1) - c*np.arange(0,m)).max(axis=-1)
 
 
 def hmw(phases,weights,m=20,c=4):
@@ -200,12 +210,41 @@ def hmw(phases,weights,m=20,c=4):
         is corrected such that the CLT still applies, i.e., it maintains
         the same calibration as the unweighted version."""
 
-    phases = np.asarray(phases)*(2*np.pi) #phase in radians
+    weights = np.asarray(weights)
+    s = np.abs(harmonic_sums(phases,m,weights=weights))**2
+    return ( (2./(weights**2).sum()) * np.cumsum(s,axis=-1) - c*np.arange(0,m) ).max(axis=-1)
+
+def hm_trials(times,freqs,fdots=0,weights=None,m=20,c=4,chunk_size=2**18):
+    """ Calculate the (weighted) H statistic for each of a set of trial
+        timing solutions, e.g. a grid in frequency and frequency derivative.
 
-    s = (np.asarray([(weights*np.cos(k*phases)).sum() for k in xrange(1,m+1)]))**2 +\
-        (np.asarray([(weights*np.sin(k*phases)).sum() for k in xrange(1,m+1)]))**2
+        times    -- photon times (s) relative to the reference epoch
+        freqs    -- trial frequencies (Hz)
+        fdots    -- trial frequency derivatives (Hz/s); scalar or same
+                    shape as freqs
+        weights  -- optional photon weights
 
-    return ( (2./(weights**2).sum()) * np.cumsum(s) - c*np.arange(0,m) ).max()
+        The trials are processed in blocks such that no more than about
+        chunk_size phases are held at once.  Returns an array of H with the
+        shape of freqs.
+    """
+    times = np.asarray(times,dtype=float)
+    freqs,fdots = np.broadcast_arrays(np.asarray(freqs,dtype=float),np.asarray(fdots,dtype=float))
+    shape = freqs.shape
+    freqs,fdots = freqs.ravel(),fdots.ravel()
+    if weights is None:
+        norm = 2./len(times)
+    else:
+        weights = np.asarray(weights,dtype=float)
+        norm = 2./(weights**2).sum()
+    block = max(1,chunk_size//len(times))
+    h = np.empty(len(freqs))
+    for i in xrange(0,len(freqs),block):
+        ph = np.outer(freqs[i:i+block],times) + np.outer(0.5*fdots[i:i+block],times**2)
+        ph -= np.floor(ph)
+        s = np.abs(harmonic_sums(ph,m,weights=weights,chunk_size=chunk_size))**2
+        h[i:i+block] = (norm*np.cumsum(s,axis=-1) - c*np.arange(0,m)).max(axis=-1)
+    return h.reshape(shape)
 
 
 #@vec
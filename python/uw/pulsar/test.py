@@ -0,0 +1,134 @@
+"""
+Pulsar testing code, using unittest
+These tests need only numpy and scipy: no data files, or tempo2
+"""
+import os, sys, unittest, tempfile
+import numpy as np
+
+from uw.pulsar import stats, polyco
+
+class TestStats(unittest.TestCase):
+    """Compare the statistics built on harmonic_sums with direct sums over the harmonics
+    """
+    def setUp(self, n=1000, m=5):
+        rng = np.random.RandomState(0)
+        # a pulsed component on a uniform background
+        self.phases = np.concatenate([rng.uniform(size=n), rng.normal(0.3, 0.05, n//10) % 1])
+        self.weights = rng.uniform(size=len(self.phases))
+        self.m = m
+
+    def direct(self, phases, m, weights=None):
+        """ return the (m,) complex array of the moments, one harmonic at a time"""
+        if weights is None: weights = np.ones_like(phases)
+        k = np.arange(1, m+1)[:,None]
+        return (weights*np.cos(2*np.pi*k*phases)).sum(axis=1) \
+            + 1j*(weights*np.sin(2*np.pi*k*phases)).sum(axis=1)
+
+    def test_harmonic_sums(self):
+        ph, w, m = self.phases, self.weights, self.m
+        self.assertTrue(np.allclose(stats.harmonic_sums(ph, m), self.direct(ph, m)))
+        self.assertTrue(np.allclose(stats.harmonic_sums(ph, m, weights=w), self.direct(ph, m, w)))
+        # chunks smaller than the number of phases
+        self.assertTrue(np.allclose(stats.harmonic_sums(ph, m, weights=w, chunk_size=100),
+                self.direct(ph, m, w)))
+
+    def test_z2m(self):
+        ph, w, m = self.phases, self.weights, self.m
+        z2 = np.cumsum(np.abs(self.direct(ph, m))**2)*2./len(ph)
+        self.assertTrue(np.allclose(stats.z2m(ph, m), z2))
+        z2w = np.cumsum(np.abs(self.direct(ph, m, w))**2)*2./(w**2).sum()
+        self.assertTrue(np.allclose(stats.z2mw(ph, w, m), z2w))
+
+    def test_hm(self, c=4):
+        ph, w, m = self.phases, self.weights, self.m
+        z2 = np.cumsum(np.abs(self.direct(ph, m))**2)*2./len(ph)
+        self.assertAlmostEqual(stats.hm(ph, m, c), max(z2[k]-c*k for k in range(m)))
+        z2w = np.cumsum(np.abs(self.direct(ph, m, w))**2)*2./(w**2).sum()
+        self.assertAlmostEqual(stats.hmw(ph, w, m, c), max(z2w[k]-c*k for k in range(m)))
+
+    def test_em_four(self):
+        ph, w, m = self.phases, self.weights, self.m
+        aks, bks = stats.em_four(ph, m, weights=w)
+        s = self.direct(ph, m, w)/w.sum()
+        self.assertTrue(np.allclose(aks, s.real) and np.allclose(bks, s.imag))
+
+    def test_rows(self):
+        """--> a 2-d array of phases gives the result for each row"""
+        ph = self.phases[:900].reshape(3,300)
+        self.assertTrue(np.allclose(stats.z2m(ph, self.m), [stats.z2m(row, self.m) for row in ph]))
+        self.assertTrue(np.allclose(stats.hm(ph, self.m), [stats.hm(row, self.m) for row in ph]))
+
+    def test_hm_trials(self, f0=0.1, f1=-1e-8):
+        rng = np.random.RandomState(1)
+        times = np.sort(rng.uniform(0, 1e4, 500))
+        freqs = f0 + np.linspace(-1e-4, 1e-4, 5)
+        h = stats.hm_trials(times, freqs, f1, m=self.m, chunk_size=1000)
+        phases = [(f*times + 0.5*f1*times**2) % 1 for f in freqs]
+        self.assertTrue(np.allclose(h, [stats.hm(ph, self.m) for ph in phases]))
+
+class TestPolyco(unittest.TestCase):
+    """Compare Polyco.vec_evaluate with the PolycoEntry evaluation for each time
+    """
+    def setUp(self, nentries=4, nspan=360):
+        """ write a polyco file with contiguous entries, one with fewer coefficients"""
+        rng = np.random.RandomState(0)
+        fd, self.filename = tempfile.mkstemp(suffix='.dat')
+        with os.fdopen(fd, 'w') as out:
+            for i in range(nentries):
+                tmid = 55000 + (i+0.5)*nspan/1440.
+                ncoeff = 8 if i==1 else 12
+                coeffs = rng.normal(size=ncoeff) * 10.**(-2.5*np.arange(ncoeff))
+                out.write('J0000+0000 01-Jan-10 %11.2f %20.11f %21.6f %7.3f %7.3f\n' 
+                    % (0, tmid, 10., 0., -6.))
+                out.write('%20.6f%18.12f%5s%6d%5d%10.3f\n' 
+                    % (rng.uniform(-1e6,1e6), 29.7+0.1*i, 'coe', nspan, ncoeff, 1400.))
+                for j in range(0, ncoeff, 3):
+                    out.write(''.join('%25.17e' % c for c in coeffs[j:j+3]) + '\n')
+        self.pc = polyco.Polyco(self.filename, recalc_polycos=False)
+        keys = self.pc.keys
+        self.times = np.sort(rng.uniform(keys[0], keys[-1], 1000))
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def test_entries(self):
+        pc = self.pc
+        self.assertEqual(len(pc.entries), 4)
+        pc.vec_evaluate(self.times)
+        self.assertTrue(np.all(pc.ids == [pc.getentry(t).uid for t in self.times]))
+
+    def test_evaluate(self):
+        """--> phases agree exactly, frequency and derivative to rounding"""
+        pc = self.pc
+        entries = [pc.getentry(t) for t in self.times]
+        phase, freq, freqd = pc.vec_evaluate(self.times)
+        self.assertTrue(np.all(phase == [e.evalphase(t) for e,t in zip(entries, self.times)]))
+        self.assertTrue(np.allclose(freq, [e.evalfreq(t) for e,t in zip(entries, self.times)], rtol=1e-12, atol=0))
+        self.assertTrue(np.allclose(freqd, [e.evalfreqderiv(t) for e,t in zip(entries, self.times)], rtol=1e-9, atol=0))
+        absphase = pc.vec_evaluate(self.times, absphase=True)[0]
+        self.assertTrue(np.all(absphase == [e.evalabsphase(t) for e,t in zip(entries, self.times)]))
+
+    def test_validity(self):
+        pc = self.pc
+        self.assertRaises(IndexError, pc.vec_evaluate, [pc.keys[-1]+1])
+
+test_cases = (
+    TestStats,
+    TestPolyco,
+    )
+
+def run(t='all', loader=unittest.TestLoader(), debug=False):
+    if t=='all':
+        suite = unittest.TestSuite()
+        for test_class in test_cases:
+            tests = loader.loadTestsFromTestCase(test_class)
+            suite.addTests(tests)
+    else:
+        suite = loader.loadTestsFromTestCase(t)
+    print 'running %d tests %s' % (suite.countTestCases(), 'in debug mode' if debug else '')
+    if debug:
+        suite.debug()
+    else:
+        unittest.TextTestRunner(stream=sys.stdout,verbosity=2).run(suite)
+
+if __name__=='__main__':
+    run()
@@ -204,4 +204,91 @@ class Photon(object):
     def srcdiff(self):
         return self.sdiff
 
-###################################################  END PHOTON CLASS #######################################################
\ No newline at end of file
+###################################################  END PHOTON CLASS #######################################################
+
+################################################# START PHOTONCOLUMNS CLASS ##################################################
+
+## Columnar photon container: one array per photon attribute instead of one Photon per event
+#
+#  Keeps ra, dec (degrees), energy, time, event class, weight, cos(theta), source index and the
+#  angular separation from the associated source (radians). Models which only depend on srcdiff()
+#  can evaluate the whole container at once; iterating yields Photon objects for everything else.
+#  Photons rotated in the GLAST frame need the pointing history, so keep using Photon lists for those.
+class PhotonColumns(object):
+
+    fields = ['ra','dec','energy','time','event_class','weight','ct','src','sdiff']
+
+    ## Constructor
+    #  @param srcs list of skymaps SkyDir source positions, referenced by the 'src' index
+    def __init__(self,srcs=[]):
+        self.srcs = list(srcs)
+        self.cols = dict([(field,np.zeros(0,dtype=int if field=='src' else float)) for field in self.fields])
+        self.pending = []
+
+    def __getattr__(self,name):
+        if name in PhotonColumns.fields:
+            self.consolidate()
+            return self.cols[name]
+        raise AttributeError(name)
+
+    def __len__(self):
+        return len(self.cols['ra'])+sum([len(chunk['ra']) for chunk in self.pending])
+
+    ## iterate over Photon objects (no pointing information)
+    def __iter__(self):
+        self.consolidate()
+        c = self.cols
+        for k in range(len(c['ra'])):
+            yield Photon(c['ra'][k],c['dec'][k],c['energy'][k],c['time'][k],c['event_class'][k],[],[],self.srcs[c['src'][k]],weight=c['weight'][k],ct=c['ct'][k])
+
+    ## join chunks added since the last access into the column arrays
+    def consolidate(self):
+        if len(self.pending)==0:
+            return
+        for field in self.fields:
+            self.cols[field] = np.concatenate([self.cols[field]]+[chunk[field] for chunk in self.pending])
+        self.pending = []
+
+    ## angular separation in radians between photon directions and a source
+    #  @param ra right ascension in degrees (array)
+    #  @param dec declination in degrees (array)
+    #  @param src index into self.srcs
+    def separation(self,ra,dec,src):
+        sd = self.srcs[src]
+        phi,theta = np.asarray(ra,float)*np.pi/180,np.asarray(dec,float)*np.pi/180
+        sphi,stheta = sd.ra()*np.pi/180,sd.dec()*np.pi/180
+        cdot = np.cos(theta)*np.cos(stheta)*np.cos(phi-sphi)+np.sin(theta)*np.sin(stheta)
+        return np.arccos(np.clip(cdot,-1.,1.))
+
+    ## add a block of photons associated with one source
+    #  @param ra right ascension in degrees (array)
+    #  @param dec declination in degrees (array)
+    #  @param energy energy in MeV (array or scalar)
+    #  @param src index into self.srcs
+    #  @param sdiff precomputed separations in radians, calculated if None
+    def add(self,ra,dec,energy,src,weight=1.,time=0.,event_class=0,ct=1.,sdiff=None):
+        ra = np.asarray(ra,float)
+        n = len(ra)
+        chunk = dict(ra=ra,dec=dec,energy=energy,time=time,event_class=event_class,weight=weight,ct=ct,src=src,
+                     sdiff=self.separation(ra,dec,src) if sdiff is None else sdiff)
+        for field in self.fields:
+            col = np.empty(n,dtype=int if field=='src' else float)
+            col[:] = chunk[field]
+            chunk[field] = col
+        self.pending.append(chunk)
+
+    ## add a single Photon object
+    #  @param photon CLHEP Photon
+    def append(self,photon):
+        idx = [k for k,sd in enumerate(self.srcs) if sd is photon.srcdir]
+        if len(idx)==0:
+            self.srcs.append(photon.srcdir)
+            idx = [len(self.srcs)-1]
+        self.add([photon.vec.ra()],[photon.vec.dec()],photon.energy,idx[0],weight=photon.weight,time=photon.time,
+                 event_class=photon.event_class,ct=photon.ct,sdiff=photon.sdiff)
+
+    ## return angular separations from the associated sources (radians)
+    def srcdiff(self):
+        return self.sdiff
+
+################################################# END PHOTONCOLUMNS CLASS ####################################################
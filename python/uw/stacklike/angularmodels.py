@@ -7,7 +7,7 @@ from uw.utilities.minuit import Minuit
 from uw.like import SpatialModels
 from uw.like.roi_extended import ExtendedSource
 from uw.utilities.convolution import AnalyticConvolution
-from uw.stacklike.CLHEP import HepRotation
+from uw.stacklike.CLHEP import HepRotation,PhotonColumns
 from uw.like import pypsf
 import numpy as np
 import pylab as py
@@ -31,6 +31,8 @@ rd = 180./np.pi
 #    Abstraction of angular distribution models
 class Model(object):
 
+    vectorized = False   #value and integrate accept a PhotonColumns container
+
     def __init__(self,model_par,free):
         self.par = model_par
         self.free = free
@@ -44,6 +46,9 @@ class Model(object):
 #  Models the angular distribution of a single King function for fitting width and tails
 
 class PSF(Model):
+
+    vectorized = True
+
     ## Constructor
     #
     #  @param lims [min,max], minimum and maximum angular deviations in radians
@@ -321,6 +326,8 @@ class PSFTheta(Model):
 #  Models the angular distribution of a single King function for fitting boresight alignment
 class PSFAlign(PSF):
 
+    vectorized = False
+
     ## Constructor
     #
     #  @param lims [min,max], minimum and maximum angular deviations in radians
@@ -397,6 +404,8 @@ class PSFAlign(PSF):
 #  Models the angular distribution of a single King function for fitting fisheye effect
 class PSFFish(PSF):
 
+    vectorized = False
+
     ## Constructor
     #
     #  @param lims [min,max], minimum and maximum angular deviations in radians
@@ -473,6 +482,9 @@ class PSFFish(PSF):
 #  Models the angular distribution of a double King function for fitting width and tails
 
 class PSFDouble(Model):
+
+    vectorized = True
+
     ## Constructor
     #
     #  @param lims [min,max], minimum and maximum angular deviations in radians
@@ -576,6 +588,8 @@ class PSFDouble(Model):
 # Manages uniform Isotropicround model
 class Isotropic(Model):
 
+    vectorized = True
+
     ## Constructor
     #
     #  @param lims [min,max], minimum and maximum angular deviations in radians
@@ -1196,6 +1210,8 @@ class Custom(Model):
 # Manages model of gaussian in 'd' (narrower than PSF)
 class Gaussian(Model):
 
+    vectorized = True
+
     ## Constructor
     #  @param lims [min,max], minimum and maximum angular deviations in radians
     #  @param model_par [theta], parameter to describe gaussian width in radians
@@ -1263,6 +1279,8 @@ class Gaussian(Model):
 # Manages model of gaussian halo (in d**2)
 class Halo(Model):
 
+    vectorized = True
+
     ## Constructor
     #  @param lims [min,max], minimum and maximum angular deviations in radians
     #  @param model_par [theta], parameter to describe gaussian width in radians
@@ -1361,7 +1379,7 @@ class CompositeModel(object):
     #  @param exp if free is set to [..False..], exp = [..Ni..], where Ni is the estimator for the number of photons in model i
     #  @param mode minuit fit strategy: 0-quick 1-normal 2-careful
     def fit(self,photons,free=[],exp=[],mode=1,quiet=True):
-        n = sum([x.weight for x in photons])
+        n = photons.weight.sum() if isinstance(photons,PhotonColumns) else sum([x.weight for x in photons])
         pars = []
         frees = []
         lims=[]
@@ -1418,7 +1436,7 @@ class CompositeModel(object):
 
     ## returns the extended likelihood of models and number estimators
     #  @param pars [N1...Nn,p11...,pnm] 'n' number estimators (N) with 'm' parameters (p)
-    #  @param photons list of CLHEP photons to fit to
+    #  @param photons list of CLHEP photons, or PhotonColumns, to fit to
     def extlikelihood(self,pars,photons,quiet=True):
         nest = pars[:len(self.models)]
         mpars = pars[len(self.models):]
@@ -1431,20 +1449,34 @@ class CompositeModel(object):
         # j is the jth photon
         # Ni is the number of photons associated with the ith model
         # model(j|pi) is the value of the ith model given the photon j and parameters pi
-        for photon in photons:
+        if isinstance(photons,PhotonColumns) and np.all([getattr(model,'vectorized',False) for model in self.models]):
+            #evaluate every photon at once from the separation column
             tacc = 0
             lastp = 0
             for i,model in enumerate(self.models):
                 prs = len(model.model_par)
-                f0 = model.value(photon,mpars[lastp:lastp+prs])
-                fint = model.integrate(photon,mpars[lastp:lastp+prs])
+                f0 = model.value(photons,mpars[lastp:lastp+prs])
+                fint = model.integrate(photons,mpars[lastp:lastp+prs])
                 tacc = tacc + nest[i]*f0/fint
                 lastp=lastp+prs
-
-            if tacc<0:
+            if np.any(tacc<0):
                 return np.Infinity
-            lterm = np.log(tacc) if tacc>=0 else 0
-            acc = acc - lterm*photon.weight
+            acc = acc - np.sum(np.log(tacc)*photons.weight)
+        else:
+            for photon in photons:
+                tacc = 0
+                lastp = 0
+                for i,model in enumerate(self.models):
+                    prs = len(model.model_par)
+                    f0 = model.value(photon,mpars[lastp:lastp+prs])
+                    fint = model.integrate(photon,mpars[lastp:lastp+prs])
+                    tacc = tacc + nest[i]*f0/fint
+                    lastp=lastp+prs
+
+                if tacc<0:
+                    return np.Infinity
+                lterm = np.log(tacc) if tacc>=0 else 0
+                acc = acc - lterm*photon.weight
         acc = acc + sum(nest)
         self.calls=self.calls+1
 
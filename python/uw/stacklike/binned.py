@@ -178,7 +178,7 @@ class CombinedLike(object):
                 sl.loadphotons(minroi,maxroi,emin,emax,tmin,tmax,ctype)
                 sl.getds()
                 photons = photons+len(sl.photons)
-                thetabar = thetabar+sum([p.ct for p in sl.photons])
+                thetabar = thetabar+sl.ctsum()
                 self.pulse_ons.append(np.array(cp.copy(sl.ds)))
                 if self.cache:
                     sl.spickle(self.cachedir+'%son%s.pickle'%(psr[0],tag))
@@ -194,7 +194,7 @@ class CombinedLike(object):
                 sl = StackLoader(name=psr[0]+'off',ctmin=self.ctmin,ctmax=self.ctmax,quiet=not self.veryverbose)
                 sl.loadphotons(minroi,maxroi,emin,emax,tmin,tmax,ctype)
                 photons = photons+len(sl.photons)
-                thetabar = thetabar+sum([p.ct for p in sl.photons])
+                thetabar = thetabar+sl.ctsum()
                 sl.getds()
                 self.pulse_offs.append(np.array(cp.copy(sl.ds)))
                 if self.cache:
@@ -223,7 +223,7 @@ class CombinedLike(object):
                 sl = StackLoader(name=lists,ctmin=self.ctmin,ctmax=self.ctmax,quiet=not self.veryverbose)
                 sl.loadphotons(minroi,maxroi,emin,emax,tmin,tmax,ctype)
                 photons = photons+len(sl.photons)
-                thetabar = thetabar+sum([p.ct for p in sl.photons])
+                thetabar = thetabar+sl.ctsum()
                 sl.getds()
                 self.agns.append(np.array(cp.copy(sl.ds)))
                 #sl.bindata()
@@ -14,7 +14,7 @@ import scipy.optimize as so
 import os as os
 from uw.like import pypsf
 from uw.stacklike.angularmodels import *
-from uw.stacklike.CLHEP import HepRotation,Hep3Vector,Photon
+from uw.stacklike.CLHEP import HepRotation,Hep3Vector,Photon,PhotonColumns
 from uw.stacklike.stcaldb import IrfLoader
 import uw.thb_roi.roi_factory as uf
 import copy as cp
@@ -201,6 +201,7 @@ class StackLoader(object):
 
             self.bpd = s.BinnedPhotonData(self.datadir+self.binfile)
             self.ebar = 0
+            photons = self.photon_columns()
             for bnd in self.bpd:
                 if cls ==0:
                     catchbad = bnd.event_class()==0 or bnd.event_class()==-2147483648
@@ -208,13 +209,14 @@ class StackLoader(object):
                     catchbad = bnd.event_class()==1
                 if bnd.emax()>self.emin and bnd.emin()<self.emax and (catchbad or cls==-1):
                     ebar = np.sqrt(bnd.emin()*bnd.emax())
-                    for src in self.srcs:
+                    for it,src in enumerate(self.srcs):
                         wsdl = s.WeightedSkyDirList(bnd,src,self.maxroi/rd)
-                        sds = len(wsdl)
-                        for wsd in wsdl:
-                            self.photons.append(Photon(wsd.ra(),wsd.dec(),ebar,0,cls,[],[],src,weight=wsd.weight()))
-                            self.ebar = self.ebar + wsd.weight()*ebar
-            pcnts = sum([x.weight for x in self.photons])
+                        if len(wsdl)==0:
+                            continue
+                        pix = np.array([[wsd.ra(),wsd.dec(),wsd.weight()] for wsd in wsdl])
+                        photons.add(pix[:,0],pix[:,1],ebar,it,weight=pix[:,2],event_class=cls)
+                        self.ebar = self.ebar + pix[:,2].sum()*ebar
+            pcnts = photons.weight.sum()
             self.photonscount = self.photoncount+pcnts
             if len(self.photons)==0:
                 print 'No photons!'
@@ -304,9 +306,30 @@ class StackLoader(object):
                 except:
                     print 'Failed GTI in file: %s'%self.ft2s[j]
                     gti = None
-                #iterate over events for photons
+                #without pointing information, fill the photon columns in bulk
+                if gti is not None and not self.useft2s:
+                    pcut = 0
+                    photons = self.photon_columns()
+                    if pass7:
+                        emsk = (tb.field('EVENT_CLASS') & self.dsel.eventclass)!=0
+                        pcut = len(tb)-emsk.sum()
+                        tb = tb[emsk]
+                    ras,decs = tb.field('RA').astype(float),tb.field('DEC').astype(float)
+                    times = tb.field('TIME')
+                    accept = self.gti_accept(gti,times)
+                    for it,src in enumerate(self.srcs):
+                        sdiff = photons.separation(ras,decs,it)
+                        msk = accept & (sdiff*rd<self.maxroi) & (sdiff*rd>self.minroi)
+                        if msk.sum()==0:
+                            continue
+                        energy = tb.field('ENERGY')[msk]
+                        photons.add(ras[msk],decs[msk],energy,it,time=times[msk],event_class=tb.field('CONVERSION_TYPE')[msk],
+                                    ct=np.cos(tb.field('THETA')[msk]/rd),sdiff=sdiff[msk])
+                        self.ebar = self.ebar+energy.sum()
+                        self.photoncount = self.photoncount + msk.sum()
 
-                if gti is not None and ((phist is not None and self.useft2s) or not self.useft2s):
+                #iterate over events for photons
+                elif gti is not None and phist is not None:
                     pcut = 0
                     for k in range(len(tb)):
                         event = tb[k]
@@ -361,6 +384,32 @@ class StackLoader(object):
 
                 #raise 'No Photons!'
 
+    ## boolean array, True for the times inside an interval [start,stop) of the Gti, as Gti.accept
+    #   @param gti skymaps.Gti, with disjoint intervals
+    #   @param times array of event times
+    @staticmethod
+    def gti_accept(gti,times):
+        intervals = np.asarray([(x.minValue(),x.maxValue()) for x in gti],dtype=float).reshape(-1,2)
+        starts,stops = intervals[np.argsort(intervals[:,0])].T
+        times = np.asarray(times,dtype=float)
+        k = np.searchsorted(starts,times,side='right')-1
+        return (k>=0) & (times<stops[np.maximum(k,0)])
+
+    ## returns self.photons as a PhotonColumns container, converting any Photon objects already loaded
+    def photon_columns(self):
+        if not isinstance(self.photons,PhotonColumns):
+            photons = PhotonColumns(self.srcs)
+            for photon in self.photons:
+                photons.append(photon)
+            self.photons = photons
+        return self.photons
+
+    ## returns the sum of cos(theta) over all loaded photons
+    def ctsum(self):
+        if isinstance(self.photons,PhotonColumns):
+            return self.photons.ct.sum()
+        return sum([p.ct for p in self.photons])
+
     ## Bins all of the angular separations together in separation
     def bindata(self):
         self.getds()
@@ -1571,6 +1620,13 @@ class StackLoader(object):
     #sets angular deviations
     def getds(self):
         if self.ds==[]:
+            if isinstance(self.photons,PhotonColumns):
+                u = self.photons.srcdiff()
+                if self.dsel.binfile is not None:
+                    self.ds = np.repeat(u,self.photons.weight.astype(int))
+                else:
+                    self.ds = u.copy()
+                return
             for photon in self.photons:
                 if self.dsel.binfile is not None:
                     u = photon.srcdiff()
@@ -13,9 +13,40 @@ from scipy.integrate import quad,romberg,cumtrapz
 from scipy.special import hyp2f1
 from uw.like.pypsf import BandCALDBPsf,PretendBand
 from uw.like.SpatialModels import SpatialMap
-from numpy.fft import fftshift,ifft2,fft2
+from numpy.fft import rfft2,irfft2
+from collections import OrderedDict
 import keyword_options
 
+# spectra of the normalized PSF kernels, keyed by (id of the IRF, energy, event type, npix, pixelsize);
+# shared by all grids, so a kernel is transformed once per band rather than once per ROI and source
+kernel_cache = OrderedDict()
+kernel_cache_size = 200
+
+def kernel_spectrum(psf_vals):
+    """ Return the real FFT of a PSF kernel evaluated on a grid, rolled such that the
+        convolved image is aligned with the input grid."""
+    shift = [n//2+1 for n in psf_vals.shape]
+    return rfft2(np.roll(np.roll(psf_vals,shift[0],axis=0),shift[1],axis=1))
+
+def cached_kernel(key,fill,irf=None):
+    """ Return a tuple (psf_vals, spectrum) for the kernel identified by key.
+        fill -- a function returning the normalized kernel values, called only on a cache miss
+        irf  -- the object that defines the PSF, e.g., a PSF manager. The key is combined with
+                its id, and the entry keeps a reference to it, so that the id is not reused.
+        If key or irf is None, the cache is not used."""
+    if key is None or irf is None:
+        psf_vals = fill()
+        return psf_vals,kernel_spectrum(psf_vals)
+    key = (id(irf),)+tuple(key)
+    if key in kernel_cache:
+        kernel_cache[key] = t = kernel_cache.pop(key) # mark as most recently used
+        return t[:2]
+    psf_vals = fill()
+    kernel_cache[key] = t = (psf_vals,kernel_spectrum(psf_vals),irf)
+    while len(kernel_cache) > kernel_cache_size:
+        kernel_cache.popitem(last=False)
+    return t[:2]
+
 ### TODO -- find a way to evaluate the PSF on a finer grid ###
 
 class Grid(object):
@@ -194,29 +225,36 @@ class BackgroundConvolution(Grid):
 
         pb = PretendBand(energy,conversion_type)
         bpsf = BandCALDBPsf(self.psf,pb,override_en=override_en,adjust_mean=False)
-        self.psf_fill(bpsf)
+        self.psf_fill(bpsf,key=(energy,conversion_type,override_en,self.npix,self.pixelsize),irf=self.psf)
         self.convolve()
 
 
-    def psf_fill(self,psf):
-        """ Evaluate a band psf over the grid."""
-        psf_vals = psf(self.dists,density=True).reshape([self.npix,self.npix])
-        self.psf_vals = psf_vals / psf_vals.sum()
+    def psf_fill(self,psf,key=None,irf=None):
+        """ Evaluate a band psf over the grid.
+            key, irf -- if not None, identify the kernel in the module kernel cache"""
+        def fill():
+            psf_vals = psf(self.dists,density=True).reshape([self.npix,self.npix])
+            return psf_vals / psf_vals.sum()
+        self.set_kernel(*cached_kernel(key,fill,irf))
         #self.psf_vals = psf_vals*np.radians(self.pixelsize)**2
 
+    def set_kernel(self,psf_vals,spectrum=None):
+        """ Set the normalized psf values, and optionally their spectrum from kernel_spectrum."""
+        self.psf_vals = psf_vals
+        self._kernel = (psf_vals, spectrum if spectrum is not None else kernel_spectrum(psf_vals))
+
+    def kernel_spectrum(self):
+        """ The spectrum of the current psf_vals, recalculated if psf_vals has been replaced."""
+        kernel = getattr(self,'_kernel',None)
+        if kernel is None or kernel[0] is not self.psf_vals:
+            self.set_kernel(self.psf_vals)
+        return self._kernel[1]
+
     def convolve(self):
         """ Perform the convolution with the current values of the bg
             and psf evaluated over the grid."""
-        fft_kernel = fft2(self.psf_vals)
-        fft_image  = fft2(self.bg_vals)
-        self.cvals = c = np.real(fftshift(ifft2(fft_kernel*fft_image)))
-
-        # swap the 0th component into the proper place
-        new = np.empty_like(c)
-        new[0,:]  = c[-1,:]
-        new[1:,:] = c[:-1,:]
-        c[:,0]  = new[:,-1]
-        c[:,1:] = new[:,:-1]
+        bg_vals = np.asarray(self.bg_vals,dtype=float)
+        self.cvals = irfft2(rfft2(bg_vals)*self.kernel_spectrum(),s=bg_vals.shape)
 
     def ap_average(self,radius,convolved=True):
         """ Estimate the average of the background over a radial aperture by
@@ -0,0 +1,57 @@
+"""
+Evaluate a function for a list of tasks in a local pool of worker processes
+
+The workers are forked, so they share, read-only, the objects that exist when the pool is created.
+A task function gets such an object, e.g., an ROI or a fitter, with context(), rather than having it
+pickled with each task. The pool is always shut down, and its workers reaped, even if the caller
+stops early or an exception is raised.
+"""
+import multiprocessing
+
+_context = None
+
+def context():
+    """ return the context object passed to imap, in the process running a task"""
+    return _context
+
+def imap(function, tasks, processes=1, context=None, ordered=True, chunksize=1, maxtasksperchild=None):
+    """ generator of function(task) for each task
+
+    function : function of a task
+        must be defined at module level, to be passed to the workers
+    tasks : list of arguments for function
+    processes : int | None
+        number of worker processes; if None, the number of cores. If 1, or only one task, the tasks are
+        evaluated here
+    context : object
+        returned by the module function context() while the tasks are evaluated
+    ordered : bool
+        if False, the results are generated as they are completed, so the function should return
+        something identifying the task
+    chunksize, maxtasksperchild : passed to multiprocessing.Pool
+
+    If the generator is closed before all the results are generated, the workers are terminated:
+    a caller that may stop early, or fail, should close it, e.g., in a finally clause.
+    """
+    global _context
+    tasks = list(tasks)
+    saved, _context = _context, context
+    try:
+        if processes==1 or len(tasks)<2:
+            for task in tasks:
+                yield function(task)
+            return
+        pool = multiprocessing.Pool(processes, maxtasksperchild=maxtasksperchild)
+        try:
+            results = pool.imap(function, tasks, chunksize) if ordered \
+                else pool.imap_unordered(function, tasks, chunksize)
+            for result in results:
+                yield result
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+    finally:
+        _context = saved